@@ -0,0 +1,32 @@
+from typing import Any, List
+
+from config_loader.execution_context import ExecutionContext
+from config_loader.models import BaseStepModel, validate_workflow
+from config_loader.steps import StepFactory
+from logger_manager import LoggerMixin
+
+class CompiledWorkflow(LoggerMixin):
+    """
+    Workflow validated and instantiated once, to be run for every query.
+    The go_to targets are resolved with a jump table built at compile time.
+    """
+    def __init__(self, workflow: List[BaseStepModel], **kwargs):
+        super().__init__()
+        validate_workflow(workflow)
+        self.steps = [StepFactory.create(s, **kwargs) for s in workflow]
+        self.jump_table = {s.id: index for index, s in enumerate(workflow)}
+
+    def run(self, execution: ExecutionContext) -> Any:
+        current_step_index = 0
+        output = None
+
+        while current_step_index < len(self.steps):
+            output = self.steps[current_step_index].run(execution)
+
+            if isinstance(output, dict) and "go_to" in output:
+                current_step_index = self.jump_table[output["go_to"]]
+                continue
+
+            current_step_index += 1
+
+        return output
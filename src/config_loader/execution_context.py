@@ -0,0 +1,44 @@
+from typing import Any, Callable, Optional
+
+
+class ExecutionContext():
+    """
+    State of a single run of the workflow: its variables, its memory of steps, its deadline and the callback
+    that receives the text of the streamed steps. The compiled steps are shared by all the runs, so everything
+    that changes during a run lives here.
+    """
+    def __init__(self, context: Optional[dict[str, Any]] = None, deadline: Optional[float] = None, parent: Optional["ExecutionContext"] = None, on_token: Optional[Callable[[str], None]] = None) -> None:
+        self.context = context if context is not None else {}
+        self.step_results = []
+        self.deadline = deadline
+        self.parent = parent
+        self.on_token = on_token
+
+    def add_to_memory(self, name:str, description:str, result:str):
+        self.step_results.append(
+            {
+                "name": name,
+                "description": description,
+                "result": result,
+            }
+        )
+
+    def add_to_context(self, key:str, value:Any):
+        self.context[key] = value
+
+    def get_memory(self) -> list[dict]:
+        inherited_memory = self.parent.get_memory() if self.parent else []
+        return inherited_memory + self.step_results
+
+    def format_memory(self):
+        return "".join(
+            f"Paso {i}: {step['name']}\nDescripción: {step['description']}\nResultado: {step['result']}\n\n"
+            for i, step in enumerate(self.get_memory(), 1)
+        )
+
+    def create_child(self) -> "ExecutionContext":
+        """Returns a context with a copy of the variables, so it can be modified without affecting this one."""
+        return ExecutionContext(dict(self.context), self.deadline, parent=self, on_token=self.on_token)
+
+    def merge_memory(self, child: "ExecutionContext"):
+        self.step_results.extend(child.step_results)
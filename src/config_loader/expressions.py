@@ -0,0 +1,64 @@
+import ast
+from functools import lru_cache
+from typing import Any
+
+class ExpressionError(ValueError):
+    pass
+
+class Expression():
+    """
+    Python expression of the DSL (if conditions, set_variable sources, evaluate conditions), parsed and compiled once.
+    Only a restricted subset of Python is accepted: context variables, constants, attribute and subscript access,
+    boolean, comparison and arithmetic operators, and calls to a few whitelisted functions.
+    """
+    ALLOWED_FUNCTIONS = {
+        "len": len,
+        "str": str,
+        "int": int,
+        "float": float,
+        "bool": bool,
+        "any": any,
+        "all": all,
+        "min": min,
+        "max": max,
+    }
+
+    ALLOWED_NODES = (
+        ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+        ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+        ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+        ast.IfExp, ast.Name, ast.Load, ast.Constant, ast.Attribute, ast.Subscript, ast.Slice,
+        ast.List, ast.Tuple, ast.Call,
+    )
+
+    def __init__(self, source: str):
+        self.source = source
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ExpressionError(f"Invalid expression \"{source}\": {e.msg}") from e
+        self._validate(tree)
+        self.names = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - self.ALLOWED_FUNCTIONS.keys())
+        self.code = compile(tree, f"<expression {source}>", "eval")
+        self.globals = {"__builtins__": {}, **self.ALLOWED_FUNCTIONS}
+
+    def _validate(self, tree: ast.AST):
+        for node in ast.walk(tree):
+            if not isinstance(node, self.ALLOWED_NODES):
+                raise ExpressionError(f"Invalid expression \"{self.source}\": {type(node).__name__} is not allowed.")
+            if isinstance(node, ast.Name) and node.id.startswith("_"):
+                raise ExpressionError(f"Invalid expression \"{self.source}\": name \"{node.id}\" is not allowed.")
+            if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+                raise ExpressionError(f"Invalid expression \"{self.source}\": attribute \"{node.attr}\" is not allowed.")
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in self.ALLOWED_FUNCTIONS):
+                raise ExpressionError(f"Invalid expression \"{self.source}\": only the functions {list(self.ALLOWED_FUNCTIONS)} can be called.")
+
+    def evaluate(self, context: dict[str, Any]) -> Any:
+        return eval(self.code, self.globals, context)
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+@lru_cache(maxsize=None)
+def compile_expression(source: str) -> Expression:
+    return Expression(source)
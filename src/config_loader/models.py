@@ -1,13 +1,18 @@
 from enum import Enum
 from pathlib import Path
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import List, Literal, Optional, Union
 from llama_index.core.vector_stores.types import VectorStoreInfo, MetadataInfo
 
+from config_loader.expressions import compile_expression
+from config_loader.templates import Template, compile_template
+
 class ExecuteMode(str, Enum):
     # CHAT = 'chat'
     EVALUATE = 'evaluate'
     NORMAL = 'normal'
+    SERVE = 'serve'
+    BATCH = 'batch'
 
 class LLMConfig(BaseModel):
     base_url: Optional[str] = None
@@ -15,9 +20,14 @@ class LLMConfig(BaseModel):
     request_timeout: Optional[float] = Field(default=None, ge=0.0)
     system_prompt: Optional[str] = None
     temperature: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    # Local Ollama model for the chunk embeddings (e.g. "nomic-embed-text")
+    embedding_model_name: Optional[str] = None
+    # Whether the model writes its reasoning between <think> tags, which is removed from its responses.
+    # None keeps the default of the model (see MODELS_WITH_THINKING)
+    thinking: Optional[bool] = None
     
     def model_dump_for_create_llm(self):
-        data = self.model_dump(exclude_none=True, exclude={"embedding_model_name"})
+        data = self.model_dump(exclude_none=True, exclude={"embedding_model_name", "thinking"})
         data['model'] = data.pop('model_name')
         
         return data
@@ -28,9 +38,40 @@ class LLMConfig(BaseModel):
         return data
 
 
+class StructuredOutputConfig(BaseModel):
+    max_attempts: int = Field(default=5, gt=0)
+    # Seconds to wait after the first failed attempt, multiplied by backoff_factor after each one
+    initial_backoff: float = Field(default=0.5, ge=0.0)
+    backoff_factor: float = Field(default=2.0, ge=1.0)
+    max_backoff: float = Field(default=8.0, ge=0.0)
+    # Seconds available for a single structured output call (all its attempts)
+    time_budget: Optional[float] = Field(default=None, gt=0.0)
+    # Seconds available for all the structured output calls of a query
+    query_time_budget: Optional[float] = Field(default=None, gt=0.0)
+
+class CompletionCacheConfig(BaseModel):
+    max_entries: int = Field(default=1024, gt=0)
+    # If set, completions are also persisted in this SQLite file
+    sqlite_path: Optional[str] = None
+
+class ServerConfig(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = Field(default=8080, gt=0, lt=65536)
+    # Queries answered at the same time, and queries that can wait for them before answering 429
+    max_concurrency: int = Field(default=4, gt=0)
+    max_queue_size: int = Field(default=16, ge=0)
+    # Maximum seconds to answer a query (a request can ask for less)
+    request_timeout: float = Field(default=600.0, gt=0.0)
+    # Seconds to wait for the queries in progress when the server stops
+    shutdown_timeout: float = Field(default=60.0, ge=0.0)
+
 class GeneralConfig(BaseModel):
     execute_mode: ExecuteMode
     llm: LLMConfig
+    structured_output: StructuredOutputConfig = StructuredOutputConfig()
+    completion_cache: Optional[CompletionCacheConfig] = None
+    # HTTP API of the "serve" mode
+    server: ServerConfig = ServerConfig()
 
 class EvaluationConfig(BaseModel):
     questions_file_path: str
@@ -38,6 +79,14 @@ class EvaluationConfig(BaseModel):
     answers_file_path: str
     results_folder_path: str
     reports_folder_path: str
+    max_workers: Optional[int] = 1
+
+class BatchConfig(BaseModel):
+    # .txt with one question per line or .jsonl with {"query": ..., "id": ...} per line
+    questions_file_path: str
+    # JSONL with one answer per line, appended as they are ready
+    answers_file_path: str
+    max_workers: Optional[int] = Field(default=1, gt=0)
 
 class LogConfig(BaseModel):
     log_level : Literal['INFO', 'WARN', "ERROR", "DEBUG", "CRITICAL"]
@@ -49,10 +98,39 @@ class MetadataConfig(VectorStoreInfo):
     # class Config:
     #     allow_population_by_field_name = True
 
+class MetadataExtractionConfig(BaseModel):
+    # "per_field": one LLM call per field. "single_call": all fields in one call, re-asking only the invalid ones
+    mode: Literal["per_field", "single_call"] = "per_field"
+    # Maximum number of requests in flight against the LLM server
+    max_concurrency: int = Field(default=1, gt=0)
+
+class ChunksConfig(BaseModel):
+    chunk_size: int = Field(default=512, gt=0)
+    chunk_overlap: int = Field(default=50, ge=0)
+    # .npz file where the chunk vectors are persisted between runs
+    index_path: Optional[str] = None
+
 class DataProcessingConfig(BaseModel):
     data_folder_path: str
+    # Folder with the manifest and the texts of the parsed PDFs, so only new or changed PDFs are parsed
+    document_store_path: Optional[str] = None
+    # Processes parsing the PDFs (None uses one per CPU)
+    ingestion_max_workers: Optional[int] = Field(default=None, gt=0)
     metadata_config: MetadataConfig
-    # chunks_config: ChunksConfig
+    metadata_cache_path: Optional[str] = None
+    # JSON file where the term counts of the BM25 index are persisted between runs
+    bm25_index_path: Optional[str] = None
+    metadata_extraction: MetadataExtractionConfig = MetadataExtractionConfig()
+    # Vector index over the chunks of the documents, needed by the "retrieve" steps
+    chunks_config: Optional[ChunksConfig] = None
+    # Seconds between checks of the data folder for new, modified or deleted PDFs in "normal" mode (None disables it)
+    watch_interval: Optional[float] = Field(default=None, gt=0.0)
+
+    @model_validator(mode="after")
+    def check_watch_interval(self):
+        if self.watch_interval and not self.document_store_path:
+            raise ValueError("watch_interval needs document_store_path.")
+        return self
 
 
 class BaseStepModel(BaseModel):
@@ -68,12 +146,27 @@ class IfStepModel(BaseStepModel):
     if_true: "StepModel"
     if_false: Optional["StepModel"] = None
 
+    @field_validator("condition")
+    @classmethod
+    def check_condition(cls, value: str) -> str:
+        compile_expression(value)
+        return value
+
 class LLMCallStepModel(BaseStepModel):
     step_type: Literal["llm_call"]
     prompt: str
     json_output: Optional[bool] = False
+    cache: Optional[bool] = False
+    # Sends the response to the token callback of the run as it is generated (e.g. the final response)
+    stream: Optional[bool] = False
     output: str
 
+    @model_validator(mode="after")
+    def check_stream(self):
+        if self.stream and self.json_output:
+            raise ValueError(f"The step '{self.id}' cannot stream a JSON output.")
+        return self
+
 class FormatDocumentsActionStepModel(BaseStepModel):
     step_type: Literal["action"]
     action: Literal["format_documents"]
@@ -92,6 +185,27 @@ class ApplyFiltersActionStepModel(BaseStepModel):
     inputs: List[str]
     output: str
 
+class MatchNamesActionStepModel(BaseStepModel):
+    step_type: Literal["action"]
+    action: Literal["match_names"]
+    inputs: List[str]
+    min_score: Optional[float] = Field(default=0.6, ge=0.0, le=1.0)
+    output: str
+
+class RetrieveActionStepModel(BaseStepModel):
+    step_type: Literal["action"]
+    action: Literal["retrieve"]
+    inputs: List[str]
+    top_k: Optional[int] = Field(default=3, gt=0)
+    output: str
+
+class SelectRelevantDocumentsActionStepModel(BaseStepModel):
+    step_type: Literal["action"]
+    action: Literal["select_relevant_documents"]
+    inputs: List[str]
+    top_k: Optional[int] = Field(default=5, gt=0)
+    output: str
+
 class CheckTermsInTextActionStepModel(BaseStepModel):
     step_type: Literal["action"]
     action: Literal["check_terms_in_text"]
@@ -107,12 +221,20 @@ class SetVariableStepModel(BaseStepModel):
     source: str
     output: str
 
+    @field_validator("source")
+    @classmethod
+    def check_source(cls, value: str) -> str:
+        compile_expression(value)
+        return value
+
 class ForEachStepModel(BaseStepModel):
     step_type: Literal["for_each"]
     iterate_obj: str
     step: "StepModel"
     collected_field: Optional[str] = None
     output: Optional[str] = None
+    parallel: Optional[bool] = False
+    max_concurrency: Optional[int] = 4
 
 class FormatListActionStepModel(BaseStepModel):
     step_type: Literal["action"]
@@ -142,7 +264,14 @@ class EvaluateActionStepModel(BaseStepModel):
     condition:str
     prompt: str
     json_output: Optional[bool] = False
+    cache: Optional[bool] = False
     output: str
+
+    @field_validator("condition")
+    @classmethod
+    def check_condition(cls, value: str) -> str:
+        compile_expression(value)
+        return value
     
 StepModel = Union[
     LLMCallStepModel, 
@@ -151,6 +280,9 @@ StepModel = Union[
     CompositeStepModel, 
     IfStepModel, 
     ApplyFiltersActionStepModel, 
+    MatchNamesActionStepModel,
+    RetrieveActionStepModel,
+    SelectRelevantDocumentsActionStepModel,
     CheckTermsInTextActionStepModel,
     GoToStepModel,
     SetVariableStepModel,
@@ -165,13 +297,73 @@ CompositeStepModel.model_rebuild()
 IfStepModel.model_rebuild()
 ForEachStepModel.model_rebuild()
 
+def get_nested_step_models(model: BaseStepModel) -> List[BaseStepModel]:
+    """Returns the step model and all the step models nested in it."""
+    if isinstance(model, CompositeStepModel):
+        children = model.steps
+    elif isinstance(model, IfStepModel):
+        children = [model.if_true] + ([model.if_false] if model.if_false else [])
+    elif isinstance(model, (ForEachStepModel, EvaluateActionStepModel)):
+        children = [model.step]
+    else:
+        children = []
+    return [model] + [m for child in children for m in get_nested_step_models(child)]
+
+def get_step_templates(model: BaseStepModel) -> List[Template]:
+    """Returns the compiled templates of a step model (not the ones of its nested steps)."""
+    if isinstance(model, LLMCallStepModel):
+        return [compile_template(model.prompt, "safe")]
+    elif isinstance(model, EvaluateActionStepModel):
+        return [compile_template(model.prompt, "format")]
+    elif isinstance(model, AddToMemoryActionStepModel):
+        return [compile_template(model.result, "format")]
+    elif isinstance(model, FormatListActionStepModel):
+        return [compile_template(model.format_template, "format")]
+    return []
+
+def validate_workflow(workflow: List[BaseStepModel]):
+    """
+    Checks that the top level step ids are unique, that every go_to jumps to one of them
+    and that the templates only use variables that some step (or the executor) defines.
+    """
+    step_ids = set()
+    for s in workflow:
+        if s.id in step_ids:
+            raise ValueError(f"Duplicated step id '{s.id}' in the workflow.")
+        step_ids.add(s.id)
+
+    step_models = [nested for s in workflow for nested in get_nested_step_models(s)]
+    defined_variables = {"documents", "query", "item"}
+    for model in step_models:
+        defined_variables.update(v for v in (getattr(model, "output", None), getattr(model, "collected_field", None)) if v)
+
+    for model in step_models:
+        if isinstance(model, GoToStepModel) and model.target_id not in step_ids:
+            raise ValueError(f"Destination step '{model.target_id}' of the step '{model.id}' not found.")
+        for template in get_step_templates(model):
+            missing_variables = [v for v in template.variables if v not in defined_variables]
+            if missing_variables:
+                raise ValueError(f"Variables {missing_variables} used in the step '{model.id}' are not defined by any step.")
+
 class AppConfig(BaseModel):
     log: LogConfig
     general: GeneralConfig
     evaluation_config: EvaluationConfig
+    batch_config: Optional[BatchConfig] = None
     data_processing: DataProcessingConfig
     workflow: List[StepModel]
 
+    @model_validator(mode="after")
+    def check_workflow(self):
+        validate_workflow(self.workflow)
+        if self.general.execute_mode == ExecuteMode.BATCH and self.batch_config is None:
+            raise ValueError("The batch mode needs batch_config.")
+        if self.data_processing.chunks_config is None:
+            retrieve_steps = [m.id for s in self.workflow for m in get_nested_step_models(s) if isinstance(m, RetrieveActionStepModel)]
+            if retrieve_steps:
+                raise ValueError(f"The steps {retrieve_steps} need the chunk index: set data_processing.chunks_config.")
+        return self
+
 class FullConfig(BaseModel):
     app: AppConfig
 
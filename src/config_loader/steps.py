@@ -1,53 +1,71 @@
 from abc import ABC, abstractmethod
-import re
-from typing import Any, Callable
-from llama_index.core.prompts.utils import format_string
-
-from config_loader.models import AddToMemoryActionStepModel, ApplyFiltersActionStepModel, BaseStepModel, CheckTermsInTextActionStepModel, CompositeStepModel, EvaluateActionStepModel, ForEachStepModel, FormatDocumentsActionStepModel, FormatListActionStepModel, FormatMemoryActionStepModel, GoToStepModel, IfStepModel, LLMCallStepModel, MetadataConfig, SetVariableStepModel, FormatDocumentActionStepModel
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any
+
+from config_loader.execution_context import ExecutionContext
+from config_loader.expressions import compile_expression
+from config_loader.templates import compile_template
+from data_processors.bm25_index import BM25Index
+from data_processors.chunk_index import ChunkIndex
+from data_processors.metadata_index import MetadataIndex
+from data_processors.name_index import NameIndex
+from config_loader.models import AddToMemoryActionStepModel, ApplyFiltersActionStepModel, BaseStepModel, CheckTermsInTextActionStepModel, CompositeStepModel, EvaluateActionStepModel, ForEachStepModel, FormatDocumentsActionStepModel, FormatListActionStepModel, FormatMemoryActionStepModel, GoToStepModel, IfStepModel, LLMCallStepModel, MatchNamesActionStepModel, MetadataConfig, RetrieveActionStepModel, SelectRelevantDocumentsActionStepModel, SetVariableStepModel, FormatDocumentActionStepModel
 from logger_manager import LoggerMixin
+from utils.completion_cache import CompletionCache
 from utils.utils import Utils
 
 class Step(ABC, LoggerMixin):
-    def __init__(self, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], ):
+    """
+    Step of a compiled workflow. Steps are created once and shared by every run,
+    so they must not keep any state of a run: it is read from and written to the ExecutionContext.
+    """
+    def __init__(self):
         super().__init__()
-        self.global_context = global_context
-        self.add_to_context = add_to_context
 
     @abstractmethod
-    def run(self):
+    def run(self, execution: ExecutionContext):
         pass
 
 class LLMCallStep(Step):
-    def __init__(self, model:LLMCallStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], llm_call, json_llm_call):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:LLMCallStepModel, llm_call, json_llm_call, stream_llm_call = None):
+        super().__init__()
         self.model = model
         self.llm_call = llm_call
         self.json_llm_call = json_llm_call
+        self.stream_llm_call = stream_llm_call
+        self.use_cache = bool(self.model.cache)
+        self.prompt = compile_template(self.model.prompt, "safe")
+
+    def run(self, execution: ExecutionContext, refresh_cache: bool = False):
+        """With `refresh_cache`, a cached step does not read the cache but stores the new output."""
+        use_cache = CompletionCache.REFRESH if refresh_cache and self.use_cache else self.use_cache
+        formatted_prompt = self.prompt.render(execution.context)
 
-    def run(self):
-        selected_llm_call = self.json_llm_call if self.model.json_output else self.llm_call
-        
-        formatted_prompt = format_string(self.model.prompt, **self.global_context)
-        
         self.logger.info(f"Prompt. Step \"{self.model.id}\": {formatted_prompt}")
-        result = selected_llm_call(formatted_prompt)
+        if self.model.json_output:
+            result = self.json_llm_call(formatted_prompt, label=self.model.id, use_cache=use_cache, deadline=execution.deadline)
+        elif self.model.stream and self.stream_llm_call is not None and execution.on_token is not None:
+            result = self.stream_llm_call(formatted_prompt, execution.on_token, use_cache=use_cache)
+        else:
+            result = self.llm_call(formatted_prompt, use_cache=use_cache)
         self.logger.info(f"Output. Step \"{self.model.id}\": {str(result)}")
 
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
 
 class FormatDocumentsActionStep(Step):
-    def __init__(self, model:FormatDocumentsActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], metadata_config:MetadataConfig):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:FormatDocumentsActionStepModel, metadata_config:MetadataConfig):
+        super().__init__()
         self.metadata_config = metadata_config
         self.model = model
-        self.documents = self.global_context.get(self.model.inputs[0])
 
-    def run(self):
+    def run(self, execution: ExecutionContext):
+        documents = execution.context.get(self.model.inputs[0])
         documents_str = []
-        for document in self.documents:
+        for document in documents:
             doc_filename = document.metadata["file_name"]
             metadata_str = []
             for k, v in document.metadata.items():
@@ -58,29 +76,29 @@ class FormatDocumentsActionStep(Step):
                         metadata_str.append(f"{k}({Utils.get_metadata_info(self.metadata_config, k).description}):\n{list_str}")
                     else:
                         metadata_str.append(f"{k}({Utils.get_metadata_info(self.metadata_config, k).description}): {v}")
-            
+
             metadata_str = "\n".join(metadata_str)
             document_str = f"<<<Documento {doc_filename}:\n {metadata_str}>>>"
             documents_str.append(document_str)
 
-        
+
         result = "\n".join(documents_str)
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
-        
+
 class FormatDocumentActionStep(Step):
-    def __init__(self, model:FormatDocumentActionStepModel, global_context, add_to_context:Callable[[str, Any], None], metadata_config:MetadataConfig):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:FormatDocumentActionStepModel, metadata_config:MetadataConfig):
+        super().__init__()
         self.metadata_config = metadata_config
         self.model = model
-        self.document = self.global_context.get(self.model.inputs[0])
 
-    def run(self):
-        doc_filename = self.document.metadata["file_name"]
+    def run(self, execution: ExecutionContext):
+        document = execution.context.get(self.model.inputs[0])
+        doc_filename = document.metadata["file_name"]
         metadata_str = []
-        for k, v in self.document.metadata.items():
+        for k, v in document.metadata.items():
             if k != "file_name":
                 metadata_info = Utils.get_metadata_info(self.metadata_config, k)
                 if metadata_info.type == "list":
@@ -88,431 +106,444 @@ class FormatDocumentActionStep(Step):
                     metadata_str.append(f"{k}({Utils.get_metadata_info(self.metadata_config, k).description}):\n{list_str}")
                 else:
                     metadata_str.append(f"{k}({Utils.get_metadata_info(self.metadata_config, k).description}): {v}")
-        
+
         metadata_str = "\n".join(metadata_str)
         document_str = f"<<<Documento {doc_filename}:\n {metadata_str}>>>"
 
         result = document_str
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
-    
+
 class CompositeStep(Step):
-    def __init__(
-        self, 
-        model:CompositeStepModel, 
-        global_context: dict[str, Any], 
-        add_to_context:Callable[[str, Any], None], 
-        llm_call, 
-        json_llm_call, 
-        metadata_config:MetadataConfig, 
-        add_to_memory, 
-        format_memory
-    ):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:CompositeStepModel, **kwargs):
+        super().__init__()
         self.model = model
-        # self.local_context = {}
-        self.llm_call = llm_call
-        self.json_llm_call = json_llm_call
-        self.metadata_config = metadata_config
-        self.add_to_memory = add_to_memory
-        self.format_memory = format_memory
-
-    def run(self):
-        for s in self.model.steps:
-            step = StepFactory.create(
-                s, 
-                # global_context = self.global_context | self.local_context, 
-                global_context = self.global_context,
-                add_to_context = self.add_to_context,
-                llm_call = self.llm_call, 
-                json_llm_call = self.json_llm_call,
-                metadata_config = self.metadata_config,
-                add_to_memory = self.add_to_memory,
-                format_memory = self.format_memory
-            )
-            output = step.run()
+        self.steps = [StepFactory.create(s, **kwargs) for s in self.model.steps]
+
+    def run(self, execution: ExecutionContext):
+        output = None
+        for step in self.steps:
+            output = step.run(execution)
 
             if isinstance(output, dict) and "go_to" in output:
                 return output
-            
+
         return output
-    
+
 class IfStep(Step):
-    def __init__(self, model:IfStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], llm_call, json_llm_call, metadata_config, add_to_memory, format_memory):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:IfStepModel, **kwargs):
+        super().__init__()
         self.model = model
-        self.llm_call = llm_call
-        self.json_llm_call = json_llm_call
-        self.metadata_config = metadata_config
-        self.add_to_memory = add_to_memory
-        self.format_memory = format_memory
+        self.condition = compile_expression(self.model.condition)
+        self.if_true = StepFactory.create(self.model.if_true, **kwargs)
+        self.if_false = StepFactory.create(self.model.if_false, **kwargs) if self.model.if_false else None
 
-    def run(self):
-        condition = self.model.condition
+    def run(self, execution: ExecutionContext):
         output = None
-        isTrue = self.evaluate_condition(condition, self.global_context)
-        s = self.model.if_true if isTrue else self.model.if_false  
-
-        if s:
-            step = StepFactory.create(
-                s, 
-                global_context = self.global_context,
-                add_to_context = self.add_to_context,
-                llm_call = self.llm_call, 
-                json_llm_call = self.json_llm_call,
-                metadata_config = self.metadata_config,
-                add_to_memory = self.add_to_memory,
-                format_memory = self.format_memory
-            )
-            output = step.run()
+        isTrue = self.evaluate_condition(execution.context)
+        step = self.if_true if isTrue else self.if_false
+
+        if step:
+            output = step.run(execution)
 
             if isinstance(output, dict) and "go_to" in output:
                 return output
-    
+
         return output
 
-    def evaluate_condition(self, condition: str, context: dict[str, Any]) -> bool:
+    def evaluate_condition(self, context: dict[str, Any]) -> bool:
         try:
-            return eval(condition, {}, context)
+            return self.condition.evaluate(context)
         except Exception as e:
             self.logger.error(f"Error evaluating if condition in the step \"{self.model.id}\": {e}")
             return False
 
-class ApplyFiltersActionStep(Step):
-    def __init__(self, model:ApplyFiltersActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None]):
-        super().__init__(global_context, add_to_context)
+class MetadataIndexStep(Step):
+    """Step that works with the metadata index of the documents."""
+    def __init__(self, metadata_index:MetadataIndex = None):
+        super().__init__()
+        self.metadata_index = metadata_index
+
+    def get_metadata_index(self, documents) -> MetadataIndex:
+        if self.metadata_index is not None and self.metadata_index.covers(documents):
+            return self.metadata_index
+        # The documents are not the indexed ones (e.g. the output of a previous filter)
+        return MetadataIndex(documents)
+
+class ApplyFiltersActionStep(MetadataIndexStep):
+    def __init__(self, model:ApplyFiltersActionStepModel, metadata_index:MetadataIndex = None):
+        super().__init__(metadata_index)
         self.model = model
-        self.documents = self.global_context.get(self.model.inputs[0])
-        self.filters = self.group_filters()
 
-    def group_filters(self):
+    def group_filters(self, context: dict[str, Any]):
         all_filters = self.model.inputs[1:]
-        all_filters_objs = [self.global_context.get(f) for f in all_filters]
+        all_filters_objs = [context.get(f) for f in all_filters]
 
         combined_attrs = {}
 
         for obj in all_filters_objs:
+            # Skip the filters whose extraction failed (StructuredOutputFailure) or do not exist
+            if not obj:
+                continue
             for k, v in vars(obj).items():
                 if v is not None and v != "None":
                     combined_attrs[k] = v
 
         return combined_attrs
 
-    def run(self):
-        filtered = []
-        unmatched_values = list(self.filters.values())
-        discarded = []
-        for doc in self.documents:
-            doc_matched = True
-
-            for key, value in self.filters.items():
-                metadata_value = str(doc.metadata.get(key, ""))
-                if metadata_value != "":
-                    if key == "fecha":
-                        value_pattern = value.replace("%", ".*")
-                        if not re.search(value_pattern, metadata_value):
-                            doc_matched = False
-                        else:
-                            if value in unmatched_values:
-                                unmatched_values.remove(value)
-                    else:
-                        if value not in metadata_value:
-                            doc_matched = False
-                        else:
-                            if value in unmatched_values:
-                                unmatched_values.remove(value)
-                        
-            if doc_matched:
-                filtered.append(doc)
-            else:
-                discarded.append(str(doc.metadata.get("file_name", "")))
+    def run(self, execution: ExecutionContext):
+        documents = execution.context.get(self.model.inputs[0])
+        filters = self.group_filters(execution.context)
+
+        # Documents without a value for a filter key are not discarded by that filter
+        filtered, unmatched_values, discarded_docs = self.get_metadata_index(documents).filter(filters, match_missing=True)
+        discarded = [str(doc.metadata.get("file_name", "")) for doc in discarded_docs]
+
+        result = [filtered, unmatched_values, filters, discarded]
+        output = self.model.output
+        if output:
+            execution.add_to_context(output, result)
+            return result
+
+class MatchNamesActionStep(MetadataIndexStep):
+    """Replaces the person names of a filter object with the name used in the documents that best matches them."""
+    def __init__(self, model:MatchNamesActionStepModel, metadata_index:MetadataIndex = None):
+        super().__init__(metadata_index)
+        self.model = model
+
+    def run(self, execution: ExecutionContext):
+        documents = execution.context.get(self.model.inputs[0])
+        names_obj = execution.context.get(self.model.inputs[1])
+
+        result = names_obj
+        # Failed extractions (StructuredOutputFailure) are passed through
+        if names_obj:
+            name_index = self.get_metadata_index(documents).name_index
+            resolved_attrs = dict(vars(names_obj))
+            for k, v in resolved_attrs.items():
+                if k not in name_index.fields or not isinstance(v, str) or v == "None":
+                    continue
+                matches = name_index.search(v, min_score=self.model.min_score)
+                self.logger.info(f"Name matches for \"{v}\": {[(m.name, m.score) for m in matches]}")
+                resolved_name = NameIndex.get_best_match(matches)
+                if resolved_name:
+                    resolved_attrs[k] = resolved_name
+            result = SimpleNamespace(**resolved_attrs)
+
+        output = self.model.output
+        if output:
+            execution.add_to_context(output, result)
+            return result
+
+class RetrieveActionStep(Step):
+    """
+    Formats the `top_k` chunks of each document most similar to a text (e.g. the query),
+    so the prompt grows with `top_k` instead of with the length of the documents.
+    """
+    def __init__(self, model:RetrieveActionStepModel, chunk_index:ChunkIndex = None):
+        super().__init__()
+        if chunk_index is None:
+            raise ValueError(f"The step '{model.id}' needs the chunk index: set data_processing.chunks_config.")
+        self.model = model
+        self.chunk_index = chunk_index
+
+    def run(self, execution: ExecutionContext):
+        documents = execution.context.get(self.model.inputs[0])
+        text = execution.context.get(self.model.inputs[1])
+        # A single document (e.g. the item of a for_each) or a list of documents
+        documents = documents if isinstance(documents, list) else [documents]
+
+        retrieved = self.chunk_index.retrieve(str(text), self.model.top_k, documents)
+        self.logger.info(f"Retrieved chunks. Step \"{self.model.id}\": {[(m.file_name, round(m.score, 3)) for matches in retrieved.values() for m in matches]}")
+        result = ChunkIndex.format_matches([m for matches in retrieved.values() for m in matches])
 
-        result = [filtered, unmatched_values, self.filters, discarded]
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
+            return result
+
+class SelectRelevantDocumentsActionStep(Step):
+    """Keeps the `top_k` documents with the best BM25 score for a text (e.g. the query), before the per-document LLM calls."""
+    def __init__(self, model:SelectRelevantDocumentsActionStepModel, bm25_index:BM25Index = None):
+        super().__init__()
+        self.model = model
+        self.bm25_index = bm25_index
+
+    def get_bm25_index(self, documents) -> BM25Index:
+        if self.bm25_index is not None and self.bm25_index.contains(documents):
+            return self.bm25_index
+        # The documents were not indexed (e.g. documents built by a previous step)
+        return BM25Index(documents)
+
+    def run(self, execution: ExecutionContext):
+        documents = execution.context.get(self.model.inputs[0])
+        text = execution.context.get(self.model.inputs[1])
+
+        result = self.get_bm25_index(documents).prune(str(text), documents, self.model.top_k)
+        self.logger.info(f"Relevant documents. Step \"{self.model.id}\": {[d.metadata.get('file_name') for d in result]}")
+
+        output = self.model.output
+        if output:
+            execution.add_to_context(output, result)
             return result
 
 class CheckTermsInTextActionStep(Step):
-    def __init__(self, model:CheckTermsInTextActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None]):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:CheckTermsInTextActionStepModel):
+        super().__init__()
         self.model = model
         self.terms = self.model.inputs[0]
-        self.text = self.global_context.get(self.model.inputs[1])
 
-    def run(self):
+    def run(self, execution: ExecutionContext):
+        text = execution.context.get(self.model.inputs[1])
         result = False
-        query_terms = self.text.lower().split(" ")
+        query_terms = text.lower().split(" ")
         for term in query_terms:
             if term in self.terms:
                 result = True
-        
+
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
 
 class GoToStep(Step):
-    def __init__(self, model:GoToStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None]):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:GoToStepModel):
+        super().__init__()
         self.model = model
 
-    def run(self):
+    def run(self, execution: ExecutionContext):
         return {"go_to": self.model.target_id}
 
 class SetVariableStep(Step):
-    def __init__(self, model:SetVariableStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None]):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:SetVariableStepModel):
+        super().__init__()
         self.model = model
+        self.source = compile_expression(self.model.source)
 
-    def run(self):
-        result = self.evaluate(self.model.source, self.global_context)
+    def run(self, execution: ExecutionContext):
+        result = self.evaluate(execution.context)
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
-    
-    def evaluate(self, expr: str, context: dict[str, Any]) -> bool:
+
+    def evaluate(self, context: dict[str, Any]) -> Any:
         try:
-            return eval(expr, {}, context)
+            return self.source.evaluate(context)
         except Exception as e:
             self.logger.error(f"Error evaluating if condition in the step \"{self.model.id}\": {e}")
             return None
 
 class ForEachStep(Step):
-    def __init__(self, model:ForEachStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], llm_call, json_llm_call, metadata_config: MetadataConfig, add_to_memory, format_memory):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:ForEachStepModel, **kwargs):
+        super().__init__()
         self.model = model
-        self.llm_call = llm_call
-        self.json_llm_call = json_llm_call
-        self.metadata_config = metadata_config
-        self.add_to_memory = add_to_memory
-        self.format_memory = format_memory
+        self.step = StepFactory.create(self.model.step, **kwargs)
+
+    def run(self, execution: ExecutionContext):
+        iterable_obj = execution.context.get(self.model.iterate_obj)
+        if self.model.parallel:
+            outputs = self.run_parallel(execution, list(iterable_obj))
+        else:
+            outputs = self.run_sequential(execution, iterable_obj)
+
+        result = outputs
+        output = self.model.output
+        if output:
+            execution.add_to_context(output, result)
+            return result
 
-    def run(self):
-        iterable_obj = self.global_context.get(self.model.iterate_obj)
+    def run_sequential(self, execution: ExecutionContext, iterable_obj):
         outputs = []
         for item in iterable_obj:
-            self.add_to_context("item", item)
-            step = StepFactory.create(
-                self.model.step,
-                global_context = self.global_context, 
-                add_to_context = self.add_to_context,
-                llm_call = self.llm_call, 
-                json_llm_call = self.json_llm_call,
-                metadata_config = self.metadata_config,
-                add_to_memory = self.add_to_memory,
-                format_memory = self.format_memory
-            )
-            output = step.run()
+            execution.add_to_context("item", item)
+            output = self.step.run(execution)
             if self.model.collected_field:
-                outputs.append(self.global_context.get(self.model.collected_field))
+                outputs.append(execution.context.get(self.model.collected_field))
             else:
                 outputs.append(output)
+        return outputs
 
-        result = outputs
-        output = self.model.output
-        if output:
-            self.add_to_context(output, result)
-            return result
+    def run_parallel(self, execution: ExecutionContext, items):
+        max_workers = max(1, min(self.model.max_concurrency or 1, len(items)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.model.id) as executor:
+            results = list(executor.map(lambda item: self.run_iteration(execution, item), items))
+
+        # The memory entries are added once all the iterations have finished, in input order
+        outputs = []
+        for output, child_execution in results:
+            execution.merge_memory(child_execution)
+            outputs.append(output)
+        return outputs
+
+    def run_iteration(self, execution: ExecutionContext, item):
+        """Runs an iteration with its own child context, so iterations can run concurrently."""
+        child_execution = execution.create_child()
+        child_execution.add_to_context("item", item)
+
+        output = self.step.run(child_execution)
+        if self.model.collected_field:
+            output = child_execution.context.get(self.model.collected_field)
+        return output, child_execution
 
 class FormatListActionStep(Step):
-    def __init__(self, model:FormatListActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None],):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:FormatListActionStepModel):
+        super().__init__()
         self.model = model
-        self.items = self.global_context.get(self.model.inputs[0])
-        self.format_template = self.model.format_template
+        self.format_template = compile_template(self.model.format_template, "format")
         self.separator = self.model.separator
 
-    def run(self):
-        formatted_items = [self.format_template.format(item=item) for item in self.items]
+    def run(self, execution: ExecutionContext):
+        items = execution.context.get(self.model.inputs[0])
+        # The items that could not be obtained (e.g. a StructuredOutputFailure) have no fields to format
+        skipped = sum(1 for item in items if not item)
+        if skipped:
+            self.logger.info(f"Step \"{self.model.id}\": {skipped} items without information are not formatted.")
+        formatted_items = [self.format_template.render({"item": item}) for item in items if item]
         result = self.separator.join(formatted_items)
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
 
 class AddToMemoryActionStep(Step):
-    def __init__(self, model:AddToMemoryActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], add_to_memory):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:AddToMemoryActionStepModel):
+        super().__init__()
         self.model = model
-        self.add_to_memory = add_to_memory
+        self.result = compile_template(self.model.result, "format")
 
-    def run(self):
-        self.add_to_memory(
+    def run(self, execution: ExecutionContext):
+        execution.add_to_memory(
             self.model.name,
             self.model.description,
-            self.model.result.format(**self.global_context),
+            self.result.render(execution.context),
         )
 
 class FormatMemoryActionStep(Step):
-    def __init__(self, model:AddToMemoryActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], format_memory):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:FormatMemoryActionStepModel):
+        super().__init__()
         self.model = model
-        self.format_memory = format_memory
 
-    def run(self):
-        result = self.format_memory()
+    def run(self, execution: ExecutionContext):
+        result = execution.format_memory()
         output = self.model.output
         if output:
-            self.add_to_context(output, result)
+            execution.add_to_context(output, result)
             return result
 
 class EvaluateActionStep(Step):
-    def __init__(self, model:EvaluateActionStepModel, global_context: dict[str, Any], add_to_context:Callable[[str, Any], None], llm_call, json_llm_call):
-        super().__init__(global_context, add_to_context)
+    def __init__(self, model:EvaluateActionStepModel, llm_call, json_llm_call):
+        super().__init__()
         self.model = model
         self.llm_call = llm_call
         self.json_llm_call = json_llm_call
-
-    def run(self):
-        selected_llm_call = self.json_llm_call if self.model.json_output else self.llm_call
-        
-        step = StepFactory.create(
+        self.condition = compile_expression(self.model.condition)
+        self.prompt = compile_template(self.model.prompt, "format")
+        self.step = StepFactory.create(
             self.model.step,
-            global_context = self.global_context, 
-            add_to_context = self.add_to_context,
-            llm_call = self.llm_call, 
+            llm_call = self.llm_call,
             json_llm_call = self.json_llm_call
         )
 
+    def run(self, execution: ExecutionContext):
         for i in range(self.model.max_intents):
-            step.run()
+            # A cached answer would be the same one that has just been rejected, so it is replaced
+            self.step.run(execution, refresh_cache=i > 0)
+            if not execution.context.get(self.step.model.output):
+                # There is nothing to evaluate (e.g. a StructuredOutputFailure) and it was already retried within its budget
+                self.logger.info(f"Step \"{self.model.id}\": no output of \"{self.step.model.id}\" to evaluate.")
+                break
 
             self.logger.info(f"Evaluation Intent {i+1}:")
-            # formatted_prompt = format_string(self.model.prompt, **self.global_context)
-            formatted_prompt = self.model.prompt.format(**self.global_context)
-            
+            formatted_prompt = self.prompt.render(execution.context)
+
             self.logger.info(f"Prompt. Step \"{self.model.id}\": {formatted_prompt}")
-            result = selected_llm_call(formatted_prompt)
+            if self.model.json_output:
+                result = self.json_llm_call(formatted_prompt, label=self.model.id, use_cache=bool(self.model.cache), deadline=execution.deadline)
+            else:
+                result = self.llm_call(formatted_prompt, use_cache=bool(self.model.cache))
             self.logger.info(f"Output. Step \"{self.model.id}\": {str(result)}")
-            
+
             output = self.model.output
             if output:
-                self.add_to_context(output, result)
-        
-            if self.evaluate_condition(self.model.condition):
+                execution.add_to_context(output, result)
+
+            if self.evaluate_condition(execution.context):
                 break
 
-    def evaluate_condition(self, condition: str) -> bool:
+    def evaluate_condition(self, context: dict[str, Any]) -> bool:
         try:
-            return eval(condition, {}, self.global_context)
+            return self.condition.evaluate(context)
         except Exception as e:
             self.logger.error(f"Error evaluating condition in the step \"{self.model.id}\": {e}")
             return False
 
-    
+
 class StepFactory:
     @staticmethod
     def create(model: BaseStepModel, **kwargs) -> Step:
         if isinstance(model, LLMCallStepModel):
             return LLMCallStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+                model,
                 llm_call = kwargs.get("llm_call"),
                 json_llm_call = kwargs.get("json_llm_call"),
+                stream_llm_call = kwargs.get("stream_llm_call"),
             )
         elif isinstance(model, FormatDocumentsActionStepModel):
             return FormatDocumentsActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+                model,
                 metadata_config = kwargs.get("metadata_config")
             )
         elif isinstance(model, FormatDocumentActionStepModel):
             return FormatDocumentActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+                model,
                 metadata_config = kwargs.get("metadata_config")
             )
         elif isinstance(model, CompositeStepModel):
-            return CompositeStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-                llm_call = kwargs.get("llm_call"),
-                json_llm_call = kwargs.get("json_llm_call"),
-                metadata_config = kwargs.get("metadata_config"),
-                add_to_memory = kwargs.get("add_to_memory"),
-                format_memory = kwargs.get("format_memory")
-            )
+            return CompositeStep(model, **kwargs)
         elif isinstance(model, ApplyFiltersActionStepModel):
             return ApplyFiltersActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+                model,
+                metadata_index = kwargs.get("metadata_index")
             )
-        elif isinstance(model, CheckTermsInTextActionStepModel):
-            return CheckTermsInTextActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+        elif isinstance(model, MatchNamesActionStepModel):
+            return MatchNamesActionStep(
+                model,
+                metadata_index = kwargs.get("metadata_index")
             )
-        elif isinstance(model, IfStepModel):
-            return IfStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-                llm_call = kwargs.get("llm_call"),
-                json_llm_call = kwargs.get("json_llm_call"),
-                metadata_config = kwargs.get("metadata_config"),
-                add_to_memory = kwargs.get("add_to_memory"),
-                format_memory = kwargs.get("format_memory")
+        elif isinstance(model, RetrieveActionStepModel):
+            return RetrieveActionStep(
+                model,
+                chunk_index = kwargs.get("chunk_index")
             )
-        elif isinstance(model, GoToStepModel):
-            return GoToStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+        elif isinstance(model, SelectRelevantDocumentsActionStepModel):
+            return SelectRelevantDocumentsActionStep(
+                model,
+                bm25_index = kwargs.get("bm25_index")
             )
+        elif isinstance(model, CheckTermsInTextActionStepModel):
+            return CheckTermsInTextActionStep(model)
+        elif isinstance(model, IfStepModel):
+            return IfStep(model, **kwargs)
+        elif isinstance(model, GoToStepModel):
+            return GoToStep(model)
         elif isinstance(model, SetVariableStepModel):
-            return SetVariableStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-            )
+            return SetVariableStep(model)
         elif isinstance(model, ForEachStepModel):
-            return ForEachStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-                llm_call = kwargs.get("llm_call"),
-                json_llm_call = kwargs.get("json_llm_call"),
-                metadata_config = kwargs.get("metadata_config"),
-                add_to_memory = kwargs.get("add_to_memory"),
-                format_memory = kwargs.get("format_memory")
-            )
+            return ForEachStep(model, **kwargs)
         elif isinstance(model, FormatListActionStepModel):
-            return FormatListActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-            )
+            return FormatListActionStep(model)
         elif isinstance(model, AddToMemoryActionStepModel):
-            return AddToMemoryActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-                add_to_memory = kwargs.get("add_to_memory")
-            )
+            return AddToMemoryActionStep(model)
         elif isinstance(model, FormatMemoryActionStepModel):
-            return FormatMemoryActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
-                format_memory = kwargs.get("format_memory")
-            )
+            return FormatMemoryActionStep(model)
         elif isinstance(model, EvaluateActionStepModel):
             return EvaluateActionStep(
-                model, 
-                global_context = kwargs.get("global_context"),
-                add_to_context = kwargs.get("add_to_context"),
+                model,
                 llm_call = kwargs.get("llm_call"),
                 json_llm_call = kwargs.get("json_llm_call"),
             )
         else:
-            raise ValueError(f"No logic builder registered for model {type(model).__name__}")
\ No newline at end of file
+            raise ValueError(f"No logic builder registered for model {type(model).__name__}")
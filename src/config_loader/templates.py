@@ -0,0 +1,100 @@
+import re
+from functools import lru_cache
+from string import Formatter
+from typing import Any, List, Literal, Tuple
+
+class TemplateError(ValueError):
+    pass
+
+TemplateMode = Literal["safe", "format"]
+
+class Template():
+    """
+    Prompt template of the DSL, parsed once into literal text and placeholders.
+    Rendering only looks up the variables the template references, instead of passing the whole context as kwargs.
+
+    Two modes are supported, matching how the prompts were formatted before:
+    - "safe": llama_index `format_string` semantics. Placeholders whose key is not in the context are left as they are,
+      so JSON examples such as {{"fecha": "DD/MM/AAAA"}} are kept untouched.
+    - "format": `str.format` semantics (escaped braces, attribute and index access, conversions and format specs).
+    """
+    SAFE_PLACEHOLDER_PATTERN = re.compile(r"\{([^{}]+)\}")
+    VARIABLE_PATTERN = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+    _formatter = Formatter()
+
+    def __init__(self, source: str, mode: TemplateMode = "safe"):
+        self.source = source
+        self.mode = mode
+        if mode == "safe":
+            self.parts = self._parse_safe(source)
+        elif mode == "format":
+            self.parts = self._parse_format(source)
+        else:
+            raise TemplateError(f"Unknown template mode \"{mode}\".")
+
+        self.variables = self._get_variables()
+
+    def _parse_safe(self, source: str) -> List[Tuple[str, str | None, str | None]]:
+        """Returns (literal_text, key, original_placeholder) tuples."""
+        parts = []
+        last_end = 0
+        for match in self.SAFE_PLACEHOLDER_PATTERN.finditer(source):
+            parts.append((source[last_end:match.start()], match.group(1), match.group(0)))
+            last_end = match.end()
+        parts.append((source[last_end:], None, None))
+        return parts
+
+    def _parse_format(self, source: str) -> List[Tuple[str, str | None, str | None, str | None]]:
+        """Returns (literal_text, field_name, conversion, format_spec) tuples."""
+        try:
+            parts = [(literal, field_name, conversion, format_spec) for literal, field_name, format_spec, conversion in self._formatter.parse(source)]
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from e
+
+        for _, field_name, _, format_spec in parts:
+            if field_name == "" or (field_name is not None and field_name[0].isdigit()):
+                raise TemplateError(f"Invalid template: positional field \"{{{field_name}}}\" is not allowed.")
+            if format_spec and "{" in format_spec:
+                raise TemplateError(f"Invalid template: nested field in the format spec \"{format_spec}\" is not allowed.")
+        return parts
+
+    def _get_variables(self) -> List[str]:
+        """Returns the context variables the template references."""
+        variables = []
+        for part in self.parts:
+            key = part[1]
+            if key is None:
+                continue
+            if self.mode == "safe":
+                # Other placeholders (e.g. JSON examples) are never replaced
+                variable = key if self.VARIABLE_PATTERN.fullmatch(key) else None
+            else:
+                variable = self.VARIABLE_PATTERN.match(key).group(0)
+            if variable and variable not in variables:
+                variables.append(variable)
+        return variables
+
+    def render(self, context: dict[str, Any]) -> str:
+        rendered = []
+        if self.mode == "safe":
+            for literal, key, original in self.parts:
+                rendered.append(literal)
+                if key is not None:
+                    rendered.append(str(context[key]) if key in context else original)
+            return "".join(rendered)
+
+        for literal, field_name, conversion, format_spec in self.parts:
+            rendered.append(literal)
+            if field_name is None:
+                continue
+            value, _ = self._formatter.get_field(field_name, (), context)
+            value = self._formatter.convert_field(value, conversion)
+            rendered.append(self._formatter.format_field(value, format_spec or ""))
+        return "".join(rendered)
+
+    def __repr__(self):
+        return f"Template({self.source[:40]!r}, mode={self.mode!r})"
+
+@lru_cache(maxsize=None)
+def compile_template(source: str, mode: TemplateMode = "safe") -> Template:
+    return Template(source, mode)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from llama_index.core.schema import Document
+
+from logger_manager import LoggerMixin
+
+class BM25Index(LoggerMixin):
+    """
+    BM25 index over the full text of the documents, used as a cheap lexical pre-filter before the per-document LLM calls.
+
+    Terms are casefolded words without accents, skipping the most common Spanish stopwords. The postings of each term
+    are NumPy arrays, so scoring a query only touches the documents that contain its terms. With a `file_path`, the term
+    counts of each document are persisted (JSON, keyed by the hash of its text) and only new or changed texts are tokenized.
+    """
+    VERSION = 1
+    TOKEN_PATTERN = re.compile(r"\w+")
+    STOPWORDS = {
+        "a", "al", "algo", "con", "como", "cual", "cuales", "cuando", "de", "del", "donde", "el", "ella", "en", "entre",
+        "es", "esta", "este", "fue", "ha", "han", "hay", "la", "las", "le", "les", "lo", "los", "mas", "me", "mi", "no",
+        "o", "para", "pero", "por", "que", "quien", "se", "ser", "si", "sin", "sobre", "son", "su", "sus", "un", "una",
+        "uno", "unos", "unas", "y", "ya",
+    }
+
+    def __init__(self, documents: List[Document], file_path: str | None = None, k1: float = 1.5, b: float = 0.75, known_entries: Dict[str, Dict[str, Any]] | None = None):
+        """`known_entries` are term counts by text hash already computed (e.g. by a previous index), reused like the persisted ones."""
+        super().__init__()
+        self.documents = documents
+        self.file_path = file_path
+        self.known_entries = known_entries or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.k1 = k1
+        self.b = b
+        self.positions = {id(d): position for position, d in enumerate(documents)}
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.idf: Dict[str, float] = {}
+        self._build()
+
+    @classmethod
+    def get_terms(cls, text: str) -> List[str]:
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+        return [t for t in cls.TOKEN_PATTERN.findall(text) if t not in cls.STOPWORDS]
+
+    @staticmethod
+    def compute_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.file_path or not os.path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.info(f"Cannot read BM25 index \"{self.file_path}\": {e}. Rebuilding it.")
+            return {}
+        return data.get("documents", {}) if data.get("version") == self.VERSION else {}
+
+    def save(self, entries: Dict[str, Dict[str, Any]]):
+        folder_path = os.path.dirname(self.file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+
+        tmp_file_path = f"{self.file_path}.tmp"
+        with open(tmp_file_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self.VERSION, "documents": entries}, file, ensure_ascii=False)
+        os.replace(tmp_file_path, self.file_path)
+
+    def _build(self):
+        persisted = self._load()
+        entries: Dict[str, Dict[str, Any]] = {}
+        term_counts: List[Dict[str, int]] = []
+        for document in self.documents:
+            text_hash = self.compute_text_hash(document.text)
+            entry = entries.get(text_hash) or self.known_entries.get(text_hash) or persisted.get(text_hash)
+            if entry is None:
+                counts: Dict[str, int] = {}
+                for term in self.get_terms(document.text):
+                    counts[term] = counts.get(term, 0) + 1
+                entry = {"terms": counts}
+            entries[text_hash] = entry
+            term_counts.append(entry["terms"])
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for position, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                term_positions, term_frequencies = postings.setdefault(term, ([], []))
+                term_positions.append(position)
+                term_frequencies.append(count)
+
+        num_documents = len(self.documents)
+        self.lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float64)
+        average_length = float(self.lengths.mean()) if num_documents else 0.0
+        average_length = average_length if average_length > 0 else 1.0
+        self.length_norms = self.k1 * (1 - self.b + self.b * self.lengths / average_length)
+        for term, (term_positions, term_frequencies) in postings.items():
+            self.postings[term] = (np.array(term_positions, dtype=np.int64), np.array(term_frequencies, dtype=np.float64))
+            df = len(term_positions)
+            self.idf[term] = math.log((num_documents - df + 0.5) / (df + 0.5) + 1)
+
+        self.entries = entries
+        if self.file_path and set(entries) != set(persisted):
+            self.save(entries)
+
+    def update(self, documents: List[Document]) -> "BM25Index":
+        """Returns a new index over the documents that reuses the term counts of this one."""
+        return BM25Index(documents, self.file_path, self.k1, self.b, self.entries)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every indexed document for the query."""
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        for term in set(self.get_terms(query)):
+            if term not in self.postings:
+                continue
+            term_positions, term_frequencies = self.postings[term]
+            scores[term_positions] += self.idf[term] * term_frequencies * (self.k1 + 1) / (term_frequencies + self.length_norms[term_positions])
+        return scores
+
+    def contains(self, documents: List[Document]) -> bool:
+        return all(id(d) in self.positions for d in documents)
+
+    def rank(self, query: str, documents: List[Document] | None = None) -> List[Tuple[Document, float]]:
+        """Returns the documents (all the indexed ones by default) with their scores, best first. Ties keep the given order."""
+        documents = self.documents if documents is None else documents
+        scores = self.get_scores(query)
+        ranked = [(d, float(scores[self.positions[id(d)]])) for d in documents]
+        return sorted(ranked, key=lambda ranked_document: -ranked_document[1])
+
+    def prune(self, query: str, documents: List[Document], top_k: int) -> List[Document]:
+        """
+        Keeps the `top_k` documents most relevant to the query, in their original order. The documents tied with
+        the k-th score are kept too, and none is discarded when no document matches a term of the query.
+        """
+        if len(documents) <= top_k:
+            return list(documents)
+        ranked = self.rank(query, documents)
+        if ranked[0][1] == 0:
+            return list(documents)
+        min_score = ranked[top_k - 1][1]
+        kept = {id(d) for d, score in ranked if score >= min_score}
+        return [d for d in documents if id(d) in kept]
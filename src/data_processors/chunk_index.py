@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from llama_index.core.schema import Document
+
+from data_processors.static_data_processor import StaticDataProcessor
+from data_processors.stored_document import StoredDocument
+from logger_manager import LoggerMixin
+from utils.embedders import Embedder
+
+class ChunkMatch(NamedTuple):
+    file_name: str
+    text: str
+    score: float
+    # Page of the chunk in the PDF ("" if the document has no pages)
+    page_label: str = ""
+
+    def cite(self) -> str:
+        return f"[Página {self.page_label}] {self.text}" if self.page_label else self.text
+
+class ChunkIndex(LoggerMixin):
+    """
+    Vector index over the chunks of the documents, searched by brute-force cosine similarity with NumPy.
+
+    The chunks of each document are contiguous rows of one normalized matrix, so a query is a single
+    matrix-vector product. With a `file_path`, the matrix is persisted (.npz) together with the hash of
+    the text of each document, and only the new or changed documents are embedded again.
+
+    Documents with pages (StoredDocument) are chunked page by page, so every chunk knows the page it comes from.
+    """
+    VERSION = 2
+
+    def __init__(self, embedder: Embedder, chunk_size: int = 512, chunk_overlap: int = 50, file_path: str | None = None):
+        super().__init__()
+        self.embedder = embedder
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.file_path = file_path
+        self.texts: List[str] = []
+        self.page_labels: List[str] = []
+        self.file_names: List[str] = []
+        self.document_hashes: List[str] = []
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def get_signature(self) -> str:
+        return json.dumps({
+            "version": self.VERSION,
+            "embedder": self.embedder.name,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+        })
+
+    @staticmethod
+    def compute_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, Tuple[List[str], List[str], np.ndarray]]:
+        """Returns the persisted chunks, page labels and vectors of each document hash."""
+        if not self.file_path or not os.path.exists(self.file_path):
+            return {}
+        try:
+            with np.load(self.file_path, allow_pickle=False) as data:
+                if str(data["signature"]) != self.get_signature():
+                    self.logger.info(f"Chunk index \"{self.file_path}\" was built with other settings. Rebuilding it.")
+                    return {}
+                texts, page_labels = data["texts"].tolist(), data["page_labels"].tolist()
+                hashes, matrix = data["document_hashes"].tolist(), data["matrix"]
+        except (OSError, KeyError, ValueError) as e:
+            self.logger.info(f"Cannot read chunk index \"{self.file_path}\": {e}. Rebuilding it.")
+            return {}
+
+        return self._group_by_hash(texts, page_labels, hashes, matrix)
+
+    @staticmethod
+    def _group_by_hash(texts: List[str], page_labels: List[str], hashes: List[str], matrix: np.ndarray) -> Dict[str, Tuple[List[str], List[str], np.ndarray]]:
+        """Returns the chunks, page labels and vectors of each document hash (the rows of a document are contiguous)."""
+        grouped: Dict[str, Tuple[List[str], List[str], np.ndarray]] = {}
+        start = 0
+        while start < len(hashes):
+            end = start
+            while end < len(hashes) and hashes[end] == hashes[start]:
+                end += 1
+            grouped[hashes[start]] = (texts[start:end], page_labels[start:end], matrix[start:end])
+            start = end
+        return grouped
+
+    def save(self):
+        folder_path = os.path.dirname(self.file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+
+        # np.savez adds the extension if it is missing, so the temporary file already has it
+        tmp_file_path = f"{self.file_path}.tmp.npz"
+        np.savez(
+            tmp_file_path,
+            signature=np.array(self.get_signature()),
+            texts=np.array(self.texts, dtype=str),
+            page_labels=np.array(self.page_labels, dtype=str),
+            document_hashes=np.array(self.document_hashes, dtype=str),
+            matrix=self.matrix,
+        )
+        os.replace(tmp_file_path, self.file_path)
+
+    def split_document(self, document: Document) -> Tuple[List[str], List[str]]:
+        """Returns the chunks of the document and the page label of each one."""
+        pages = document.iter_pages() if isinstance(document, StoredDocument) else [document]
+        chunks, page_labels = [], []
+        for page in pages:
+            page_chunks = [c.text for c in StaticDataProcessor.split_document_into_chunks(page, self.chunk_size, self.chunk_overlap)]
+            chunks.extend(page_chunks)
+            page_labels.extend([page.metadata.get("page_label", "")] * len(page_chunks))
+        return chunks, page_labels
+
+    def build(self, documents: List[Document], reusable: Dict[str, Tuple[List[str], List[str], np.ndarray]] | None = None) -> "ChunkIndex":
+        """Embeds the chunks of the documents, except the ones persisted or in `reusable` (chunks, page labels and vectors by document hash)."""
+        persisted = self._load()
+        reusable = {**persisted, **(reusable or {})}
+        document_chunks: List[Tuple[str, str, List[str], List[str], np.ndarray | None]] = []
+        pending_texts: List[str] = []
+        for document in documents:
+            document_hash = self.compute_text_hash(document.text)
+            chunks, page_labels, vectors = reusable.get(document_hash, (None, None, None))
+            if chunks is None:
+                chunks, page_labels = self.split_document(document)
+                pending_texts.extend(chunks)
+            document_chunks.append((document.metadata.get("file_name", ""), document_hash, chunks, page_labels, vectors))
+
+        reused = sum(vectors is not None for *_, vectors in document_chunks)
+        self.logger.info(f"Chunk index: {reused} documents reused, {len(pending_texts)} chunks to embed.")
+        pending_vectors = self.embedder.embed(pending_texts)
+
+        self.texts, self.page_labels, self.file_names, self.document_hashes, self.ranges = [], [], [], [], {}
+        rows = []
+        pending_start = 0
+        for file_name, document_hash, chunks, page_labels, vectors in document_chunks:
+            if vectors is None:
+                vectors = pending_vectors[pending_start:pending_start + len(chunks)]
+                pending_start += len(chunks)
+            self.ranges[file_name] = (len(self.texts), len(self.texts) + len(chunks))
+            self.texts.extend(chunks)
+            self.page_labels.extend(page_labels)
+            self.file_names.extend([file_name] * len(chunks))
+            self.document_hashes.extend([document_hash] * len(chunks))
+            rows.append(vectors)
+
+        rows = [r for r in rows if len(r) > 0]
+        self.matrix = np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+
+        # Saved when documents were added, changed or removed
+        if self.file_path and set(persisted) != set(self.document_hashes):
+            self.save()
+        return self
+
+    def update(self, documents: List[Document]) -> "ChunkIndex":
+        """Returns a new index over the documents that reuses the vectors of this one, so only new or changed documents are embedded."""
+        reusable = self._group_by_hash(self.texts, self.page_labels, self.document_hashes, self.matrix)
+        return ChunkIndex(self.embedder, self.chunk_size, self.chunk_overlap, self.file_path).build(documents, reusable)
+
+    def _get_scores(self, query: str) -> np.ndarray:
+        return self.matrix @ self.embedder.embed([query])[0]
+
+    def _get_ranges(self, documents: List[Document] | None) -> List[Tuple[str, Tuple[int, int]]]:
+        if documents is None:
+            return list(self.ranges.items())
+        ranges = []
+        for document in documents:
+            file_name = document.metadata.get("file_name", "")
+            if file_name not in self.ranges:
+                self.logger.info(f"Document \"{file_name}\" is not in the chunk index.")
+                continue
+            ranges.append((file_name, self.ranges[file_name]))
+        return ranges
+
+    @staticmethod
+    def _get_top_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Returns the positions of the `top_k` best scores, best first."""
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.array([], dtype=int)
+        top_rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        return top_rows[np.argsort(-scores[top_rows], kind="stable")]
+
+    def retrieve(self, query: str, top_k: int = 3, documents: List[Document] | None = None) -> Dict[str, List[ChunkMatch]]:
+        """Returns the `top_k` chunks of each document (all the indexed ones by default) most similar to the query."""
+        if len(self.texts) == 0:
+            return {}
+        scores = self._get_scores(query)
+        retrieved = {}
+        for file_name, (start, end) in self._get_ranges(documents):
+            document_scores = scores[start:end]
+            retrieved[file_name] = [
+                ChunkMatch(file_name, self.texts[start + row], float(document_scores[row]), self.page_labels[start + row])
+                for row in self._get_top_rows(document_scores, top_k)
+            ]
+        return retrieved
+
+    def search(self, query: str, top_k: int = 3, documents: List[Document] | None = None) -> List[ChunkMatch]:
+        """Returns the `top_k` chunks most similar to the query among all the chunks of the documents."""
+        if len(self.texts) == 0:
+            return []
+        scores = self._get_scores(query)
+        ranges = self._get_ranges(documents)
+        if not ranges:
+            return []
+        rows = np.concatenate([np.arange(start, end) for _, (start, end) in ranges])
+        top_rows = rows[self._get_top_rows(scores[rows], top_k)]
+        return [ChunkMatch(self.file_names[row], self.texts[row], float(scores[row]), self.page_labels[row]) for row in top_rows]
+
+    @staticmethod
+    def format_matches(matches: List[ChunkMatch]) -> str:
+        """Formats the chunks for a prompt, grouped by document in order of appearance and citing their page."""
+        grouped: Dict[str, List[str]] = {}
+        for match in matches:
+            grouped.setdefault(match.file_name, []).append(match.cite())
+        return "\n".join(
+            f"<<<Fragmentos del documento {file_name}:\n" + "\n...\n".join(texts) + ">>>"
+            for file_name, texts in grouped.items()
+        )
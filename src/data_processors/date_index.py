@@ -0,0 +1,82 @@
+import calendar
+import re
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+class DateIndex():
+    """
+    Sorted index over the dates of the documents (`fecha`, in DD/MM/AAAA format), searched by binary search.
+
+    Besides full dates it answers the partial dates produced by the query extractor, where "%" replaces the
+    missing parts ("%/06/2023" is June 2023, "%/%/2022" is the whole 2022), and ranges of them separated
+    by " - " ("%/03/2025 - %/06/2025" goes from March to June 2025).
+    """
+    DATE_FORMAT = "%d/%m/%Y"
+    WILDCARD = "%"
+    RANGE_PATTERN = re.compile(r"^\s*(\S+)\s+-\s+(\S+)\s*$")
+
+    def __init__(self, values: Dict[str, Set[int]]):
+        """`values` maps each distinct date string to the positions of the documents with that date."""
+        entries: List[Tuple[date, int]] = []
+        self.unparsed_values: Dict[str, Set[int]] = {}
+        for value, positions in values.items():
+            parsed = self.parse_date(value)
+            if parsed is None:
+                self.unparsed_values[value] = positions
+                continue
+            entries.extend((parsed, position) for position in positions)
+
+        entries.sort()
+        self.dates = [d for d, _ in entries]
+        self.positions = [p for _, p in entries]
+
+    @classmethod
+    def parse_date(cls, value: str) -> Optional[date]:
+        try:
+            return datetime.strptime(value.strip(), cls.DATE_FORMAT).date()
+        except ValueError:
+            return None
+
+    @classmethod
+    def parse_partial_date(cls, value: str) -> Optional[Tuple[date, date]]:
+        """Returns the first and last day of a full or partial date, or None if it is not a contiguous period."""
+        parts = value.strip().split("/")
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        day, month, year = parts
+        year = int(year)
+        try:
+            if month == cls.WILDCARD:
+                if day != cls.WILDCARD:
+                    return None
+                return date(year, 1, 1), date(year, 12, 31)
+            month = int(month)
+            if day == cls.WILDCARD:
+                return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+            full_date = date(year, month, int(day))
+            return full_date, full_date
+        except ValueError:
+            return None
+
+    @classmethod
+    def parse_query(cls, value: str) -> Optional[Tuple[date, date]]:
+        """Returns the period of a date query (a full date, a partial date or a range), or None if it cannot be represented."""
+        match = cls.RANGE_PATTERN.match(value)
+        if match is None:
+            return cls.parse_partial_date(value)
+
+        start, end = cls.parse_partial_date(match.group(1)), cls.parse_partial_date(match.group(2))
+        if start is None or end is None:
+            return None
+        return start[0], end[1]
+
+    def range(self, start: date, end: date) -> Set[int]:
+        return set(self.positions[bisect_left(self.dates, start):bisect_right(self.dates, end)])
+
+    def search(self, value: str) -> Optional[Set[int]]:
+        """Returns the positions of the documents whose date is in the queried period, or None if the query is not a period."""
+        period = self.parse_query(value)
+        if period is None:
+            return None
+        return self.range(*period)
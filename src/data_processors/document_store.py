@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Set
+
+import pypdf
+from llama_index.core.schema import Document
+
+from data_processors.stored_document import Page, StoredDocument
+from logger_manager import LoggerMixin
+
+def parse_pdf(file_path: str, texts_path: str) -> List[Page]:
+    """
+    Writes the text of the PDF to `texts_path` page by page, as PDFReader joins it ("\n" between pages),
+    and returns the byte range and label of every page. Only one page is kept in memory at a time.
+    Module level function, so it can run in a worker process.
+    """
+    pages = []
+    tmp_file_path = f"{texts_path}.tmp"
+    with open(file_path, "rb") as pdf_file, open(tmp_file_path, "wb") as texts_file:
+        pdf = pypdf.PdfReader(pdf_file)
+        for number, page in enumerate(pdf.pages):
+            if number > 0:
+                texts_file.write(b"\n")
+            start = texts_file.tell()
+            texts_file.write(page.extract_text().encode("utf-8"))
+            pages.append(Page(start, texts_file.tell(), pdf.page_labels[number]))
+    os.replace(tmp_file_path, texts_path)
+    return pages
+
+class SyncResult(NamedTuple):
+    documents: List[Document]
+    # Names of the files that are new or whose content changed, and of the files that are gone
+    changed: List[str]
+    removed: List[str]
+
+class DocumentStore(LoggerMixin):
+    """
+    Incremental store of the texts parsed from the PDFs of the data folder.
+
+    A manifest keeps the size, modification time and hash of every PDF, and the parsed texts are stored
+    by file hash. On each sync, files whose size and modification time did not change are loaded from the
+    store without reading them, files that changed are hashed, and only new content is parsed (in a process pool).
+
+    The texts stay on disk: the documents are StoredDocuments, which read their text (or one of their pages)
+    only when it is used.
+    """
+    VERSION = 2
+    MANIFEST_FILE_NAME = "manifest.json"
+    TEXTS_FOLDER_NAME = "texts"
+
+    def __init__(self, folder_path: str):
+        super().__init__()
+        self.folder_path = folder_path
+        self.manifest_path = os.path.join(folder_path, self.MANIFEST_FILE_NAME)
+        self.texts_folder_path = os.path.join(folder_path, self.TEXTS_FOLDER_NAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.info(f"Cannot read document manifest \"{self.manifest_path}\": {e}. Parsing every PDF.")
+            return
+
+        if data.get("version") == self.VERSION:
+            self.entries = data.get("files", {})
+
+    def save(self):
+        os.makedirs(self.folder_path, exist_ok=True)
+        tmp_file_path = f"{self.manifest_path}.tmp"
+        with open(tmp_file_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self.VERSION, "files": self.entries}, file, ensure_ascii=False)
+        os.replace(tmp_file_path, self.manifest_path)
+
+    @staticmethod
+    def compute_file_hash(file_path: str) -> str:
+        """SHA-256 of the content of the file. The metadata cache uses the same hash, so it is keyed by the manifest hashes."""
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def get_texts_path(self, file_hash: str) -> str:
+        return os.path.join(self.texts_folder_path, f"{file_hash}.txt")
+
+    def get_pages_path(self, file_hash: str) -> str:
+        return os.path.join(self.texts_folder_path, f"{file_hash}.pages.json")
+
+    def read_pages(self, file_hash: str) -> List[Page] | None:
+        if not os.path.exists(self.get_texts_path(file_hash)):
+            return None
+        try:
+            with open(self.get_pages_path(file_hash), "r", encoding="utf-8") as file:
+                return [Page(*page) for page in json.load(file)]
+        except (OSError, json.JSONDecodeError, TypeError):
+            return None
+
+    def write_pages(self, file_hash: str, pages: List[Page]):
+        pages_path = self.get_pages_path(file_hash)
+        tmp_file_path = f"{pages_path}.tmp"
+        with open(tmp_file_path, "w", encoding="utf-8") as file:
+            json.dump(pages, file, ensure_ascii=False)
+        os.replace(tmp_file_path, pages_path)
+
+    def _parse(self, file_paths: List[str], texts_paths: List[str], max_workers: int | None) -> List[List[Page]]:
+        if len(file_paths) <= 1 or max_workers == 1:
+            return [parse_pdf(file_path, texts_path) for file_path, texts_path in zip(file_paths, texts_paths)]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(parse_pdf, file_paths, texts_paths))
+
+    def _remove_unused_texts(self, kept_hashes: Set[str]):
+        """Removes the texts of the files that are gone, except the ones of `kept_hashes`."""
+        if not os.path.isdir(self.texts_folder_path):
+            return
+        used_hashes = kept_hashes | {entry["hash"] for entry in self.entries.values()}
+        used_files = {os.path.basename(path) for h in used_hashes for path in (self.get_texts_path(h), self.get_pages_path(h))}
+        for file_name in os.listdir(self.texts_folder_path):
+            if file_name not in used_files:
+                os.remove(os.path.join(self.texts_folder_path, file_name))
+
+    def sync(self, data_folder_path: str, max_workers: int | None = None) -> SyncResult:
+        """Returns the documents of the PDFs in the data folder, parsing only the new or changed ones."""
+        file_names = [f for f in os.listdir(data_folder_path) if f.endswith(".pdf")]
+        pages: Dict[str, List[Page]] = {}
+        pending: Dict[str, List[str]] = {}
+        entries: Dict[str, Dict[str, Any]] = {}
+        for file_name in file_names:
+            file_path = os.path.join(data_folder_path, file_name)
+            stat = os.stat(file_path)
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            previous_entry = self.entries.get(file_name, {})
+            if previous_entry.get("size") == entry["size"] and previous_entry.get("mtime_ns") == entry["mtime_ns"]:
+                entry["hash"] = previous_entry["hash"]
+            else:
+                entry["hash"] = self.compute_file_hash(file_path)
+            entries[file_name] = entry
+
+            file_pages = self.read_pages(entry["hash"])
+            if file_pages is None:
+                pending.setdefault(entry["hash"], []).append(file_name)
+            else:
+                pages[file_name] = file_pages
+
+        # Files with the same content are parsed once
+        to_parse = [names[0] for names in pending.values()]
+        if pending:
+            self.logger.info(f"Parsing {len(to_parse)} PDFs: {to_parse}")
+            os.makedirs(self.texts_folder_path, exist_ok=True)
+            file_paths = [os.path.join(data_folder_path, file_name) for file_name in to_parse]
+            texts_paths = [self.get_texts_path(file_hash) for file_hash in pending]
+            for file_hash, file_pages in zip(pending, self._parse(file_paths, texts_paths, max_workers)):
+                self.write_pages(file_hash, file_pages)
+                for file_name in pending[file_hash]:
+                    pages[file_name] = file_pages
+        changed = [file_name for file_name in file_names if self.entries.get(file_name, {}).get("hash") != entries[file_name]["hash"]]
+        removed = [file_name for file_name in self.entries if file_name not in entries]
+        self.logger.info(f"Document store: {len(file_names) - len(to_parse)} PDFs loaded from the store, {len(to_parse)} parsed, {len(removed)} removed.")
+
+        if entries != self.entries:
+            # The documents of the previous sync may still be in use (e.g. by a query in progress),
+            # so their texts are only removed the next time the files change
+            previous_hashes = {entry["hash"] for entry in self.entries.values()}
+            self.entries = entries
+            self.save()
+            self._remove_unused_texts(previous_hashes)
+
+        documents = [
+            StoredDocument(self.get_texts_path(entries[file_name]["hash"]), pages[file_name], entries[file_name]["hash"], metadata={"file_name": file_name})
+            for file_name in file_names
+        ]
+        return SyncResult(documents, changed, removed)
+
+    def load_pdf_documents(self, data_folder_path: str, max_workers: int | None = None) -> List[Document]:
+        return self.sync(data_folder_path, max_workers).documents
@@ -0,0 +1,98 @@
+import threading
+from typing import Callable, Dict, List
+
+from llama_index.core.schema import Document
+
+from data_processors.document_store import DocumentStore
+from logger_manager import LoggerMixin
+
+class DocumentWatcher(LoggerMixin):
+    """
+    Polls the data folder and keeps the list of documents up to date while the application runs.
+
+    Each poll syncs the DocumentStore: the new or modified PDFs are parsed, their metadata is extracted with
+    `extract_metadata` (which updates the metadata of the documents it receives) and the deleted ones are dropped.
+    The unchanged documents are kept as they are. The new list replaces `documents` (the previous list is never
+    modified, so the queries in progress are not affected) and is passed to the `on_change` listeners.
+    """
+    def __init__(
+        self,
+        data_folder_path: str,
+        document_store: DocumentStore,
+        documents: List[Document],
+        extract_metadata: Callable[[List[Document]], None],
+        interval: float = 10.0,
+        max_workers: int | None = None,
+    ):
+        super().__init__()
+        self.data_folder_path = data_folder_path
+        self.document_store = document_store
+        self.documents = documents
+        self.extract_metadata = extract_metadata
+        self.interval = interval
+        self.max_workers = max_workers
+        # Hash of the content of each file in `documents`. The store is loaded from the same manifest as the documents
+        self.file_hashes = {f: entry["hash"] for f, entry in document_store.entries.items()}
+        self.listeners: List[Callable[[List[Document]], None]] = []
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def add_listener(self, on_change: Callable[[List[Document]], None]):
+        self.listeners.append(on_change)
+
+    @staticmethod
+    def group_by_file(documents: List[Document]) -> Dict[str, List[Document]]:
+        grouped: Dict[str, List[Document]] = {}
+        for document in documents:
+            grouped.setdefault(document.metadata.get("file_name", ""), []).append(document)
+        return grouped
+
+    def poll(self) -> bool:
+        """Syncs the documents with the data folder. Returns whether they changed."""
+        result = self.document_store.sync(self.data_folder_path, self.max_workers)
+        current = self.group_by_file(self.documents)
+        synced = self.group_by_file(result.documents)
+        file_hashes = {f: entry["hash"] for f, entry in self.document_store.entries.items()}
+        # Compared with the hashes of the current documents instead of using result.changed,
+        # so a file whose metadata extraction failed is retried in the next poll
+        changed = {f for f in synced if f not in current or file_hashes.get(f) != self.file_hashes.get(f)}
+        removed = [f for f in current if f not in synced]
+        if not changed and not removed:
+            return False
+
+        self.logger.info(f"Data folder changed. New or modified: {sorted(changed)}. Removed: {removed}")
+        new_documents = [d for d in result.documents if d.metadata.get("file_name", "") in changed]
+        if new_documents:
+            self.extract_metadata(new_documents)
+
+        documents = []
+        for file_name, file_documents in synced.items():
+            documents.extend(file_documents if file_name in changed else current[file_name])
+        self.documents = documents
+        self.file_hashes = file_hashes
+
+        for on_change in self.listeners:
+            on_change(documents)
+        return True
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # e.g. a PDF that is still being copied. It is retried in the next poll
+                self.logger.info(f"Cannot sync the data folder \"{self.data_folder_path}\": {e}")
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="DocumentWatcher", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Watching \"{self.data_folder_path}\" every {self.interval} seconds.")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from typing import Any, Tuple
+
+from llama_index.core.schema import Document
+from llama_index.core.vector_stores.types import MetadataInfo
+
+from data_processors.document_store import DocumentStore
+from logger_manager import LoggerMixin
+
+class MetadataCache(LoggerMixin):
+    """
+    Content-addressed store for the metadata extracted from each PDF.
+
+    Entries are keyed by the hash of the PDF file and, inside it, by a key derived
+    from the field definition (name, type and description) and the extractor model.
+    Changing a field description in settings.yml only invalidates that field.
+    """
+    VERSION = 1
+
+    def __init__(self, file_path: str):
+        super().__init__()
+        self.file_path = file_path
+        self.entries: dict[str, dict[str, dict[str, Any]]] = {}
+        self.used_keys: dict[str, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.info(f"Cannot read metadata cache \"{self.file_path}\": {e}. Starting with an empty cache.")
+            return
+
+        if data.get("version") == self.VERSION:
+            self.entries = data.get("documents", {})
+
+    @staticmethod
+    def compute_document_hash(document: Document, data_folder_path: str) -> str:
+        # The documents of the DocumentStore already have the hash of their PDF
+        file_hash = getattr(document, "file_hash", None)
+        if file_hash:
+            return file_hash
+        file_path = os.path.join(data_folder_path, document.metadata.get("file_name", ""))
+        if os.path.isfile(file_path):
+            return DocumentStore.compute_file_hash(file_path)
+        return hashlib.sha256(document.text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_field_key(metadata_info: MetadataInfo, model_name: str) -> str:
+        raw_key = "|".join([model_name, metadata_info.name, metadata_info.type, metadata_info.description])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, document_hash: str, metadata_info: MetadataInfo, model_name: str) -> Tuple[bool, Any]:
+        field_key = self.get_field_key(metadata_info, model_name)
+        self.used_keys.setdefault(document_hash, set()).add(field_key)
+
+        entry = self.entries.get(document_hash, {}).get(field_key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, entry["value"]
+
+    def set(self, document_hash: str, metadata_info: MetadataInfo, model_name: str, value: Any):
+        field_key = self.get_field_key(metadata_info, model_name)
+        self.used_keys.setdefault(document_hash, set()).add(field_key)
+        self.entries.setdefault(document_hash, {})[field_key] = {
+            "field": metadata_info.name,
+            "model": model_name,
+            "value": value,
+        }
+
+    def save(self):
+        # Drop the stale fields of the documents used in this run (e.g. a field whose description changed)
+        for document_hash, keys in self.used_keys.items():
+            fields = self.entries.get(document_hash)
+            if fields is not None:
+                self.entries[document_hash] = {k: v for k, v in fields.items() if k in keys}
+
+        folder_path = os.path.dirname(self.file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+
+        tmp_file_path = f"{self.file_path}.tmp"
+        with open(tmp_file_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self.VERSION, "documents": self.entries}, file, ensure_ascii=False)
+        os.replace(tmp_file_path, self.file_path)
+
+    def get_stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total > 0 else 0.0,
+        }
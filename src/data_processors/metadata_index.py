@@ -0,0 +1,132 @@
+import re
+from typing import Any, Dict, List, Set, Tuple, Union
+
+from llama_index.core.schema import Document
+
+from data_processors.date_index import DateIndex
+from data_processors.name_index import NameIndex
+from logger_manager import LoggerMixin
+
+class MetadataIndex(LoggerMixin):
+    """
+    In-memory inverted index over the metadata of the documents, built once after the metadata extraction.
+
+    For every field it keeps the distinct values (each element for list fields, such as `lista_asistentes`)
+    with the documents that contain them, and the character trigrams of those values. A filter value is matched
+    as a substring of the indexed values, like the previous scan over `str(doc.metadata[key])`, but the candidate
+    values are found by intersecting the trigram postings, so the cost does not grow with the number of documents.
+    Every trigram of a substring is a trigram of the value, so no value containing the filter value is left out.
+    Dates are searched in a sorted DateIndex and person names can be looked up with the fuzzy NameIndex.
+    """
+    DATE_FIELD = "fecha"
+    TRIGRAM_LENGTH = 3
+
+    def __init__(self, documents: List[Document]):
+        super().__init__()
+        self.documents = documents
+        self.values: Dict[str, Dict[str, Set[int]]] = {}
+        self.trigrams: Dict[str, Dict[str, Set[str]]] = {}
+        self.missing: Dict[str, Set[int]] = {}
+        self.all_positions = set(range(len(documents)))
+        self._build()
+
+    def _build(self):
+        keys = {k for d in self.documents for k in d.metadata.keys() if k != "file_name"}
+        for key in keys:
+            values: Dict[str, Set[int]] = {}
+            missing: Set[int] = set()
+            for position, document in enumerate(self.documents):
+                value = document.metadata.get(key)
+                if value is None or str(value) == "":
+                    missing.add(position)
+                    continue
+                elements = value if isinstance(value, list) else [value]
+                for element in elements:
+                    values.setdefault(str(element), set()).add(position)
+
+            trigrams: Dict[str, Set[str]] = {}
+            for value in values:
+                for trigram in self.get_trigrams(value):
+                    trigrams.setdefault(trigram, set()).add(value)
+
+            self.values[key] = values
+            self.trigrams[key] = trigrams
+            self.missing[key] = missing
+
+        self.date_index = DateIndex(self.values.get(self.DATE_FIELD, {}))
+        self.name_index = NameIndex(self.documents)
+
+    @classmethod
+    def get_trigrams(cls, text: str) -> Set[str]:
+        return {text[i:i + cls.TRIGRAM_LENGTH] for i in range(len(text) - cls.TRIGRAM_LENGTH + 1)}
+
+    def _get_candidate_values(self, key: str, value: str) -> Set[str] | List[str]:
+        """Returns the indexed values that may contain `value`: the ones having all its trigrams."""
+        query_trigrams = self.get_trigrams(value)
+        if not query_trigrams:
+            # A value shorter than a trigram can only be found checking every distinct value
+            return list(self.values.get(key, {}).keys())
+        trigrams = self.trigrams.get(key, {})
+        if any(t not in trigrams for t in query_trigrams):
+            return set()
+        return set.intersection(*[trigrams[t] for t in query_trigrams])
+
+    @staticmethod
+    def _match_date_pattern(values: Dict[str, Set[int]], value: str) -> Set[int]:
+        """Matches the dates with the "%" wildcards of the query, as the filters did before the date index."""
+        try:
+            value_pattern = re.compile(value.replace("%", ".*"))
+        except re.error:
+            return set()
+        positions = set()
+        for v, v_positions in values.items():
+            if value_pattern.search(v):
+                positions |= v_positions
+        return positions
+
+    def match_date(self, value: str) -> Set[int]:
+        positions = self.date_index.search(value)
+        if positions is None:
+            # Not a period (e.g. "24/%/2025"), so it is matched with the wildcards
+            return self._match_date_pattern(self.values.get(self.DATE_FIELD, {}), value)
+        # Dates that could not be parsed are still matched with the wildcards
+        return positions | self._match_date_pattern(self.date_index.unparsed_values, value)
+
+    def match(self, key: str, value: str) -> Set[int]:
+        """Returns the positions of the documents whose metadata `key` matches `value`."""
+        if key == self.DATE_FIELD:
+            return self.match_date(value)
+
+        values = self.values.get(key, {})
+        matched_values = [v for v in self._get_candidate_values(key, value) if value in v]
+
+        positions = set()
+        for v in matched_values:
+            positions |= values[v]
+        return positions
+
+    def filter(
+        self,
+        filters: Dict[str, Union[str, List[str]]],
+        match_missing: bool = False
+    ) -> Tuple[List[Document], List[str], List[Document]]:
+        """
+        Returns the documents that match every filter, the filter values that no document matches and the discarded documents.
+        With `match_missing`, a document without a value for a filter key is not discarded by that filter.
+        """
+        positions = set(self.all_positions)
+        unmatched_values = list(filters.values())
+        for key, value in filters.items():
+            matched = self.match(key, value)
+            if matched and value in unmatched_values:
+                unmatched_values.remove(value)
+            if match_missing:
+                matched = matched | self.missing.get(key, self.all_positions)
+            positions &= matched
+
+        filtered = [self.documents[i] for i in sorted(positions)]
+        discarded = [self.documents[i] for i in sorted(self.all_positions - positions)]
+        return filtered, unmatched_values, discarded
+
+    def covers(self, documents: Any) -> bool:
+        return documents is self.documents
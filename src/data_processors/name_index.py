@@ -0,0 +1,109 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, NamedTuple, Set
+
+from llama_index.core.schema import Document
+
+class NameMatch(NamedTuple):
+    name: str
+    score: float
+    positions: Set[int]
+
+class NameIndex():
+    """
+    Index of the person names of the documents (attendees, president and secretary) for fuzzy lookups.
+
+    Names are normalized (casefold and accent folding), so "Juan Perez" finds "Juan Pérez Gutiérrez".
+    Candidates are the names sharing trigrams with the query, ranked by the fraction of query tokens
+    found in the name (allowing small typos) and by trigram similarity, so a missing second surname still matches.
+    """
+    NAME_FIELDS = ["lista_asistentes", "presidente", "secretario"]
+    TOKEN_SIMILARITY = 0.8
+
+    def __init__(self, documents: List[Document], fields: List[str] = None):
+        self.fields = fields or self.NAME_FIELDS
+        self.names: Dict[str, str] = {}
+        self.positions: Dict[str, Set[int]] = {}
+        self.name_tokens: Dict[str, List[str]] = {}
+        self.name_trigrams: Dict[str, Set[str]] = {}
+        self.trigrams: Dict[str, Set[str]] = {}
+        self._build(documents)
+
+    def _build(self, documents: List[Document]):
+        for position, document in enumerate(documents):
+            for field in self.fields:
+                value = document.metadata.get(field)
+                if not value:
+                    continue
+                for name in value if isinstance(value, list) else [value]:
+                    normalized = self.normalize(str(name))
+                    if not normalized:
+                        continue
+                    self.names.setdefault(normalized, str(name))
+                    self.positions.setdefault(normalized, set()).add(position)
+
+        for normalized in self.names:
+            self.name_tokens[normalized] = normalized.split()
+            self.name_trigrams[normalized] = self.get_trigrams(normalized)
+            for trigram in self.name_trigrams[normalized]:
+                self.trigrams.setdefault(trigram, set()).add(normalized)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+        return " ".join(re.findall(r"\w+", text))
+
+    @staticmethod
+    def get_trigrams(normalized: str) -> Set[str]:
+        padded = f"  {normalized} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def _get_token_score(self, query_tokens: List[str], name_tokens: List[str]) -> float:
+        found = 0
+        for query_token in query_tokens:
+            if query_token in name_tokens or any(
+                SequenceMatcher(None, query_token, name_token).ratio() >= self.TOKEN_SIMILARITY for name_token in name_tokens
+            ):
+                found += 1
+        return found / len(query_tokens)
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.6) -> List[NameMatch]:
+        """Returns the names that match the query, best first."""
+        normalized_query = self.normalize(query)
+        if not normalized_query:
+            return []
+
+        query_tokens = normalized_query.split()
+        query_trigrams = self.get_trigrams(normalized_query)
+        candidates = set()
+        for trigram in query_trigrams:
+            candidates |= self.trigrams.get(trigram, set())
+
+        matches = []
+        for normalized in candidates:
+            name_trigrams = self.name_trigrams[normalized]
+            trigram_score = 2 * len(query_trigrams & name_trigrams) / (len(query_trigrams) + len(name_trigrams))
+            score = 0.7 * self._get_token_score(query_tokens, self.name_tokens[normalized]) + 0.3 * trigram_score
+            if score >= min_score:
+                matches.append(NameMatch(self.names[normalized], round(score, 4), self.positions[normalized]))
+
+        matches.sort(key=lambda m: (-m.score, m.name))
+        return matches[:limit]
+
+    @staticmethod
+    def get_best_match(matches: List[NameMatch], min_margin: float = 0.05) -> str | None:
+        """
+        Returns the name of the best match, or None if there is no match or it is ambiguous
+        (e.g. only a first name shared by several people).
+        """
+        if not matches:
+            return None
+        if len(matches) > 1 and matches[0].score - matches[1].score < min_margin:
+            return None
+        return matches[0].name
+
+    def resolve(self, query: str, min_score: float = 0.6) -> str | None:
+        """Returns the name of the documents the query refers to, if there is a clear one."""
+        return self.get_best_match(self.search(query, limit=2, min_score=min_score))
@@ -5,9 +5,15 @@ from llama_index.core.schema import Document
 from llama_index.readers.file import PDFReader
 from llama_index.core.node_parser import SentenceSplitter
 
+from data_processors.document_store import DocumentStore
+
 class StaticDataProcessor():
     @staticmethod
-    def load_pdf_documents(folder_path:str)->List[Document]:
+    def load_pdf_documents(folder_path:str, store_path:str = None, max_workers:int = None)->List[Document]:
+        if store_path:
+            # Only the new or changed PDFs are parsed (in parallel), the rest are loaded from the store
+            return DocumentStore(store_path).load_pdf_documents(folder_path, max_workers)
+
         pdf_loader = PDFReader(return_full_document=True)
         documents = []
         for filename in os.listdir(folder_path):
@@ -0,0 +1,60 @@
+import mmap
+from typing import Iterator, List, NamedTuple
+
+from llama_index.core.schema import Document, MetadataMode
+from pydantic import PrivateAttr
+
+class Page(NamedTuple):
+    # Byte range of the page in the text file and its label in the PDF
+    start: int
+    end: int
+    label: str
+
+class StoredDocument(Document):
+    """
+    Document whose text stays in a file of the DocumentStore instead of in memory.
+
+    The text is read (memory-mapped) each time it is used, so only the documents being processed are resident.
+    `iter_pages` yields one Document per page, with the page number in the metadata, for citations.
+    `file_hash` is the hash of the PDF in the manifest of the store, so it is not computed again.
+    """
+    _texts_path: str = PrivateAttr()
+    _pages: List[Page] = PrivateAttr()
+    _file_hash: str = PrivateAttr()
+
+    def __init__(self, texts_path: str, pages: List[Page], file_hash: str, **data):
+        super().__init__(**data)
+        self._texts_path = texts_path
+        self._pages = pages
+        self._file_hash = file_hash
+
+    @property
+    def file_hash(self) -> str:
+        return self._file_hash
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def read_text(self, start: int = 0, end: int | None = None) -> str:
+        with open(self._texts_path, "rb") as file:
+            # mmap cannot map an empty file (a PDF without text)
+            if file.seek(0, 2) == 0:
+                return ""
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as texts:
+                return texts[start:end].decode("utf-8")
+
+    def get_content(self, metadata_mode: MetadataMode = MetadataMode.NONE) -> str:
+        text = self.read_text()
+        metadata_str = self.get_metadata_str(metadata_mode)
+        if metadata_mode == MetadataMode.NONE or not metadata_str:
+            return text
+        return self.text_template.format(content=text, metadata_str=metadata_str).strip()
+
+    def iter_pages(self) -> Iterator[Document]:
+        """Yields the pages one by one, reading only the text of each page."""
+        for number, page in enumerate(self._pages, start=1):
+            yield Document(
+                text=self.read_text(page.start, page.end),
+                metadata={**self.metadata, "page_label": page.label, "page_number": number},
+            )
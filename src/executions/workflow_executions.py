@@ -1,9 +1,15 @@
+import asyncio
+import json
 import os
+import threading
+import time
 
 from abc import ABC, abstractmethod
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Set, Tuple
 
-from config_loader.models import EvaluationConfig, FullConfig
+from config_loader.models import BatchConfig, EvaluationConfig, FullConfig, ServerConfig
+from data_processors.chunk_index import ChunkIndex
 # from rag_manager import RAGManager
 from evaluate.accuracy_evaluator import AccuracyEvaluator
 
@@ -12,6 +18,7 @@ from logger_manager import LoggerMixin
 from new_workflow import DocumentsBasedQAFlowExecutor
 from utils.utils import Utils
 from utils.evaluation_mode_validator import EvaluationModeValidator
+from utils.llm_call_manager import LLMCallManager
 from utils.file_handler import FileHandler
 from llama_index.core.workflow import Workflow
 from llama_index.core.schema import Document
@@ -21,6 +28,165 @@ from llama_index.llms.ollama import Ollama
 from llama_index.core.prompts.utils import format_string
 from llama_index.core.agent.workflow import ReActAgent
 
+class EvaluationRunner(LoggerMixin):
+    """
+    Processes the evaluation questions with up to `max_workers` questions in flight at the same time.
+    The responses are always returned in the order of the questions.
+    """
+    def __init__(self, max_workers: int = 1):
+        super().__init__()
+        self.max_workers = max(1, max_workers or 1)
+
+    def _process(self, index: int, question: str, process_question: Callable[[str], str]) -> str:
+        self.logger.info(f"{index + 1}. Pregunta: {question}")
+        response_text = process_question(question)
+        self.logger.info(f"{index + 1}. Respuesta: {response_text}\n")
+        return response_text
+
+    def run(self, questions: List[str], process_question: Callable[[str], str]) -> List[str]:
+        if self.max_workers == 1:
+            return [self._process(index, question, process_question) for index, question in enumerate(questions)]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._process, index, question, process_question) for index, question in enumerate(questions)]
+            return [future.result() for future in futures]
+
+    async def arun(self, questions: List[str], process_question: Callable[[str], Awaitable[str]]) -> List[str]:
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def process(index: int, question: str) -> str:
+            async with semaphore:
+                self.logger.info(f"{index + 1}. Pregunta: {question}")
+                response_text = await process_question(question)
+                self.logger.info(f"{index + 1}. Respuesta: {response_text}\n")
+                return response_text
+
+        return await asyncio.gather(*[process(index, question) for index, question in enumerate(questions)])
+
+class BatchRunner(LoggerMixin):
+    """
+    Answers the questions of a file with up to `max_workers` questions in flight, reading them as they are needed.
+
+    The questions file is a .txt (one question per line) or a .jsonl ({"query": "...", "id": ...} per line).
+    Each answer is appended to the answers file (JSONL) as soon as it is ready, with the line of its question,
+    so the answers are in order of completion. Running it again resumes the work: the lines already answered
+    are skipped, and the ones that failed (written with an "error") are asked again.
+    """
+    def __init__(self, max_workers: int = 1):
+        super().__init__()
+        self.max_workers = max(1, max_workers or 1)
+        self._lock = threading.Lock()
+
+    def read_questions(self, questions_file_path: str) -> Iterator[Tuple[int, str, Any]]:
+        """Yields the line number, the question and the id (if any) of every question of the file."""
+        is_jsonl = questions_file_path.endswith(".jsonl")
+        with open(questions_file_path, "r", encoding="utf-8") as file:
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                if not is_jsonl:
+                    yield line_number, line, None
+                    continue
+                try:
+                    data = json.loads(line)
+                    query = data.get("query") or data.get("question")
+                except (json.JSONDecodeError, AttributeError):
+                    query = None
+                if not isinstance(query, str) or not query.strip():
+                    self.logger.info(f"Line {line_number} of \"{questions_file_path}\" has no \"query\". Skipped.")
+                    continue
+                yield line_number, query, data.get("id")
+
+    def read_answered_lines(self, answers_file_path: str) -> Set[int]:
+        answered = set()
+        if not os.path.exists(answers_file_path):
+            return answered
+        with open(answers_file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut if the previous run crashed while writing it
+                    continue
+                if isinstance(record, dict) and "response" in record:
+                    answered.add(record.get("line"))
+        return answered
+
+    def open_answers_file(self, answers_file_path: str):
+        folder_path = os.path.dirname(answers_file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+        file = open(answers_file_path, "a+", encoding="utf-8")
+        # Starts on a new line if the previous run crashed in the middle of one
+        if file.tell() > 0:
+            file.seek(file.tell() - 1)
+            if file.read(1) != "\n":
+                file.write("\n")
+        return file
+
+    def write_answer(self, file, record: Dict[str, Any]):
+        with self._lock:
+            file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            file.flush()
+
+    def _process(self, file, line_number: int, question: str, question_id: Any, process_question: Callable[[str], Any]):
+        record = {"line": line_number, "query": question}
+        if question_id is not None:
+            record["id"] = question_id
+        self.logger.info(f"{line_number}. Pregunta: {question}")
+        start = time.monotonic()
+        try:
+            record["response"] = process_question(question)
+        except Exception as e:
+            self.logger.info(f"{line_number}. Error: {e}")
+            record["error"] = str(e)
+        else:
+            self.logger.info(f"{line_number}. Respuesta: {record['response']}\n")
+        record["elapsed"] = round(time.monotonic() - start, 3)
+        self.write_answer(file, record)
+        return "response" in record
+
+    def run(self, questions_file_path: str, answers_file_path: str, process_question: Callable[[str], Any]) -> Dict[str, int]:
+        answered_lines = self.read_answered_lines(answers_file_path)
+        if answered_lines:
+            self.logger.info(f"Resuming: {len(answered_lines)} questions already answered in \"{answers_file_path}\".")
+
+        stats = {"answered": 0, "failed": 0, "skipped": 0}
+        # Bounds the questions submitted and not finished, so the file is read as the workers need them
+        slots = threading.BoundedSemaphore(self.max_workers)
+        def release(future):
+            try:
+                answered = future.exception() is None and future.result()
+                with self._lock:
+                    stats["answered" if answered else "failed"] += 1
+            finally:
+                slots.release()
+
+        with self.open_answers_file(answers_file_path) as file, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for line_number, question, question_id in self.read_questions(questions_file_path):
+                if line_number in answered_lines:
+                    stats["skipped"] += 1
+                    continue
+                slots.acquire()
+                future = executor.submit(self._process, file, line_number, question, question_id, process_question)
+                future.add_done_callback(release)
+        return stats
+
+def get_documents_context(documents: List[Document], query: str, chunk_index: ChunkIndex = None, top_k: int = 5) -> str:
+    """
+    Context of the baseline prompts: the metadata and the full text of every document or,
+    with a chunk index, only the `top_k` chunks most similar to the query among all the documents.
+    """
+    if chunk_index is None:
+        docs_with_metadata = [f"{d.metadata}\n{d.text}" for d in documents]
+    else:
+        texts = {}
+        for match in chunk_index.search(query, top_k, documents):
+            texts.setdefault(match.file_name, []).append(match.cite())
+        docs_with_metadata = [f"{d.metadata}\n" + "\n...\n".join(texts[d.metadata.get("file_name")]) for d in documents if d.metadata.get("file_name") in texts]
+    return "\n\n".join([f"Fichero {i+1}:\n {f}" for i, f in enumerate(docs_with_metadata)])
+
 class WorkflowModeExecution(ABC, LoggerMixin):
     def __init__(self, workflow: Workflow):
         super().__init__()
@@ -58,15 +224,12 @@ class WorkflowEvaluationModeExecution(WorkflowModeExecution):
         prompts = FileHandler.read_from_txt(prompts_file_path)
         answers = FileHandler.read_from_txt(answers_file_path)
 
-        responses = []
-
-        for index, question in enumerate(questions):
-            self.logger.info(f"{index + 1}. Pregunta: {question}")
-            
-            response_text = await self._process_question(question)
+        runner = EvaluationRunner(self.evaluation_config.max_workers)
+        responses = await runner.arun(questions, self._process_question)
 
-            self.logger.info(f"Respuesta: {response_text}\n")
-            responses.append(response_text) 
+        if hasattr(self.workflow, "get_completion_cache_stats"):
+            self.logger.info(f"Completion cache stats: {self.workflow.get_completion_cache_stats()}")
+        self.logger.info(f"Reasoning stats: {LLMCallManager.get_reasoning_stats()}")
 
         # Get the questions file name (without .txt extension and parent folders)
         questions_file_name = os.path.splitext(os.path.basename(questions_file_path))[0]
@@ -82,12 +245,14 @@ class WorkflowEvaluationModeExecution(WorkflowModeExecution):
         # AccuracyEvaluator.get_results(f"{reports_folder_path}/{filename}.csv", questions, answers, responses)
 
 class BaselineEvaluationModeExecution(LoggerMixin):
-    def __init__(self, llm: Ollama, evaluation_config: EvaluationConfig, documents:List[Document]):
+    def __init__(self, llm: Ollama, evaluation_config: EvaluationConfig, documents:List[Document], chunk_index: ChunkIndex = None, top_k: int = 5):
         super().__init__()
         self.llm = llm
         self.evaluation_config = evaluation_config
         self.validator = EvaluationModeValidator()
         self.documents = documents
+        self.chunk_index = chunk_index
+        self.top_k = top_k
         self.prompt = (
             "Información contenida en los pdfs está a continuación:\n"
             "{context_str}"
@@ -100,8 +265,7 @@ class BaselineEvaluationModeExecution(LoggerMixin):
         self._process_questions()
 
     def _process_question(self, query)-> str:
-        docs_with_metadata = [f"{d.metadata}\n{d.text}" for d in self.documents]
-        context_str = "\n\n".join([f"Fichero {i+1}:\n {f}" for i, f in enumerate(docs_with_metadata)])
+        context_str = get_documents_context(self.documents, query, self.chunk_index, self.top_k)
         response = self.llm.complete(format_string(self.prompt, context_str=context_str, query_str=query))
         response_text = response.text
         return response_text
@@ -117,15 +281,8 @@ class BaselineEvaluationModeExecution(LoggerMixin):
         prompts = FileHandler.read_from_txt(prompts_file_path)
         answers = FileHandler.read_from_txt(answers_file_path)
 
-        responses = []
-
-        for index, question in enumerate(questions):
-            self.logger.info(f"{index + 1}. Pregunta: {question}")
-            
-            response_text = self._process_question(question)
-
-            self.logger.info(f"Respuesta: {response_text}\n")
-            responses.append(response_text) 
+        runner = EvaluationRunner(self.evaluation_config.max_workers)
+        responses = runner.run(questions, self._process_question)
 
         # Get the questions file name (without .txt extension and parent folders)
         questions_file_name = os.path.splitext(os.path.basename(questions_file_path))[0]
@@ -143,12 +300,14 @@ class BaselineEvaluationModeExecution(LoggerMixin):
 
 
 class ReActAgentEvaluationModeExecution(LoggerMixin):
-    def __init__(self, llm: Ollama, evaluation_config: EvaluationConfig, documents:List[Document]):
+    def __init__(self, llm: Ollama, evaluation_config: EvaluationConfig, documents:List[Document], chunk_index: ChunkIndex = None, top_k: int = 5):
         super().__init__()
         self.llm = llm
         self.evaluation_config = evaluation_config
         self.validator = EvaluationModeValidator()
         self.documents = documents
+        self.chunk_index = chunk_index
+        self.top_k = top_k
         self.prompt = (
             "Información contenida en los pdfs está a continuación:\n"
             "{context_str}"
@@ -168,8 +327,7 @@ class ReActAgentEvaluationModeExecution(LoggerMixin):
         await self._process_questions()
 
     async def _process_question(self, query)-> str:
-        docs_with_metadata = [f"{d.metadata}\n{d.text}" for d in self.documents]
-        context_str = "\n\n".join([f"Fichero {i+1}:\n {f}" for i, f in enumerate(docs_with_metadata)])
+        context_str = get_documents_context(self.documents, query, self.chunk_index, self.top_k)
 
         formatted_prompt = format_string(self.prompt, context_str=context_str, query_str=query)
         response = await self.agent.run(formatted_prompt, timeout=1200)
@@ -187,15 +345,8 @@ class ReActAgentEvaluationModeExecution(LoggerMixin):
         prompts = FileHandler.read_from_txt(prompts_file_path)
         answers = FileHandler.read_from_txt(answers_file_path)
 
-        responses = []
-
-        for index, question in enumerate(questions):
-            self.logger.info(f"{index + 1}. Pregunta: {question}")
-            
-            response_text = await self._process_question(question)
-
-            self.logger.info(f"Respuesta: {response_text}\n")
-            responses.append(response_text) 
+        runner = EvaluationRunner(self.evaluation_config.max_workers)
+        responses = await runner.arun(questions, self._process_question)
 
         # Get the questions file name (without .txt extension and parent folders)
         questions_file_name = os.path.splitext(os.path.basename(questions_file_path))[0]
@@ -247,15 +398,12 @@ class ExecutorEvaluationModeExecution(DSLBasedWorkflowModeExecution):
         prompts = FileHandler.read_from_txt(prompts_file_path)
         answers = FileHandler.read_from_txt(answers_file_path)
 
-        responses = []
-
-        for index, question in enumerate(questions):
-            self.logger.info(f"{index + 1}. Pregunta: {question}")
-            
-            response_text = self._process_question(question)
+        runner = EvaluationRunner(self.evaluation_config.max_workers)
+        responses = runner.run(questions, self._process_question)
 
-            self.logger.info(f"Respuesta: {response_text}\n")
-            responses.append(response_text) 
+        self.logger.info(f"Structured output attempts: {self.executor.get_structured_output_stats()}")
+        self.logger.info(f"Completion cache stats: {self.executor.get_completion_cache_stats()}")
+        self.logger.info(f"Reasoning stats: {LLMCallManager.get_reasoning_stats()}")
 
         # Get the questions file name (without .txt extension and parent folders)
         questions_file_name = os.path.splitext(os.path.basename(questions_file_path))[0]
@@ -271,6 +419,28 @@ class ExecutorEvaluationModeExecution(DSLBasedWorkflowModeExecution):
         # AccuracyEvaluator.get_results(f"{reports_folder_path}/{filename}.csv", questions, answers, responses)
 
 
+class ExecutorBatchModeExecution(DSLBasedWorkflowModeExecution):
+    def __init__(self, executor: DocumentsBasedQAFlowExecutor, batch_config: BatchConfig):
+        super().__init__(executor)
+        self.batch_config = batch_config
+
+    def run(self):
+        runner = BatchRunner(self.batch_config.max_workers)
+        stats = runner.run(self.batch_config.questions_file_path, self.batch_config.answers_file_path, lambda query: self.executor.run(query=query))
+        self.logger.info(f"Batch finished: {stats}. Answers in \"{self.batch_config.answers_file_path}\".")
+        self.logger.info(f"Structured output attempts: {self.executor.get_structured_output_stats()}")
+        self.logger.info(f"Completion cache stats: {self.executor.get_completion_cache_stats()}")
+
+class ExecutorServeModeExecution(DSLBasedWorkflowModeExecution):
+    def __init__(self, executor: DocumentsBasedQAFlowExecutor, server_config: ServerConfig):
+        super().__init__(executor)
+        self.server_config = server_config
+
+    def run(self):
+        # Imported here so aiohttp is only needed by this mode
+        from services.query_api import QueryAPI
+        QueryAPI(self.executor, self.server_config).run()
+
 class ExecutorQueryModeExecution(DSLBasedWorkflowModeExecution):
     def run(self):
         print("Escribe \"salir\", \"exit\" o \"quit\" para salir.\n")
@@ -279,10 +449,22 @@ class ExecutorQueryModeExecution(DSLBasedWorkflowModeExecution):
             if query.lower() in ["salir", "exit", "quit"]:
                 print("👋 Terminando motor de consultas.")
                 break
-            
+
+            # The streamed steps (the final response) are printed as they are generated
+            streamed = []
+            def print_token(text):
+                if not streamed:
+                    print("✅ Resultado:")
+                streamed.append(text)
+                print(text, end="", flush=True)
+
             response_text = self.executor.run(
-                query=query
+                query=query,
+                on_token=print_token
             )
+            if streamed:
+                print()
+                continue
             # transformed_query = self.rag_manager.query_response_processor.transform(query, "")
             # transformed_query = self.rag_manager.query_response_processor.transform(query)
             # response = self.rag_manager.query_engine.query(transformed_query)
@@ -1,4 +1,5 @@
 from config_loader.models import EvaluationConfig, LLMConfig
+from data_processors.chunk_index import ChunkIndex
 from data_processors.static_data_processor import StaticDataProcessor
 from executions.workflow_executions import BaselineEvaluationModeExecution
 from logger_manager import LoggerManager, LoggerMixin
@@ -7,6 +8,10 @@ from utils.evaluation_mode_validator import EvaluationModeValidator
 from utils.llm_manager import LLMManager
 
 DATA_FOLDER_PATH ="data"
+DOCUMENT_STORE_PATH = "cache/documents"
+# Number of chunks most similar to the question sent instead of the full documents (None sends the full documents)
+RETRIEVAL_TOP_K = None
+CHUNK_INDEX_PATH = "cache/chunk_index.npz"
 
 class Main(LoggerMixin):
     def __init__(self, model_name):
@@ -31,7 +36,8 @@ class Main(LoggerMixin):
             prompts_file_path= "dataset/questions/prompts/1-questions_persons_prompts.txt",
             answers_file_path= "dataset/answers/1-questions_persons_answers.txt",
             results_folder_path= "results",
-            reports_folder_path= "reports"
+            reports_folder_path= "reports",
+            max_workers= 4
         )
         
         LoggerManager.initialize("INFO")
@@ -39,8 +45,11 @@ class Main(LoggerMixin):
         llm = LLMManager.create_llm_by_config(llm_config)
         EvaluationModeValidator().init(validator_llm_config)
         try:
-            documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH)
-            execution = BaselineEvaluationModeExecution(llm, evaluation_config, documents)
+            documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH, DOCUMENT_STORE_PATH)
+            chunk_index = None
+            if RETRIEVAL_TOP_K:
+                chunk_index = ChunkIndex(LLMManager.create_embedder_by_config(llm_config), file_path=CHUNK_INDEX_PATH).build(documents)
+            execution = BaselineEvaluationModeExecution(llm, evaluation_config, documents, chunk_index, RETRIEVAL_TOP_K)
 
             execution.run()
         except Exception as e:  # Captura cualquier otra excepción
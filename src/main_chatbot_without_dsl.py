@@ -1,18 +1,29 @@
 
 import asyncio
+import queue
 import re 
+from data_processors.document_store import DocumentStore
+from data_processors.document_watcher import DocumentWatcher
+from data_processors.metadata_cache import MetadataCache
 from data_processors.static_data_processor import StaticDataProcessor
-from main_workflow_without_dsl import DATA_FOLDER_PATH, VECTOR_STORE_INFO
+from main_workflow_without_dsl import BM25_INDEX_PATH, COMPLETION_CACHE_PATH, DATA_FOLDER_PATH, DOCUMENT_STORE_PATH, EVIDENCE_MAX_CONCURRENCY, METADATA_CACHE_PATH, METADATA_EXTRACTION_MAX_CONCURRENCY, METADATA_EXTRACTION_SINGLE_CALL, RELEVANT_DOCUMENTS_TOP_K, VECTOR_STORE_INFO
 from qwen_workflow import QwenDocumentsBasedQAFlow
+from services.query_service import QueryService
 import streamlit as st
 
 from config_loader.models import LLMConfig
 from logger_manager import LoggerManager
+from utils.completion_cache import SQLiteCompletionCache
 from utils.evaluation_mode_validator import EvaluationModeValidator
 from utils.llm_call_manager import LLMCallManager
 from utils.llm_manager import LLMManager
 from llama_index.llms.ollama import Ollama
 
+# Seconds between checks of the data folder for new, modified or deleted actas
+WATCH_INTERVAL = 10.0
+# Queries of all the sessions that run at the same time
+QUERY_MAX_CONCURRENCY = 4
+
 @st.cache_resource
 def get_rag_manager():
     llm_config = LLMConfig(
@@ -46,16 +57,13 @@ def get_rag_manager():
         json_mode=True
     )
 
-    flow = QwenDocumentsBasedQAFlow(workflow_llm, workflow_llm_json_output, timeout=600, verbose=True)
+    completion_cache = SQLiteCompletionCache(COMPLETION_CACHE_PATH)
+    flow = QwenDocumentsBasedQAFlow(workflow_llm, workflow_llm_json_output, completion_cache=completion_cache, max_concurrency=EVIDENCE_MAX_CONCURRENCY, relevant_documents_top_k=RELEVANT_DOCUMENTS_TOP_K, bm25_index_path=BM25_INDEX_PATH, stream_final_response=True, timeout=600, verbose=True)
 
     return flow
 
 
 
-# Inicialización
-if "rag_manager" not in st.session_state:
-    st.session_state.rag_manager = get_rag_manager()
-    
 header = "Chatbot para las Actas de Comunidad"
 welcome_message = "Hola, escribe preguntas sobre las actas"
 input_placeholder = "Pregunta sobre alguna persona"
@@ -75,23 +83,42 @@ if "messages" not in st.session_state.keys():
 @st.cache_resource(show_spinner=False)
 def load_data():
     with st.spinner(text=loading_message):
-        if "documents" not in st.session_state:
-            metadata_llm_json_output = Ollama(
-                model="llama3.2", 
-                # base_url="http://156.35.95.18:11434", 
-                temperature=0.3, 
-                request_timeout=600.0, 
-                json_mode=True
-            )
-            documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH)
-            for d in documents:
-                metadata = LLMCallManager.get_document_all_metadata_by_custom_llm(metadata_llm_json_output, VECTOR_STORE_INFO, d.text)
-                d.metadata.update(metadata)
-                doc_filename = d.metadata["file_name"]
-                print(f"Extracted Metadata for the document {doc_filename}: {metadata}")
-            st.session_state.documents = documents
-
-load_data()
+        metadata_llm_json_output = Ollama(
+            model="llama3.2", 
+            # base_url="http://156.35.95.18:11434", 
+            temperature=0.3, 
+            request_timeout=600.0, 
+            json_mode=True
+        )
+        metadata_cache = MetadataCache(METADATA_CACHE_PATH)
+
+        def extract_metadata(documents):
+            asyncio.run(LLMCallManager.aget_documents_all_metadata_by_custom_llm(
+                metadata_llm_json_output, VECTOR_STORE_INFO, documents, DATA_FOLDER_PATH, metadata_cache, METADATA_EXTRACTION_MAX_CONCURRENCY, METADATA_EXTRACTION_SINGLE_CALL
+            ))
+
+        documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH, DOCUMENT_STORE_PATH)
+        extract_metadata(documents)
+
+        # Shared by every session: new, modified or deleted actas are picked up without restarting
+        watcher = DocumentWatcher(DATA_FOLDER_PATH, DocumentStore(DOCUMENT_STORE_PATH), documents, extract_metadata, WATCH_INTERVAL)
+        watcher.start()
+        return watcher
+
+document_watcher = load_data()
+
+@st.cache_resource(show_spinner=False)
+def get_query_service():
+    # One per process: the queries of every session run in its event loop, with the same flow and documents
+    flow = get_rag_manager()
+    query_service = QueryService(
+        lambda query, on_delta: flow.arun_query(document_watcher.documents, query, on_delta),
+        QUERY_MAX_CONCURRENCY
+    )
+    query_service.start()
+    return query_service
+
+query_service = get_query_service()
 
 def clean_message(self, text):
     # Eliminar contenido entre <think> y </think>
@@ -111,21 +138,28 @@ for message in st.session_state.messages:  # Display the prior chat messages
         st.write(message["content"])
 
 
-async def run_query(prompt):
-    response = await st.session_state.rag_manager.run(
-        documents=st.session_state.documents,
-        query=prompt
-    )
-    return response
+def run_query(prompt, placeholder):
+    # The final response arrives from the thread of the query service and is shown as it is generated
+    deltas = queue.SimpleQueue()
+    future = query_service.submit(prompt, deltas.put)
+    streamed = ""
+    while not future.done() or not deltas.empty():
+        try:
+            streamed += deltas.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        placeholder.markdown(streamed)
+    return future.result()
 
 if st.session_state.messages[-1]["role"] != "assistant":
     with st.chat_message("assistant"):
+        placeholder = st.empty()
         with st.spinner(thinking_message):
             print(f"Pregunta: {prompt}")
             
-            response = asyncio.run(run_query(prompt))
+            response = run_query(prompt, placeholder)
 
-            st.write(response)
+            placeholder.markdown(response)
             print(f"Respuesta: {response}\n")
 
             message = {"role": "assistant", "content": response}
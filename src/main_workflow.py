@@ -2,10 +2,16 @@ import asyncio
 from config_loader.config_loader import ConfigLoader
 from config_loader.models import ExecuteMode, LLMConfig
 
+from data_processors.bm25_index import BM25Index
+from data_processors.chunk_index import ChunkIndex
+from data_processors.document_store import DocumentStore
+from data_processors.document_watcher import DocumentWatcher
+from data_processors.metadata_cache import MetadataCache
 from data_processors.static_data_processor import StaticDataProcessor
-from executions.workflow_executions import ExecutorEvaluationModeExecution, ExecutorQueryModeExecution
+from executions.workflow_executions import ExecutorBatchModeExecution, ExecutorEvaluationModeExecution, ExecutorQueryModeExecution, ExecutorServeModeExecution
 from logger_manager import LoggerManager, LoggerMixin
 from new_workflow import DocumentsBasedQAFlowExecutor
+from utils.completion_cache import CompletionCache
 from utils.evaluation_mode_validator import EvaluationModeValidator
 
 
@@ -41,15 +47,31 @@ class Main(LoggerMixin):
         workflow_llm_json_output = LLMManager.create_json_output_llm_by_config(self.full_config.app.general.llm)
 
         data_folder_path = self.full_config.app.data_processing.data_folder_path
+        document_store_path = self.full_config.app.data_processing.document_store_path
+        ingestion_max_workers = self.full_config.app.data_processing.ingestion_max_workers
+        watch_interval = self.full_config.app.data_processing.watch_interval
         metadata_config = self.full_config.app.data_processing.metadata_config
+        metadata_cache_path = self.full_config.app.data_processing.metadata_cache_path
+        metadata_extraction_config = self.full_config.app.data_processing.metadata_extraction
+        chunks_config = self.full_config.app.data_processing.chunks_config
+        bm25_index_path = self.full_config.app.data_processing.bm25_index_path
+        structured_output_config = self.full_config.app.general.structured_output
+        completion_cache_config = self.full_config.app.general.completion_cache
         workflow = self.full_config.app.workflow
         try:
-            documents = StaticDataProcessor.load_pdf_documents(data_folder_path)
-            for d in documents:
-                metadata = LLMCallManager.get_document_all_metadata_by_custom_llm(metadata_llm_json_output, metadata_config, d.text)
-                d.metadata.update(metadata)
-                doc_filename = d.metadata["file_name"]
-                self.logger.info(f"Extracted Metadata for the document {doc_filename}: {metadata}")
+            documents = StaticDataProcessor.load_pdf_documents(data_folder_path, document_store_path, ingestion_max_workers)
+            metadata_cache = MetadataCache(metadata_cache_path) if metadata_cache_path else None
+            single_call = metadata_extraction_config.mode == "single_call"
+
+            def extract_metadata(documents):
+                if metadata_extraction_config.max_concurrency > 1:
+                    asyncio.run(LLMCallManager.aget_documents_all_metadata_by_custom_llm(
+                        metadata_llm_json_output, metadata_config, documents, data_folder_path, metadata_cache, metadata_extraction_config.max_concurrency, single_call, structured_output_config
+                    ))
+                else:
+                    LLMCallManager.get_documents_all_metadata_by_custom_llm(metadata_llm_json_output, metadata_config, documents, data_folder_path, metadata_cache, single_call, structured_output_config)
+
+            extract_metadata(documents)
 
             # metadatas = [
             #     {'fecha': '24/02/2025', 'num_asistentes': 20, 'lista_asistentes': ['Juan Pérez Gutiérrez', 'Marta González Ramírez', 'Luis Ramírez Ortega', 'Ana Sánchez Herrera', 'Roberto Martínez Vázquez', 'Carmen Herrera Jiménez', 'Pedro Jiménez Suárez', 'Laura Díaz Castro', 'Manuel Ortega Medina', 'Isabel Castro Torres', 'Jorge Moreno Navarro', 'Beatriz Suárez Aguilar', 'Alejandro Torres Rojas', 'Natalia Vázquez Gutiérrez', 'Eduardo Rojas Martínez', 'Silvia Medina Pérez', 'Ricardo Flores Sánchez', 'Patricia Navarro Díaz', 'Daniel Gutiérrez Moreno', 'Rosa Aguilar Fernández'], 'presidente': 'Juan Pérez Gutiérrez', 'secretario': 'Rosa Aguilar Fernández'},
@@ -66,13 +88,29 @@ class Main(LoggerMixin):
             execute_mode = full_config.app.general.execute_mode
             
             execution = None
-            executor = DocumentsBasedQAFlowExecutor(workflow_llm, workflow_llm_json_output, metadata_config, documents, workflow)
+            completion_cache = CompletionCache.from_config(completion_cache_config) if completion_cache_config else None
+            chunk_index = None
+            if chunks_config:
+                embedder = LLMManager.create_embedder_by_config(self.full_config.app.general.llm)
+                chunk_index = ChunkIndex(embedder, chunks_config.chunk_size, chunks_config.chunk_overlap, chunks_config.index_path).build(documents)
+            bm25_index = BM25Index(documents, bm25_index_path)
+            executor = DocumentsBasedQAFlowExecutor(workflow_llm, workflow_llm_json_output, metadata_config, documents, workflow, structured_output_config, completion_cache, chunk_index, bm25_index)
             
 
             if execute_mode == ExecuteMode.EVALUATE:
                 execution = ExecutorEvaluationModeExecution(executor, evaluation_config)
-            elif execute_mode == ExecuteMode.NORMAL:
-                execution = ExecutorQueryModeExecution(executor)
+            elif execute_mode == ExecuteMode.BATCH:
+                execution = ExecutorBatchModeExecution(executor, self.full_config.app.batch_config)
+            else:
+                if execute_mode == ExecuteMode.SERVE:
+                    execution = ExecutorServeModeExecution(executor, self.full_config.app.general.server)
+                else:
+                    execution = ExecutorQueryModeExecution(executor)
+                if watch_interval:
+                    # New, modified or deleted actas are picked up without restarting
+                    watcher = DocumentWatcher(data_folder_path, DocumentStore(document_store_path), documents, extract_metadata, watch_interval, ingestion_max_workers)
+                    watcher.add_listener(executor.update_documents)
+                    watcher.start()
             
             
             execution.run()
@@ -1,6 +1,7 @@
 import asyncio
 
 from config_loader.models import EvaluationConfig, LLMConfig
+from data_processors.metadata_cache import MetadataCache
 from data_processors.static_data_processor import StaticDataProcessor
 from executions.workflow_executions import WorkflowEvaluationModeExecution
 from logger_manager import LoggerManager, LoggerMixin
@@ -8,6 +9,7 @@ from logger_manager import LoggerManager, LoggerMixin
 from qwen_workflow import QwenDocumentsBasedQAFlow
 from utils.evaluation_mode_validator import EvaluationModeValidator
 
+from utils.completion_cache import SQLiteCompletionCache
 from utils.llm_call_manager import LLMCallManager
 from utils.llm_manager import LLMManager
 
@@ -56,6 +58,14 @@ VECTOR_STORE_INFO = VectorStoreInfo(
 )
 
 DATA_FOLDER_PATH = "data"
+DOCUMENT_STORE_PATH = "cache/documents"
+METADATA_CACHE_PATH = "cache/metadata_cache.json"
+METADATA_EXTRACTION_MAX_CONCURRENCY = 4
+METADATA_EXTRACTION_SINGLE_CALL = True
+COMPLETION_CACHE_PATH = "cache/completions.sqlite"
+EVIDENCE_MAX_CONCURRENCY = 4
+BM25_INDEX_PATH = "cache/bm25_index.json"
+RELEVANT_DOCUMENTS_TOP_K = 5
 
 class Main(LoggerMixin):
     def __init__(self):
@@ -78,7 +88,8 @@ class Main(LoggerMixin):
             prompts_file_path= "dataset/questions/prompts/1-questions_persons_prompts.txt",
             answers_file_path= "dataset/answers/1-questions_persons_answers.txt",
             results_folder_path= "results",
-            reports_folder_path= "reports"
+            reports_folder_path= "reports",
+            max_workers= 4
         )
 
         # Log settings
@@ -109,14 +120,14 @@ class Main(LoggerMixin):
         )
 
         try:
-            documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH)
-            for d in documents:
-                metadata = LLMCallManager.get_document_all_metadata_by_custom_llm(metadata_llm_json_output, VECTOR_STORE_INFO, d.text)
-                d.metadata.update(metadata)
-                doc_filename = d.metadata["file_name"]
-                self.logger.info(f"Extracted Metadata for the document {doc_filename}: {metadata}")
+            documents = StaticDataProcessor.load_pdf_documents(DATA_FOLDER_PATH, DOCUMENT_STORE_PATH)
+            metadata_cache = MetadataCache(METADATA_CACHE_PATH)
+            asyncio.run(LLMCallManager.aget_documents_all_metadata_by_custom_llm(
+                metadata_llm_json_output, VECTOR_STORE_INFO, documents, DATA_FOLDER_PATH, metadata_cache, METADATA_EXTRACTION_MAX_CONCURRENCY, METADATA_EXTRACTION_SINGLE_CALL
+            ))
 
-            flow = QwenDocumentsBasedQAFlow(workflow_llm, workflow_llm_json_output, timeout=600, verbose=True)
+            completion_cache = SQLiteCompletionCache(COMPLETION_CACHE_PATH)
+            flow = QwenDocumentsBasedQAFlow(workflow_llm, workflow_llm_json_output, completion_cache=completion_cache, max_concurrency=EVIDENCE_MAX_CONCURRENCY, relevant_documents_top_k=RELEVANT_DOCUMENTS_TOP_K, bm25_index_path=BM25_INDEX_PATH, timeout=600, verbose=True)
             execution = WorkflowEvaluationModeExecution(flow, evaluation_config, documents)
            
             asyncio.run(execution.run())
@@ -1,15 +1,22 @@
-import json
+import threading
+import time
 from types import SimpleNamespace
-from typing import Any, List
+from typing import Any, Callable, List
 from llama_index.llms.ollama import Ollama
 from llama_index.core.schema import Document
 
-from config_loader.models import BaseStepModel, MetadataConfig
-from config_loader.steps import StepFactory
+from config_loader.models import BaseStepModel, MetadataConfig, StructuredOutputConfig
+from config_loader.compiled_workflow import CompiledWorkflow
+from config_loader.execution_context import ExecutionContext
+from data_processors.bm25_index import BM25Index
+from data_processors.chunk_index import ChunkIndex
+from data_processors.metadata_index import MetadataIndex
 from logger_manager import LoggerManager
 
 
+from utils.completion_cache import CompletionCache
 from utils.llm_call_manager import LLMCallManager
+from utils.structured_output_caller import StructuredOutputCaller, StructuredOutputFailure
 from utils.utils import Utils
 
 # pasar a utils
@@ -20,109 +27,145 @@ def get_metadata_info(metadata_config:MetadataConfig, metadata_name:str|None):
     return None
 
 class DocumentsBasedQAFlowExecutor():
-    def __init__(self, llm:Ollama, llm_json_output:Ollama, metadata_config:MetadataConfig, documents: List[Document], workflow: List[BaseStepModel]) -> None:
+    """
+    Runs the DSL workflow over the loaded documents. The state of each run lives in its own ExecutionContext,
+    so one executor can serve several queries at the same time.
+    """
+    def __init__(self, llm:Ollama, llm_json_output:Ollama, metadata_config:MetadataConfig, documents: List[Document], workflow: List[BaseStepModel], structured_output_config: StructuredOutputConfig = None, completion_cache: CompletionCache = None, chunk_index: ChunkIndex = None, bm25_index: BM25Index = None) -> None:
         self.logger = LoggerManager.get_logger(name=self.__class__.__name__)
         self.llm = llm
         self.llm_json_output = llm_json_output
+        self.completion_cache = completion_cache
+        self.structured_output_config = structured_output_config or StructuredOutputConfig()
+        self.structured_output_caller = StructuredOutputCaller(llm_json_output, self.structured_output_config, self.process_complete_response, completion_cache)
         self.metadata_config = metadata_config
-        self.documents = documents
-        self.step_results = []
         self.workflow = workflow
-        self.context = {}
-        self.context["documents"] = documents
-    
-    def add_to_memory(self, name:str, description:str, result:str):
-        self.step_results.append(
-            {
-                "name": name,
-                "description": description,
-                "result": result,
-            }
-        )
-    def add_to_context(self, key:str, value:Any):
-        self.context[key] = value
-
-        
-    def format_memory(self):
-        return "".join(
-            f"Paso {i}: {step['name']}\nDescripción: {step['description']}\nResultado: {step['result']}\n\n"
-            for i, step in enumerate(self.step_results, 1)
+        # Guards the swap of the documents and their indexes when the documents change (see update_documents)
+        self.documents_lock = threading.Lock()
+        self.documents = documents
+        self.metadata_index = MetadataIndex(documents)
+        self.chunk_index = chunk_index
+        self.bm25_index = bm25_index if bm25_index is not None else BM25Index(documents)
+        self.compiled_workflow = self.compile_workflow(self.metadata_index, self.chunk_index, self.bm25_index)
+
+    def compile_workflow(self, metadata_index: MetadataIndex, chunk_index: ChunkIndex | None, bm25_index: BM25Index) -> CompiledWorkflow:
+        return CompiledWorkflow(
+            self.workflow,
+            llm_call=self.get_llm_output,
+            json_llm_call=self.get_valid_json_output,
+            stream_llm_call=self.get_streamed_llm_output,
+            metadata_config=self.metadata_config,
+            metadata_index=metadata_index,
+            chunk_index=chunk_index,
+            bm25_index=bm25_index,
         )
 
-
-    def run(self, query:str)->str:
-        self.context["query"] = query
-
-        
-        steps_by_id = {s.id: s for s in self.workflow}
-        step_ids = list(steps_by_id.keys())
-        current_step_index = 0
-        output = None
-
-        while current_step_index < len(step_ids):
-            step_id = step_ids[current_step_index]
-            s = steps_by_id[step_id]
-
-            step = StepFactory.create(
-                s,
-                global_context=self.context,
-                llm_call=self.get_llm_output,
-                json_llm_call=self.get_valid_json_output,
-                metadata_config=self.metadata_config,
-                add_to_memory = self.add_to_memory,
-                format_memory = self.format_memory,
-                add_to_context = self.add_to_context
-            )
-
-            output = step.run()
-            
-            if isinstance(output, dict) and "go_to" in output:
-                target_id = output["go_to"]
-                if target_id in steps_by_id:
-                    current_step_index = step_ids.index(target_id)
-                    continue
-                else:
-                    raise ValueError(f"Destination step '{target_id}' not found.")
-                
-            # self.context[s.output] = output
-            current_step_index += 1
+    def update_documents(self, documents: List[Document]):
+        """
+        Replaces the documents (e.g. after new actas are added to the data folder) without restarting.
+        The indexes are updated reusing the work done for the unchanged documents, and the runs
+        already in progress finish with the previous documents.
+        """
+        metadata_index = MetadataIndex(documents)
+        bm25_index = self.bm25_index.update(documents)
+        chunk_index = self.chunk_index.update(documents) if self.chunk_index is not None else None
+        compiled_workflow = self.compile_workflow(metadata_index, chunk_index, bm25_index)
+        with self.documents_lock:
+            self.documents = documents
+            self.metadata_index = metadata_index
+            self.bm25_index = bm25_index
+            self.chunk_index = chunk_index
+            self.compiled_workflow = compiled_workflow
+        self.logger.info(f"Documents updated: {[d.metadata.get('file_name') for d in documents]}")
+
+    def create_execution_context(
+        self,
+        query:str,
+        documents: List[Document] = None,
+        on_token: Callable[[str], None] = None,
+        deadline: float | None = None
+    ) -> ExecutionContext:
+        """`deadline` (time.monotonic()) ends the query earlier than its time budget, e.g. at the timeout of a request."""
+        query_time_budget = self.structured_output_config.query_time_budget
+        if query_time_budget:
+            budget_deadline = time.monotonic() + query_time_budget
+            deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+        documents = self.documents if documents is None else documents
+        return ExecutionContext({"documents": documents, "query": query}, deadline, on_token=on_token)
+
+    def run(self, query:str, on_token: Callable[[str], None] = None, deadline: float | None = None)->str:
+        """
+        `on_token` receives the text of the streamed steps (stream: True) as it is generated.
+        The structured output calls stop at `deadline` (time.monotonic()) if it comes before the query time budget.
+        """
+        with self.documents_lock:
+            documents, compiled_workflow = self.documents, self.compiled_workflow
+        execution = self.create_execution_context(query, documents, on_token, deadline)
+        output = compiled_workflow.run(execution)
 
         if output is None:
-            context_values = list(self.context.values())
+            context_values = list(execution.context.values())
             output = context_values[-1] if context_values else "No output."
 
-        self.reset()
         return output
-    
-    def reset(self):
-        self.step_results = []
-        self.context = {}
-        self.context["documents"] = self.documents
 
-    def get_llm_output(self, prompt):
+    def get_llm_output(self, prompt, use_cache=False):
+        """
+        Returns the visible text of the response, without reasoning. The raw response is cached, as in get_streamed_llm_output.
+        `use_cache` can be CompletionCache.REFRESH to replace the cached response.
+        """
+        cache_key = None
+        if use_cache and self.completion_cache is not None:
+            cache_key = CompletionCache.make_key(self.llm, prompt)
+            cached = self.completion_cache.get(cache_key) if use_cache != CompletionCache.REFRESH else None
+            if cached is not None:
+                return self.process_complete_response(cached)
+
         response = self.llm.complete(prompt)
-        return response.text
+        if cache_key is not None:
+            self.completion_cache.set(cache_key, response.text)
+        return self.process_complete_response(response.text)
+
+    def get_streamed_llm_output(self, prompt, on_token: Callable[[str], None], use_cache=False) -> str:
+        """Like get_llm_output, but sends the visible text (without reasoning) to `on_token` as it is generated and returns it."""
+        cache_key = None
+        cached = None
+        if use_cache and self.completion_cache is not None:
+            cache_key = CompletionCache.make_key(self.llm, prompt)
+            cached = self.completion_cache.get(cache_key) if use_cache != CompletionCache.REFRESH else None
+
+        deltas = []
+        def get_deltas():
+            if cached is not None:
+                yield cached
+                return
+            for response in self.llm.stream_complete(prompt):
+                deltas.append(response.delta or "")
+                yield deltas[-1]
+
+        texts = []
+        for text in LLMCallManager.process_stream_response(self.llm.model, get_deltas()):
+            on_token(text)
+            texts.append(text)
+
+        if cache_key is not None and cached is None:
+            self.completion_cache.set(cache_key, "".join(deltas))
+        return "".join(texts)
     
     def process_complete_response(self, complete):
         return LLMCallManager.process_complete_response(self.llm.model, complete)
     
-    def get_valid_json_output(self, prompt, keys=None):
+    def get_valid_json_output(self, prompt, keys=None, label=None, use_cache=False, deadline=None) -> SimpleNamespace | StructuredOutputFailure:
         if keys == None:
             keys = Utils.extract_json_keys_from_text(prompt)
-        while True:
-            try:
-                response = self.llm_json_output.complete(prompt)
-                response_str = self.process_complete_response(response)
-                data = json.loads(response_str)
-                
-                obj = SimpleNamespace(**data)
-
-                if keys:
-                    if all([key in data for key in keys]):
-                        self.logger.info("Valid JSON: %s", data)
-                        return obj
-                else:
-                    self.logger.info("Valid JSON: %s", data)
-                    return obj
-            except json.JSONDecodeError:
-                self.logger.info("Invalid JSON. Try it again.")
\ No newline at end of file
+
+        data = self.structured_output_caller.call(prompt, keys, label=label, deadline=deadline, use_cache=use_cache)
+        if isinstance(data, StructuredOutputFailure):
+            return data
+        return SimpleNamespace(**data)
+
+    def get_structured_output_stats(self):
+        return self.structured_output_caller.get_stats()
+
+    def get_completion_cache_stats(self):
+        return self.completion_cache.get_stats() if self.completion_cache else None
@@ -1,12 +1,18 @@
-import json
-from typing import Dict, List, Tuple, Union
+import asyncio
+from contextvars import ContextVar
+import time
+from typing import Callable, Dict, List, Tuple, Union
 from llama_index.llms.ollama import Ollama
-from llama_index.core.workflow import Workflow, Event, StartEvent, StopEvent, step
+from llama_index.core.workflow import Context, Workflow, Event, StartEvent, StopEvent, step
 from llama_index.core.schema import Document
 from logger_manager import LoggerManager
 from llama_index.core.vector_stores.types import MetadataInfo, VectorStoreInfo
+from config_loader.models import StructuredOutputConfig
+from data_processors.bm25_index import BM25Index
+from data_processors.metadata_index import MetadataIndex
+from utils.completion_cache import CompletionCache
 from utils.llm_call_manager import LLMCallManager
-import re
+from utils.structured_output_caller import StructuredOutputCaller, StructuredOutputFailure
 
 
 VECTOR_STORE_INFO = VectorStoreInfo(
@@ -56,26 +62,47 @@ def get_metadata_info(metadata_name:str|None):
             return metadata
     return None
 
+# Deadline of the query being run. Being a context variable, each concurrent run (and the tasks it creates) sees its own one
+QUERY_DEADLINE: ContextVar[float | None] = ContextVar("query_deadline", default=None)
+
 class GetFinalResponseEvent(Event):
     query:str
 
+class FinalResponseDeltaEvent(Event):
+    # Visible text (without reasoning) of the final response, streamed as it is generated
+    delta:str
+
 class QwenDocumentsBasedQAFlow(Workflow):
-    def __init__(self, llm:Ollama, llm_json_output:Ollama, **kwargs) -> None:
+    def __init__(self, llm:Ollama, llm_json_output:Ollama, structured_output_config: StructuredOutputConfig = None, completion_cache: CompletionCache = None, max_concurrency: int = 4, relevant_documents_top_k: int | None = None, bm25_index_path: str | None = None, stream_final_response: bool = False, **kwargs) -> None:
         super().__init__(**kwargs)
         self.logger = LoggerManager.get_logger(name=self.__class__.__name__)
         self.llm = llm
         self.llm_json_output = llm_json_output
-        self.step_results = []
+        self.completion_cache = completion_cache
+        self.structured_output_config = structured_output_config or StructuredOutputConfig()
+        self.structured_output_caller = StructuredOutputCaller(llm_json_output, self.structured_output_config, self.process_complete_response, completion_cache)
+        self.max_concurrency = max(1, max_concurrency)
+        self.metadata_index = None
+        # Individual queries only ask the `relevant_documents_top_k` documents with the best BM25 score (None asks all of them)
+        self.relevant_documents_top_k = relevant_documents_top_k
+        self.bm25_index_path = bm25_index_path
+        self.bm25_index = None
+        # Writes FinalResponseDeltaEvents to the event stream of the run (handler.stream_events())
+        self.stream_final_response = stream_final_response
 
 
     def process_complete_response(self, complete):
         return LLMCallManager.process_complete_response(self.llm.model, complete)
     
-    def init_step_results(self):
-        self.step_results = []
+    def init_deadline(self):
+        query_time_budget = self.structured_output_config.query_time_budget
+        QUERY_DEADLINE.set(time.monotonic() + query_time_budget if query_time_budget else None)
+
     @step
-    async def filter_documents(self, ev: StartEvent) -> GetFinalResponseEvent:
-        self.init_step_results()
+    async def filter_documents(self, ctx: Context, ev: StartEvent) -> GetFinalResponseEvent:
+        # The step results are kept in the run context, so the same flow can run several queries at once
+        self.init_deadline()
+        step_results = []
         query = ev.query
         documents = ev.documents
 
@@ -101,23 +128,30 @@ Si la fecha está incompleta, utiliza "%" para el día, el mes o el año faltant
 - Si solo se menciona "junio de 2023", devuelve: {{"fecha": "%/06/2023"}}
 - Si solo se menciona "2022", devuelve: {{"fecha": "%/%/2022"}}
 
-Devuelve el resultado en formato JSON con la clave "fecha", siguiendo exactamente una de estas dos estructuras:
+Si se menciona un periodo, devuelve sus fechas de inicio y fin separadas por " - ". Por ejemplo:
+- Si se menciona "entre marzo y junio de 2025", devuelve: {{"fecha": "%/03/2025 - %/06/2025"}}
+
+Devuelve el resultado en formato JSON con la clave "fecha", siguiendo exactamente una de estas tres estructuras:
 
 {{"fecha": "DD/MM/AAAA"}}
 o
+{{"fecha": "DD/MM/AAAA - DD/MM/AAAA"}}
+o
 {{"fecha": "None"}}
 
 CONSULTA: {query}
 """)
         filters = {}
-        name_response = self.get_valid_json_output(extract_name_prompt, ["persona"])
-        if name_response["persona"] != "None":
-            filters["lista_asistentes"] = name_response["persona"]
+        name_response = await self.aget_valid_json_output(extract_name_prompt, ["persona"], "extract_name", use_cache=True)
+        if name_response and name_response["persona"] != "None":
+            # Use the name as it is written in the documents (accents, second surname, small typos)
+            resolved_name = self.get_metadata_index(documents).name_index.resolve(name_response["persona"])
+            filters["lista_asistentes"] = resolved_name or name_response["persona"]
         self.logger.info(f"Output. Extract name: {str(name_response)}")
         
 
-        date_response = self.get_valid_json_output(extract_date_prompt, ["fecha"])
-        if date_response["fecha"] != "None":
+        date_response = await self.aget_valid_json_output(extract_date_prompt, ["fecha"], "extract_date", use_cache=True)
+        if date_response and date_response["fecha"] != "None":
             filters["fecha"] = date_response["fecha"]
         self.logger.info(f"Output. Extract date: {str(date_response)}")
 
@@ -152,7 +186,8 @@ CONSULTA: {query}
                     f"Por lo tanto, todos los documentos han sido descartados. Documentos excluidos: {no_relevant_docs_str}."
                 )
 
-                self.step_results.append(step_result)
+                step_results.append(step_result)
+                await ctx.store.set("step_results", step_results)
                 return GetFinalResponseEvent(query=query)
             else:
                 # Elimina la última coma y espacio si es necesario
@@ -161,14 +196,14 @@ CONSULTA: {query}
                     "Se han revisado todos los documentos disponibles y se han excluido aquellos que no coinciden con los filtros especificados."
                     f"Los documentos que no cumplen con estos criterios son los siguientes: {no_relevant_docs_str}"
                 )
-                self.step_results.append(step_result)
+                step_results.append(step_result)
         else:
             filtered_docs = documents
             step_result["resultado"] = (
                 f"A partir de la consulta '{query}', no se han extraído ningún filtro. "
                 "Por lo tanto no se excluyen ningún documento."
             )
-            self.step_results.append(step_result)
+            step_results.append(step_result)
         relevant_docs_str = ", ".join([d.metadata["file_name"] for d in filtered_docs])
         self.logger.info(f"Filtered Documents: {relevant_docs_str}")
         
@@ -189,6 +224,11 @@ CONSULTA: {query}
         if not is_global_query:
             query_to_analyze = query
             step_result["resultado"] = f"""Según el análisis, la consulta '{query}' es de tipo individual. Por ello, no hay necesidad de transformarla en una subconsulta."""
+            if self.relevant_documents_top_k and len(filtered_docs) > self.relevant_documents_top_k:
+                filtered_docs = self.get_bm25_index(documents).prune(query, filtered_docs, self.relevant_documents_top_k)
+                relevant_docs_str = ", ".join([d.metadata["file_name"] for d in filtered_docs])
+                self.logger.info(f"Relevant Documents: {relevant_docs_str}")
+                step_result["resultado"] += f" Se analizan solo los documentos más relevantes para la consulta: {relevant_docs_str}."
         else:
             if is_comparative_query:
                 step_result["resultado"] = (
@@ -196,12 +236,12 @@ CONSULTA: {query}
                 )
             else:
                 self.logger.info(f"This is a global query: {query}")
-                query_to_analyze = self.trasform_to_sub_query(query)
+                query_to_analyze = await self.atrasform_to_sub_query(query)
                 step_result["resultado"] = (
                 f"Según el análisis, la consulta '{query}' es de tipo global. Por ello, se obtiene una subconsulta para preguntar a cada reunión: {query_to_analyze}"
             )
 
-        self.step_results.append(step_result)
+        step_results.append(step_result)
 
         # Step 5: Return result
         step_result = {
@@ -211,16 +251,7 @@ CONSULTA: {query}
 
 
         if not is_comparative_query:
-            evidences = []
-            for d in filtered_docs:
-                response_str = self.get_evidence(d, query_to_analyze) # objeto jsons
-                for time in range(5):
-                    isTrue = self.evaluate(d, response_str)
-                    if isTrue:
-                        break
-                    response_str = self.get_evidence(d, query_to_analyze)
-                
-                evidences.append((d, response_str))
+            evidences = await self.aget_evidences(filtered_docs, query_to_analyze)
             info_str = self.format_evidences(evidences)
 
         else:
@@ -229,15 +260,17 @@ CONSULTA: {query}
         
         step_result["resultado"] = f"Se ha recopilado la siguiente información:\n {info_str}"
 
-        self.step_results.append(step_result)
+        step_results.append(step_result)
+        await ctx.store.set("step_results", step_results)
         return GetFinalResponseEvent(query=query)
 
     @step
-    def get_final_response(self, ev:GetFinalResponseEvent)->StopEvent:
+    async def get_final_response(self, ctx: Context, ev:GetFinalResponseEvent)->StopEvent:
         query = ev.query
+        step_results = await ctx.store.get("step_results", default=[])
         formatted_steps = "".join(
             f"Paso {i}: {step['name']}\nDescripción: {step['description']}\nResultado: {step['resultado']}\n\n"
-            for i, step in enumerate(self.step_results, 1)
+            for i, step in enumerate(step_results, 1)
         )
 
         
@@ -253,61 +286,62 @@ Consulta del usuario: {query}
 """
 
         self.logger.info(f"Prompt. Final Response Generator: {prompt}")
-        response = self.llm.complete(prompt)
-        response_str = self.process_complete_response(response)
+        if self.stream_final_response:
+            response_str = await self.astream_final_response(ctx, prompt)
+        else:
+            response = await self.llm.acomplete(prompt)
+            response_str = self.process_complete_response(response)
         self.logger.info(f"Output. Final Response Generator: {response_str}")
 
         return StopEvent(result=response_str)
 
+    async def arun_query(self, documents: List[Document], query: str, on_delta: Callable[[str], None] | None = None) -> str:
+        """Runs the flow and returns the final response. With stream_final_response, `on_delta` receives it as it is generated."""
+        handler = self.run(documents=documents, query=query)
+        async for event in handler.stream_events():
+            if isinstance(event, FinalResponseDeltaEvent) and on_delta is not None:
+                on_delta(event.delta)
+        return await handler
+
+    async def astream_final_response(self, ctx: Context, prompt: str) -> str:
+        response = await self.llm.astream_complete(prompt)
+        deltas = (r.delta or "" async for r in response)
+        texts = []
+        async for text in LLMCallManager.aprocess_stream_response(self.llm.model, deltas):
+            ctx.write_event_to_stream(FinalResponseDeltaEvent(delta=text))
+            texts.append(text)
+        return "".join(texts)
+
+    def get_metadata_index(self, documents: List[Document]) -> MetadataIndex:
+        metadata_index = self.metadata_index
+        if metadata_index is None or not metadata_index.covers(documents):
+            metadata_index = MetadataIndex(documents)
+            self.metadata_index = metadata_index
+        return metadata_index
+
+    def get_bm25_index(self, documents: List[Document]) -> BM25Index:
+        bm25_index = self.bm25_index
+        if bm25_index is None or bm25_index.documents is not documents:
+            bm25_index = BM25Index(documents, self.bm25_index_path)
+            self.bm25_index = bm25_index
+        return bm25_index
+
     def filter_documents_by_metadata(
         self,
         documents: List[Document],
         filters: Dict[str, Union[str, List[str]]]
     ) -> Tuple[List[Document], List[str]]:
-        filtered = []
-        unmatched_values = list(filters.values())
-        for doc in documents:
-            doc_matched = True
-
-            for key, value in filters.items():
-                metadata_value = str(doc.metadata.get(key, ""))
-
-                if key == "fecha":
-                    value_pattern = value.replace("%", ".*")
-                    if not re.search(value_pattern, metadata_value):
-                        doc_matched = False
-                    else:
-                        if value in unmatched_values:
-                            unmatched_values.remove(value)
-                else:
-                    if value not in metadata_value:
-                        doc_matched = False
-                    else:
-                        if value in unmatched_values:
-                            unmatched_values.remove(value)
-                        
-            if doc_matched:
-                filtered.append(doc)
-
-
+        filtered, unmatched_values, _ = self.get_metadata_index(documents).filter(filters)
         return filtered, unmatched_values
     
-    def get_valid_json_output(self, prompt, keys=None):
-        while True:
-            try:
-                response = self.llm_json_output.complete(prompt)
-                response_str = self.process_complete_response(response)
-                datos = json.loads(response_str)
-                
-                if keys:
-                    if all([key in datos for key in keys]):
-                        self.logger.info("Valid JSON:", datos)
-                        return datos
-                else:
-                    self.logger.info("Valid JSON:", datos)
-                    return datos
-            except json.JSONDecodeError:
-                self.logger.info("Invalid JSON. Try it again.")
+    async def aget_valid_json_output(self, prompt, keys=None, label=None, use_cache=False) -> dict | StructuredOutputFailure:
+        return await self.structured_output_caller.acall(prompt, keys, label=label, deadline=QUERY_DEADLINE.get(), use_cache=use_cache)
+
+    def get_structured_output_stats(self):
+        return self.structured_output_caller.get_stats()
+
+    def get_completion_cache_stats(self):
+        return self.completion_cache.get_stats() if self.completion_cache else None
 
     def is_global_query(self, query:str):
         results = []
@@ -333,7 +367,7 @@ Consulta del usuario: {query}
             
         return False
     
-    def trasform_to_sub_query(self, query:str):
+    async def atrasform_to_sub_query(self, query:str):
         prompt = (f"""
         Transforma preguntas globales que requieren revisar múltiples documentos (como actas de reuniones) en preguntas individuales que puedan aplicarse a cada documento por separado.
         Pasos:
@@ -358,12 +392,14 @@ Consulta del usuario: {query}
         }}
         """)
         self.logger.info(f"Prompt. Transform to a individual question: {prompt}")
-        data = self.get_valid_json_output(prompt)
+        data = await self.aget_valid_json_output(prompt, ["pregunta_individual"], "transform_to_sub_query", use_cache=True)
         self.logger.info(f"Output. Transform to a individual question: {str(data)}")
 
+        if not data:
+            return query
         return data["pregunta_individual"]
     
-    def get_evidence(self, document:Document, query:str):
+    def get_evidence_prompt(self, document:Document, query:str):
         doc_filename = document.metadata["file_name"]
         metadata_str = []
         for k, v in document.metadata.items():
@@ -410,12 +446,43 @@ Consulta del usuario: {query}
         """
         )
         self.logger.info(f"Prompt. Get response by document: {prompt}")
-        data = self.get_valid_json_output(prompt)
-        self.logger.info(f"Output. Get response by document: {str(data)}")
+        return prompt
 
+    def process_evidence(self, data):
+        self.logger.info(f"Output. Get response by document: {str(data)}")
+        if not data:
+            return None
         answer = data["respuesta"]
         evidence = data["evidencia"]
         return f"{answer} (Evidencia textual: {evidence})"
+
+    async def aget_evidence(self, document:Document, query:str):
+        prompt = self.get_evidence_prompt(document, query)
+        data = await self.aget_valid_json_output(prompt, ["respuesta", "evidencia"], "get_evidence")
+        return self.process_evidence(data)
+
+    async def aget_evidences(self, documents:List[Document], query:str) -> List[Tuple[Document, str]]:
+        """Gets the verified evidence of every document, with at most `max_concurrency` documents in progress."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # gather keeps the order of the documents, so format_evidences lists them as before
+        responses = await asyncio.gather(
+            *[self.aget_verified_evidence(d, query, semaphore) for d in documents]
+        )
+        return list(zip(documents, responses))
+
+    async def aget_verified_evidence(self, document:Document, query:str, semaphore:asyncio.Semaphore):
+        """Gets the evidence of a document, asking again (up to 5 times) while the evaluator considers it invented."""
+        async with semaphore:
+            response_str = await self.aget_evidence(document, query)
+            for _ in range(5):
+                isTrue = response_str is not None and await self.aevaluate(document, response_str)
+                if isTrue:
+                    break
+                response_str = await self.aget_evidence(document, query)
+
+        if response_str is None:
+            response_str = "No se ha podido obtener información de este documento."
+        return response_str
     
     def format_evidences(self, evidences):
         evidences_str = ""
@@ -450,7 +517,7 @@ Consulta del usuario: {query}
         return documents_str
     
 
-    def evaluate(self, document:Document, answer):
+    def get_evaluation_prompt(self, document:Document, answer):
         doc_filename = document.metadata["file_name"]
         metadata_str = []
         for k, v in document.metadata.items():
@@ -481,7 +548,15 @@ Responde en formato json con dos claves: "evaluation" y "justification" de tipo
 }}
 """)
         self.logger.info(f"Prompt. Response Evaluator: {prompt}")
-        data = self.get_valid_json_output(prompt, ["evaluation", "justification"])
-        self.logger.info(f"Output. Response Evaluator: {str(data)}")
+        return prompt
 
-        return not data["evaluation"].lower().startswith("inventada")
\ No newline at end of file
+    def process_evaluation(self, data):
+        self.logger.info(f"Output. Response Evaluator: {str(data)}")
+        if not data:
+            return False
+        return not data["evaluation"].lower().startswith("inventada")
+
+    async def aevaluate(self, document:Document, answer):
+        prompt = self.get_evaluation_prompt(document, answer)
+        data = await self.aget_valid_json_output(prompt, ["evaluation", "justification"], "evaluate")
+        return self.process_evaluation(data)
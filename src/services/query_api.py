@@ -0,0 +1,155 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from aiohttp import web
+
+from config_loader.models import ServerConfig
+from logger_manager import LoggerMixin
+from new_workflow import DocumentsBasedQAFlowExecutor
+from utils.llm_call_manager import LLMCallManager
+
+class QueryAPI(LoggerMixin):
+    """
+    HTTP/JSON API over an executor loaded once:
+
+    - POST /query {"query": "...", "timeout": 60} answers a query. The runs use a pool of `max_concurrency` threads
+      and up to `max_queue_size` more wait for one; beyond that the API answers 429, so the clients back off.
+      A query that is not answered within its timeout gets 504 (the run is cancelled if it had not started yet,
+      and its structured output calls stop at the timeout if it had).
+    - GET /health answers 200 while the API accepts queries and 503 while it shuts down, so the load balancer drains it.
+    - GET /metrics returns the counters of the API and the stats of the executor.
+
+    On SIGINT/SIGTERM the API stops accepting queries and waits up to `shutdown_timeout` seconds for the ones in progress.
+    """
+    def __init__(self, executor: DocumentsBasedQAFlowExecutor, config: ServerConfig = None):
+        super().__init__()
+        self.executor = executor
+        self.config = config or ServerConfig()
+        self.pool: ThreadPoolExecutor | None = None
+        self.stopping = False
+        # Queries accepted and not finished yet (running or waiting for a thread). Only changed in the event loop
+        self.pending = 0
+        self.running = 0
+        self.metrics: Dict[str, Any] = {
+            "requests": 0,
+            "responses": {},
+            "latency": {"count": 0, "total": 0.0, "max": 0.0},
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/query", self.handle_query),
+            web.get("/health", self.handle_health),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    def run(self):
+        self.logger.info(f"Query API listening on http://{self.config.host}:{self.config.port}")
+        web.run_app(self.create_app(), host=self.config.host, port=self.config.port, shutdown_timeout=self.config.shutdown_timeout, print=None)
+
+    async def on_startup(self, app: web.Application):
+        self.stopping = False
+        self.pool = ThreadPoolExecutor(max_workers=self.config.max_concurrency, thread_name_prefix="QueryAPI")
+
+    async def on_shutdown(self, app: web.Application):
+        self.stopping = True
+        self.logger.info(f"Query API shutting down. Queries in progress: {self.pending}")
+
+    async def on_cleanup(self, app: web.Application):
+        # The queries that timed out may still be running in the pool
+        pool, self.pool = self.pool, None
+        await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(wait=True, cancel_futures=True))
+
+    def respond(self, status: int, data: Dict[str, Any]) -> web.Response:
+        responses = self.metrics["responses"]
+        responses[str(status)] = responses.get(str(status), 0) + 1
+        return web.json_response(data, status=status, dumps=lambda d: json.dumps(d, ensure_ascii=False, default=str))
+
+    def get_timeout(self, data: Dict[str, Any]) -> float:
+        timeout = data.get("timeout", self.config.request_timeout)
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise ValueError("\"timeout\" must be a positive number of seconds.")
+        return min(float(timeout), self.config.request_timeout)
+
+    async def handle_query(self, request: web.Request) -> web.Response:
+        self.metrics["requests"] += 1
+        if self.stopping or self.pool is None:
+            return self.respond(503, {"error": "The service is shutting down."})
+
+        try:
+            data = await request.json()
+            query = data.get("query") if isinstance(data, dict) else None
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("The body must be a JSON object with a non empty \"query\".")
+            timeout = self.get_timeout(data)
+        except ValueError as e:
+            return self.respond(400, {"error": str(e)})
+
+        if self.pending >= self.config.max_concurrency + self.config.max_queue_size:
+            return self.respond(429, {"error": "Too many queries in progress. Try again later."})
+
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self.pending += 1
+        # The time waiting for a thread counts, so the structured output calls stop when the client stops waiting
+        future = self.pool.submit(self.run_query, loop, query, start + timeout)
+        # The slot is released when the run really ends, not when the client stops waiting for it
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+        try:
+            response = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.logger.info(f"Query timed out after {timeout} seconds: {query}")
+            return self.respond(504, {"error": f"The query was not answered within {timeout} seconds."})
+        except Exception as e:
+            self.logger.info(f"Query failed: {query}. Error: {e}")
+            return self.respond(500, {"error": "The query could not be answered."})
+
+        elapsed = time.monotonic() - start
+        latency = self.metrics["latency"]
+        latency["count"] += 1
+        latency["total"] += elapsed
+        latency["max"] = max(latency["max"], elapsed)
+        return self.respond(200, {"query": query, "response": response, "elapsed": round(elapsed, 3)})
+
+    def run_query(self, loop: asyncio.AbstractEventLoop, query: str, deadline: float) -> Any:
+        loop.call_soon_threadsafe(self.change_running, 1)
+        try:
+            return self.executor.run(query=query, deadline=deadline)
+        finally:
+            loop.call_soon_threadsafe(self.change_running, -1)
+
+    def change_running(self, delta: int):
+        self.running += delta
+
+    def release(self):
+        self.pending -= 1
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        if self.stopping:
+            return web.json_response({"status": "stopping"}, status=503)
+        return web.json_response({"status": "ok", "documents": len(self.executor.documents)})
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        latency = self.metrics["latency"]
+        return web.json_response({
+            "requests": self.metrics["requests"],
+            "responses": dict(self.metrics["responses"]),
+            "running": self.running,
+            "queued": self.pending - self.running,
+            "latency": {
+                "count": latency["count"],
+                "average": latency["total"] / latency["count"] if latency["count"] else 0.0,
+                "max": latency["max"],
+            },
+            "structured_output": self.executor.get_structured_output_stats(),
+            "completion_cache": self.executor.get_completion_cache_stats(),
+            "reasoning": LLMCallManager.get_reasoning_stats(),
+        }, dumps=lambda d: json.dumps(d, ensure_ascii=False, default=str))
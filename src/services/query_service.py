@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Optional
+
+from logger_manager import LoggerMixin
+
+# Runs a query and returns its response. The optional callback receives the final response as it is generated
+QueryFunction = Callable[[str, Optional[Callable[[str], None]]], Awaitable[str]]
+
+class QueryService(LoggerMixin):
+    """
+    Runs the queries of every client (e.g. the sessions of the chatbot) in one asyncio event loop
+    that lives in a dedicated thread for the whole process.
+
+    The documents, indexes and LLM clients used by `run_query` are created once and shared, and `submit`
+    can be called from any thread: it returns a Future instead of blocking, so the clients do not wait for
+    each other. At most `max_concurrency` queries run at the same time; the rest wait for their turn.
+    """
+    def __init__(self, run_query: QueryFunction, max_concurrency: int = 4):
+        super().__init__()
+        self.run_query = run_query
+        self.max_concurrency = max(1, max_concurrency)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: threading.Thread | None = None
+        self.semaphore: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.thread = threading.Thread(target=self.loop.run_forever, name="QueryService", daemon=True)
+            self.thread.start()
+        self.logger.info(f"Query service started (max_concurrency={self.max_concurrency}).")
+
+    def stop(self):
+        with self._lock:
+            if self.thread is None:
+                return
+            loop, thread = self.loop, self.thread
+            self.loop = self.thread = None
+
+        async def cancel_queries():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_queries(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        self.logger.info("Query service stopped.")
+
+    def submit(self, query: str, on_delta: Callable[[str], None] | None = None) -> Future:
+        """
+        Schedules the query and returns the Future of its response. `on_delta` is called from the thread
+        of the service, so it must be thread safe (e.g. the put of a queue read by the client).
+        """
+        loop = self.loop
+        if loop is None:
+            raise RuntimeError("The query service is not running: call start() first.")
+        return asyncio.run_coroutine_threadsafe(self._run(query, on_delta), loop)
+
+    async def _run(self, query: str, on_delta: Callable[[str], None] | None) -> str:
+        async with self.semaphore:
+            return await self.run_query(query, on_delta)
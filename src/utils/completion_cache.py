@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from llama_index.core.llms import LLM
+
+from config_loader.models import CompletionCacheConfig
+
+class CompletionCache(ABC):
+    """
+    Cache of LLM completions keyed by model, generation options and prompt text.
+
+    The calls that take `use_cache` also accept REFRESH: the cached completion is not read, but the new one
+    is stored (e.g. to retry a completion that was rejected without keeping the rejected one in the cache).
+    """
+    REFRESH = "refresh"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(llm: LLM, prompt: str, **options) -> str:
+        key_options = {
+            "temperature": getattr(llm, "temperature", None),
+            "json_mode": getattr(llm, "json_mode", None),
+        } | options
+        raw_key = json.dumps(
+            {"model": getattr(llm, "model", None), "options": key_options, "prompt": prompt},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        self._set(key, value)
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: str):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total > 0 else 0.0,
+            }
+
+    @staticmethod
+    def from_config(config: CompletionCacheConfig) -> "CompletionCache":
+        if config.sqlite_path:
+            return SQLiteCompletionCache(config.sqlite_path, config.max_entries)
+        return LRUCompletionCache(config.max_entries)
+
+class LRUCompletionCache(CompletionCache):
+    def __init__(self, max_entries: int = 1024):
+        super().__init__()
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self._entries_lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._entries_lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._entries_lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class SQLiteCompletionCache(LRUCompletionCache):
+    """In-memory LRU backed by a SQLite file, so completions survive between runs."""
+    def __init__(self, file_path: str, max_entries: int = 1024):
+        super().__init__(max_entries)
+        folder_path = os.path.dirname(file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _get(self, key: str) -> Optional[str]:
+        value = super()._get(key)
+        if value is not None:
+            return value
+
+        with self._db_lock:
+            row = self.connection.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        super()._set(key, row[0])
+        return row[0]
+
+    def _set(self, key: str, value: str):
+        super()._set(key, value)
+        with self._db_lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO completions (key, value) VALUES (?, ?)", (key, value))
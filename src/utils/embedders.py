@@ -0,0 +1,81 @@
+import re
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+from ollama import Client
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors, one row per text."""
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Identifies the vectors of the embedder, so vectors of different embedders are never mixed."""
+        pass
+
+    @abstractmethod
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        pass
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.normalize(np.asarray(self._embed(texts), dtype=np.float32))
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+class OllamaEmbedder(Embedder):
+    """Embeddings of a local Ollama embedding model (e.g. "nomic-embed-text")."""
+    def __init__(self, model_name: str, base_url: str | None = None, batch_size: int = 32):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.client = Client(host=base_url)
+
+    @property
+    def name(self) -> str:
+        return f"ollama:{self.model_name}"
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            response = self.client.embed(model=self.model_name, input=texts[i:i + self.batch_size])
+            embeddings.extend(response.embeddings)
+        return np.array(embeddings, dtype=np.float32)
+
+class HashingEmbedder(Embedder):
+    """
+    Local stand-in that needs no model: words and word bigrams (casefolded, without accents) are hashed
+    into `dimensions` buckets with a random sign. It finds the chunks that share the words of the query,
+    so it is useful when no embedding model is available.
+    """
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, dimensions: int = 1024):
+        self.dimensions = dimensions
+
+    @property
+    def name(self) -> str:
+        return f"hashing:{self.dimensions}"
+
+    @classmethod
+    def get_tokens(cls, text: str) -> List[str]:
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+        words = cls.TOKEN_PATTERN.findall(text)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.get_tokens(text):
+                # crc32 instead of hash(): the vectors are persisted, so the hash must not change between runs
+                token_hash = zlib.crc32(token.encode("utf-8"))
+                sign = 1.0 if token_hash & 0x80000000 else -1.0
+                vectors[row, token_hash % self.dimensions] += sign
+        return vectors
@@ -1,15 +1,22 @@
+import asyncio
 import json
-import re
-from llama_index.core.vector_stores.types import VectorStoreInfo
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Tuple
+from llama_index.core.schema import Document
+from llama_index.core.vector_stores.types import MetadataInfo, VectorStoreInfo
+from config_loader.models import StructuredOutputConfig
+from data_processors.metadata_cache import MetadataCache
+from logger_manager import LoggerManager
 from metaclasses import SingletonMeta
 from utils.llm_manager import LLMManager
+from utils.structured_output_caller import StructuredOutputCaller
+from utils.think_tag_filter import ReasoningStats, ThinkTagFilter
 from llama_index.core.llms import LLM
 
 from utils.utils import Utils
 
-MODELS_WITH_THINKING = ["qwen3:4b"]
-
 class LLMCallManager(metaclass=SingletonMeta):
+    # Reasoning removed from the responses of the thinking models, shared by every caller
+    reasoning_stats = ReasoningStats()
     
     def init(self):
        self.llm = LLMManager().create_json_output_llm()
@@ -27,16 +34,12 @@ class LLMCallManager(metaclass=SingletonMeta):
         return result
 
     @staticmethod
-    def get_document_all_metadata_by_custom_llm(llm: LLM, vector_store_info: VectorStoreInfo, document: str):
-        metadata_infos = vector_store_info.metadata_info
-        result = {}
-
-        for i, metadata_info in enumerate(metadata_infos):
-            field_name = metadata_info.name
-            field_type = metadata_info.type
-            field_description = metadata_info.description
+    def get_field_metadata_prompt(metadata_info: MetadataInfo, document: str) -> str:
+        field_name = metadata_info.name
+        field_type = metadata_info.type
+        field_description = metadata_info.description
 
-            prompt = f"""
+        return f"""
     Extrae el valor del siguiente campo de metadatos a partir del contexto proporcionado.
 
     Campo: '{field_name}'  
@@ -51,28 +54,246 @@ class LLMCallManager(metaclass=SingletonMeta):
     Contexto:
     {document}
     """
-            if field_type == "list":
-                valid_list = False
-                while not valid_list:
-                    response = llm.complete(prompt)
-                    partial_result = json.loads(response.text)
-                    if type(partial_result[field_name]) == list:
-                        valid_list = True
-                        if field_name in partial_result:
-                            result[field_name] = partial_result[field_name]
-            else:        
-                # Llamada al LLM
-                response = llm.complete(prompt)
-                partial_result = json.loads(response.text)
-                if field_name in partial_result:
-                    result[field_name] = partial_result[field_name]
 
+    @staticmethod
+    def _get_field_metadata_validator(metadata_info: MetadataInfo):
+        field_name = metadata_info.name
+        if metadata_info.type == "list":
+            return lambda data: type(data.get(field_name)) == list
+        return None
+
+    @staticmethod
+    async def aget_field_metadata_by_custom_llm(caller: StructuredOutputCaller, metadata_info: MetadataInfo, document: str, semaphore: asyncio.Semaphore) -> Tuple[bool, Any]:
+        field_name = metadata_info.name
+        prompt = LLMCallManager.get_field_metadata_prompt(metadata_info, document)
+
+        async with semaphore:
+            data = await caller.acall(
+                prompt,
+                keys=[field_name],
+                label=f"metadata:{field_name}",
+                validate=LLMCallManager._get_field_metadata_validator(metadata_info),
+            )
+        if not data:
+            return False, None
+        return True, data[field_name]
+
+    @staticmethod
+    def get_all_fields_metadata_prompt(metadata_infos: List[MetadataInfo], document: str) -> str:
+        strs_to_prompt = [
+            f"{i+1}) '{metadata_info.name}' (Tipo: {metadata_info.type}. Descripción: {metadata_info.description})"
+            for i, metadata_info in enumerate(metadata_infos)
+        ]
+        fields_str = "\n    ".join(strs_to_prompt)
+
+        return f"""
+    Extrae el valor de los siguientes campos de metadatos a partir del contexto proporcionado.
+
+    {fields_str}
+
+    Devuelve únicamente un JSON con {len(metadata_infos)} claves, una por cada campo.
+
+    No incluyas ningún texto adicional fuera del JSON.
+
+    Contexto:
+    {document}
+    """
+
+    @staticmethod
+    def get_metadata_json_schema(metadata_infos: List[MetadataInfo]) -> dict:
+        properties = {}
+        for metadata_info in metadata_infos:
+            if metadata_info.type == "list":
+                properties[metadata_info.name] = {"type": "array", "items": {"type": "string"}}
+            elif metadata_info.type == "int":
+                properties[metadata_info.name] = {"type": "integer"}
+            else:
+                properties[metadata_info.name] = {"type": "string"}
+
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": [metadata_info.name for metadata_info in metadata_infos],
+        }
+
+    @staticmethod
+    def validate_field_value(metadata_info: MetadataInfo, value: Any) -> Tuple[bool, Any]:
+        if metadata_info.type == "list":
+            return type(value) == list, value
+        if metadata_info.type == "int":
+            if type(value) == int:
+                return True, value
+            if type(value) == str and value.strip().isdigit():
+                return True, int(value.strip())
+            return False, None
+        if metadata_info.type == "str":
+            return type(value) == str, value
+        return value is not None, value
+
+    @staticmethod
+    def get_valid_fields(metadata_infos: List[MetadataInfo], partial_result: dict) -> dict:
+        if not partial_result:
+            return {}
+
+        result = {}
+        for metadata_info in metadata_infos:
+            if metadata_info.name in partial_result:
+                valid, value = LLMCallManager.validate_field_value(metadata_info, partial_result[metadata_info.name])
+                if valid:
+                    result[metadata_info.name] = value
         return result
 
     @staticmethod
-    def process_complete_response(model_name, complete_response):
-        if model_name in MODELS_WITH_THINKING:
-            result_str = str(complete_response)
-            return re.sub(r'<think>.*?</think>', '', result_str, flags=re.DOTALL).strip('\n')
+    async def aget_fields_metadata_by_custom_llm(caller: StructuredOutputCaller, metadata_infos: List[MetadataInfo], document: str, semaphore: asyncio.Semaphore) -> dict:
+        outputs = await asyncio.gather(*[
+            LLMCallManager.aget_field_metadata_by_custom_llm(caller, metadata_info, document, semaphore)
+            for metadata_info in metadata_infos
+        ])
+        return {
+            metadata_info.name: value
+            for metadata_info, (found, value) in zip(metadata_infos, outputs)
+            if found
+        }
+
+    @staticmethod
+    async def aget_fields_metadata_in_one_call_by_custom_llm(caller: StructuredOutputCaller, metadata_infos: List[MetadataInfo], document: str, semaphore: asyncio.Semaphore) -> dict:
+        """
+        Requests every field in a single JSON-schema-constrained call and only asks
+        again, field by field, for the values that are missing or have a wrong type.
+        """
+        if not metadata_infos:
+            return {}
+
+        prompt = LLMCallManager.get_all_fields_metadata_prompt(metadata_infos, document)
+        async with semaphore:
+            data = await caller.acall(prompt, label="metadata:all_fields", format=LLMCallManager.get_metadata_json_schema(metadata_infos))
+        result = LLMCallManager.get_valid_fields(metadata_infos, data)
+
+        failed_metadata_infos = [m for m in metadata_infos if m.name not in result]
+        result.update(await LLMCallManager.aget_fields_metadata_by_custom_llm(caller, failed_metadata_infos, document, semaphore))
+        return result
+
+    @staticmethod
+    def _get_cached_metadata(model_name: str, metadata_infos: List[MetadataInfo], metadata_cache: MetadataCache, document_hash: str) -> Tuple[dict, List[MetadataInfo]]:
+        cached = {}
+        missing_metadata_infos = []
+        for metadata_info in metadata_infos:
+            if metadata_cache is not None and document_hash is not None:
+                found, value = metadata_cache.get(document_hash, metadata_info, model_name)
+                if found:
+                    cached[metadata_info.name] = value
+                    continue
+            missing_metadata_infos.append(metadata_info)
+        return cached, missing_metadata_infos
+
+    @staticmethod
+    def _merge_metadata(model_name: str, metadata_infos: List[MetadataInfo], cached: dict, extracted: dict, metadata_cache: MetadataCache, document_hash: str) -> dict:
+        result = {}
+        for metadata_info in metadata_infos:
+            if metadata_info.name in extracted:
+                result[metadata_info.name] = extracted[metadata_info.name]
+                if metadata_cache is not None and document_hash is not None:
+                    metadata_cache.set(document_hash, metadata_info, model_name, extracted[metadata_info.name])
+            elif metadata_info.name in cached:
+                result[metadata_info.name] = cached[metadata_info.name]
+        return result
+
+    @staticmethod
+    async def aget_document_all_metadata_by_custom_llm(llm: LLM, vector_store_info: VectorStoreInfo, document: str, semaphore: asyncio.Semaphore, metadata_cache: MetadataCache = None, document_hash: str = None, single_call: bool = False, caller: StructuredOutputCaller = None):
+        caller = caller or StructuredOutputCaller(llm)
+        metadata_infos = vector_store_info.metadata_info
+        cached, missing_metadata_infos = LLMCallManager._get_cached_metadata(llm.model, metadata_infos, metadata_cache, document_hash)
+
+        if single_call:
+            extracted = await LLMCallManager.aget_fields_metadata_in_one_call_by_custom_llm(caller, missing_metadata_infos, document, semaphore)
         else:
-            return str(complete_response)
\ No newline at end of file
+            extracted = await LLMCallManager.aget_fields_metadata_by_custom_llm(caller, missing_metadata_infos, document, semaphore)
+
+        return LLMCallManager._merge_metadata(llm.model, metadata_infos, cached, extracted, metadata_cache, document_hash)
+
+    @staticmethod
+    def get_documents_all_metadata_by_custom_llm(llm: LLM, vector_store_info: VectorStoreInfo, documents: List[Document], data_folder_path: str, metadata_cache: MetadataCache = None, single_call: bool = False, structured_output_config: StructuredOutputConfig = None):
+        """Extracts the metadata of the documents one LLM call at a time, with `aget_documents_all_metadata_by_custom_llm`."""
+        asyncio.run(LLMCallManager.aget_documents_all_metadata_by_custom_llm(
+            llm, vector_store_info, documents, data_folder_path, metadata_cache, 1, single_call, structured_output_config
+        ))
+
+    @staticmethod
+    async def aget_documents_all_metadata_by_custom_llm(llm: LLM, vector_store_info: VectorStoreInfo, documents: List[Document], data_folder_path: str, metadata_cache: MetadataCache = None, max_concurrency: int = 4, single_call: bool = False, structured_output_config: StructuredOutputConfig = None):
+        """
+        Extracts the metadata of the documents and merges it into `Document.metadata` following the order of the metadata fields.
+        The LLM calls of all the documents and fields are fanned out with at most `max_concurrency` requests in flight.
+        """
+        logger = LoggerManager.get_logger(name=LLMCallManager.__name__)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        caller = StructuredOutputCaller(llm, structured_output_config)
+
+        async def aget_metadata(d: Document) -> dict:
+            # Hashing may read the whole PDF, so it runs in a thread instead of delaying the requests of the other documents
+            document_hash = await asyncio.to_thread(MetadataCache.compute_document_hash, d, data_folder_path) if metadata_cache else None
+            return await LLMCallManager.aget_document_all_metadata_by_custom_llm(
+                llm,
+                vector_store_info,
+                d.text,
+                semaphore,
+                metadata_cache,
+                document_hash,
+                single_call,
+                caller,
+            )
+
+        metadatas = await asyncio.gather(*[aget_metadata(d) for d in documents])
+
+        for d, metadata in zip(documents, metadatas):
+            d.metadata.update(metadata)
+            doc_filename = d.metadata["file_name"]
+            logger.info(f"Extracted Metadata for the document {doc_filename}: {metadata}")
+
+        logger.info(f"Metadata extraction attempts: {caller.get_stats()}")
+        if metadata_cache:
+            metadata_cache.save()
+            logger.info(f"Metadata cache stats: {metadata_cache.get_stats()}")
+
+    @staticmethod
+    def create_think_filter(model_name) -> ThinkTagFilter | None:
+        return ThinkTagFilter() if LLMManager.is_thinking_model(model_name) else None
+
+    @staticmethod
+    def get_reasoning_stats():
+        return LLMCallManager.reasoning_stats.get_stats()
+
+    @staticmethod
+    def process_complete_response(model_name, complete_response):
+        think_filter = LLMCallManager.create_think_filter(model_name)
+        if think_filter is None:
+            return str(complete_response)
+        result_str = think_filter.filter(str(complete_response))
+        LLMCallManager.reasoning_stats.record(model_name, think_filter)
+        return result_str
+
+    @staticmethod
+    def process_stream_response(model_name, deltas: Iterable[str]) -> Iterator[str]:
+        """Yields the visible text of a streamed response as it arrives, like process_complete_response does with the complete one."""
+        think_filter = LLMCallManager.create_think_filter(model_name)
+        for delta in deltas:
+            text = think_filter.feed(delta) if think_filter else delta
+            if text:
+                yield text
+        if think_filter:
+            text = think_filter.flush()
+            LLMCallManager.reasoning_stats.record(model_name, think_filter)
+            if text:
+                yield text
+
+    @staticmethod
+    async def aprocess_stream_response(model_name, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        think_filter = LLMCallManager.create_think_filter(model_name)
+        async for delta in deltas:
+            text = think_filter.feed(delta) if think_filter else delta
+            if text:
+                yield text
+        if think_filter:
+            text = think_filter.flush()
+            LLMCallManager.reasoning_stats.record(model_name, think_filter)
+            if text:
+                yield text
@@ -6,8 +6,15 @@ from llama_index.llms.ollama import Ollama
 from llama_index.core import Settings
 
 from metaclasses import SingletonMeta
+from utils.embedders import Embedder, HashingEmbedder, OllamaEmbedder
+
+# Models that write their reasoning between <think> tags unless their LLMConfig says otherwise
+MODELS_WITH_THINKING = ["qwen3:4b"]
 
 class LLMManager(metaclass=SingletonMeta):
+    # Thinking setting of the models created from an LLMConfig that sets it
+    thinking_by_model = {}
+
     def init(self, llm_config:LLMConfig):
        self.llm_config = llm_config
        self._set_general_llm()
@@ -18,6 +25,7 @@ class LLMManager(metaclass=SingletonMeta):
         pass
 
     def create_llm(self):
+        LLMManager.register_thinking(self.llm_config)
         input_params = self.llm_config.model_dump_for_create_llm()
         return Ollama(**input_params)
     
@@ -27,6 +35,7 @@ class LLMManager(metaclass=SingletonMeta):
     #     return OllamaEmbedding(**input_params)
         
     def create_json_output_llm(self):
+        LLMManager.register_thinking(self.llm_config)
         input_params = self.llm_config.model_dump_for_create_llm()
         json_params = {
             "temperature": 0.0,
@@ -37,13 +46,24 @@ class LLMManager(metaclass=SingletonMeta):
 
         return Ollama(**filtered_params)
     
+    @staticmethod
+    def register_thinking(llm_config:LLMConfig):
+        if llm_config.thinking is not None:
+            LLMManager.thinking_by_model[llm_config.model_name] = llm_config.thinking
+
+    @staticmethod
+    def is_thinking_model(model_name:str) -> bool:
+        return LLMManager.thinking_by_model.get(model_name, model_name in MODELS_WITH_THINKING)
+
     @staticmethod
     def create_llm_by_config(llm_config:LLMConfig):
+        LLMManager.register_thinking(llm_config)
         input_params = llm_config.model_dump_for_create_llm()
         return Ollama(**input_params)
     
     @staticmethod
     def create_json_output_llm_by_config(llm_config:LLMConfig):
+        LLMManager.register_thinking(llm_config)
         input_params = llm_config.model_dump_for_create_llm()
         json_params = {
             # "temperature": 0.0,
@@ -51,4 +71,12 @@ class LLMManager(metaclass=SingletonMeta):
         }
 
         filtered_params = input_params | json_params
-        return Ollama(**filtered_params)
\ No newline at end of file
+        return Ollama(**filtered_params)
+
+    @staticmethod
+    def create_embedder_by_config(llm_config:LLMConfig) -> Embedder:
+        # Without an embedding model the chunks are embedded with the local hashing stand-in
+        if not llm_config.embedding_model_name:
+            return HashingEmbedder()
+        input_params = llm_config.model_dump_for_create_embed_model()
+        return OllamaEmbedder(**input_params)
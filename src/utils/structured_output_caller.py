@@ -0,0 +1,188 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from llama_index.core.llms import LLM
+
+from config_loader.models import StructuredOutputConfig
+from logger_manager import LoggerMixin
+from utils.completion_cache import CompletionCache
+
+class StructuredOutputFailure():
+    """
+    Typed result returned when no valid JSON output was obtained within the budget.
+    It evaluates to False, so the workflows can route on it (e.g. `if not name_obj`).
+    """
+    def __init__(self, label: str, reason: str, attempts: int, last_response: Optional[str] = None):
+        self.label = label
+        self.reason = reason
+        self.attempts = attempts
+        self.last_response = last_response
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"StructuredOutputFailure(label={self.label!r}, reason={self.reason!r}, attempts={self.attempts})"
+
+class StructuredOutputCaller(LoggerMixin):
+    """
+    Calls a JSON-output LLM until the response is a JSON object with the required keys,
+    with a maximum number of attempts, exponential backoff between attempts and a time budget.
+    """
+    def __init__(self, llm: LLM, config: StructuredOutputConfig = None, process_response: Callable[[Any], str] = str, completion_cache: CompletionCache = None):
+        super().__init__()
+        self.llm = llm
+        self.config = config or StructuredOutputConfig()
+        self.process_response = process_response
+        self.completion_cache = completion_cache
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_default_label(prompt: str) -> str:
+        return " ".join(prompt.split())[:60]
+
+    def get_deadline(self, deadline: Optional[float] = None) -> Optional[float]:
+        if self.config.time_budget is None:
+            return deadline
+        call_deadline = time.monotonic() + self.config.time_budget
+        return call_deadline if deadline is None else min(deadline, call_deadline)
+
+    def get_backoff(self, attempt: int, deadline: Optional[float]) -> Optional[float]:
+        """Returns the seconds to wait before the next attempt, or None if there is no time left for it."""
+        backoff = min(self.config.initial_backoff * (self.config.backoff_factor ** (attempt - 1)), self.config.max_backoff)
+        if deadline is not None and time.monotonic() + backoff >= deadline:
+            return None
+        return backoff
+
+    def parse(self, response_str: str, keys: Optional[List[str]], validate: Optional[Callable[[dict], bool]]) -> Optional[dict]:
+        data = json.loads(response_str)
+        if not isinstance(data, dict):
+            return None
+        if keys and not all(key in data for key in keys):
+            return None
+        if validate and not validate(data):
+            return None
+        return data
+
+    def get_cached(self, prompt: str, keys: Optional[List[str]], validate: Optional[Callable[[dict], bool]], use_cache: bool | str, llm_kwargs: dict) -> tuple[Optional[str], Optional[dict]]:
+        """
+        Returns the cache key (None if the cache is not used) and the cached valid output, if any.
+        With `use_cache=CompletionCache.REFRESH` the cache is not read, but the key is returned so set_cached writes the new output.
+        """
+        if not use_cache or self.completion_cache is None:
+            return None, None
+
+        cache_key = CompletionCache.make_key(self.llm, prompt, **llm_kwargs)
+        if use_cache == CompletionCache.REFRESH:
+            return cache_key, None
+        cached = self.completion_cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        return cache_key, self.parse(cached, keys, validate)
+
+    def set_cached(self, cache_key: Optional[str], data: dict):
+        """Stores the valid output under the key returned by get_cached, also in the REFRESH mode."""
+        if cache_key is not None:
+            self.completion_cache.set(cache_key, json.dumps(data, ensure_ascii=False))
+
+    def try_parse(self, response: Any, attempt: int, keys: Optional[List[str]], validate: Optional[Callable[[dict], bool]]) -> tuple[Optional[str], Optional[dict]]:
+        """Returns the processed response and the valid output of an attempt, logging why it is not valid."""
+        response_str = self.process_response(response)
+        try:
+            data = self.parse(response_str, keys, validate)
+        except json.JSONDecodeError:
+            self.logger.info(f"Invalid JSON (attempt {attempt}). Try it again.")
+            return response_str, None
+        if data is None:
+            self.logger.info(f"JSON without the expected structure (attempt {attempt}). Try it again.")
+        return response_str, data
+
+    def get_next_backoff(self, attempt: int, deadline: Optional[float]) -> tuple[Optional[float], str]:
+        """After a failed attempt, returns the seconds to wait before the next one, or None and the reason to stop."""
+        if attempt >= self.config.max_attempts:
+            return None, "max attempts reached"
+        backoff = self.get_backoff(attempt, deadline)
+        if backoff is None:
+            return None, "time budget exhausted"
+        return backoff, ""
+
+    def succeed(self, label: str, attempts: int, cache_key: Optional[str], data: dict) -> dict:
+        self._record(label, attempts, failed=False)
+        self.set_cached(cache_key, data)
+        self.logger.info("Valid JSON: %s", data)
+        return data
+
+    def fail(self, label: str, attempts: int, reason: str, response_str: Optional[str]) -> StructuredOutputFailure:
+        self._record(label, attempts, failed=True)
+        self.logger.info(f"No valid JSON output for \"{label}\" after {attempts} attempts: {reason}.")
+        return StructuredOutputFailure(label, reason, attempts, response_str)
+
+    def call(self, prompt: str, keys: Optional[List[str]] = None, label: Optional[str] = None, validate: Optional[Callable[[dict], bool]] = None, deadline: Optional[float] = None, use_cache: bool | str = False, **llm_kwargs) -> dict | StructuredOutputFailure:
+        label = label or self.get_default_label(prompt)
+        cache_key, data = self.get_cached(prompt, keys, validate, use_cache, llm_kwargs)
+        if data is not None:
+            self.logger.info("Valid JSON (cached): %s", data)
+            return data
+
+        deadline = self.get_deadline(deadline)
+        response_str = None
+        attempt = 0
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return self.fail(label, attempt, "time budget exhausted", response_str)
+            attempt += 1
+            try:
+                response_str, data = self.try_parse(self.llm.complete(prompt, **llm_kwargs), attempt, keys, validate)
+                if data is not None:
+                    return self.succeed(label, attempt, cache_key, data)
+            except Exception as e:
+                self.logger.info(f"Error calling the LLM (attempt {attempt}): {type(e).__name__} - {e}")
+
+            backoff, reason = self.get_next_backoff(attempt, deadline)
+            if backoff is None:
+                return self.fail(label, attempt, reason, response_str)
+            time.sleep(backoff)
+
+    async def acall(self, prompt: str, keys: Optional[List[str]] = None, label: Optional[str] = None, validate: Optional[Callable[[dict], bool]] = None, deadline: Optional[float] = None, use_cache: bool | str = False, **llm_kwargs) -> dict | StructuredOutputFailure:
+        """Async version of `call`, with the same attempts, backoff, cache and stats."""
+        label = label or self.get_default_label(prompt)
+        cache_key, data = self.get_cached(prompt, keys, validate, use_cache, llm_kwargs)
+        if data is not None:
+            self.logger.info("Valid JSON (cached): %s", data)
+            return data
+
+        deadline = self.get_deadline(deadline)
+        response_str = None
+        attempt = 0
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return self.fail(label, attempt, "time budget exhausted", response_str)
+            attempt += 1
+            try:
+                response_str, data = self.try_parse(await self.llm.acomplete(prompt, **llm_kwargs), attempt, keys, validate)
+                if data is not None:
+                    return self.succeed(label, attempt, cache_key, data)
+            except Exception as e:
+                self.logger.info(f"Error calling the LLM (attempt {attempt}): {type(e).__name__} - {e}")
+
+            backoff, reason = self.get_next_backoff(attempt, deadline)
+            if backoff is None:
+                return self.fail(label, attempt, reason, response_str)
+            await asyncio.sleep(backoff)
+
+    def _record(self, label: str, attempts: int, failed: bool):
+        with self._lock:
+            stats = self.stats.setdefault(label, {"calls": 0, "attempts": 0, "retries": 0, "failures": 0})
+            stats["calls"] += 1
+            stats["attempts"] += attempts
+            stats["retries"] += max(attempts - 1, 0)
+            if failed:
+                stats["failures"] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {label: dict(stats) for label, stats in self.stats.items()}
@@ -0,0 +1,100 @@
+import threading
+from typing import Dict
+
+
+class ThinkTagFilter():
+    """
+    State machine that removes the reasoning spans (<think>...</think>) of a response, complete or while it streams.
+
+    `feed` returns the visible text of each chunk as soon as it is known: only the end of a chunk that may be
+    the beginning of a tag is held back until the next one, so the reasoning is never buffered. The newlines at
+    the beginning and at the end of the visible text are dropped. The length of the reasoning and of the visible
+    text is counted, for the reasoning stats.
+    """
+    def __init__(self, start_tag: str = "<think>", end_tag: str = "</think>"):
+        self.start_tag = start_tag
+        self.end_tag = end_tag
+        self.in_reasoning = False
+        # End of the previous chunk that may be the beginning of a tag
+        self.pending = ""
+        # Newlines held until more visible text arrives, so the trailing ones are never emitted
+        self.newlines = ""
+        self.started = False
+        self.reasoning_length = 0
+        self.visible_length = 0
+
+    @staticmethod
+    def get_partial_tag_length(text: str, tag: str) -> int:
+        """Length of the longest end of the text that is the beginning of the tag."""
+        for length in range(min(len(text), len(tag) - 1), 0, -1):
+            if tag.startswith(text[-length:]):
+                return length
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        text = self.pending + chunk
+        self.pending = ""
+        visible = []
+        while text:
+            tag = self.end_tag if self.in_reasoning else self.start_tag
+            index = text.find(tag)
+            if index >= 0:
+                if self.in_reasoning:
+                    self.reasoning_length += index
+                else:
+                    visible.append(text[:index])
+                text = text[index + len(tag):]
+                self.in_reasoning = not self.in_reasoning
+                continue
+
+            partial_tag_length = self.get_partial_tag_length(text, tag)
+            if self.in_reasoning:
+                self.reasoning_length += len(text) - partial_tag_length
+            else:
+                visible.append(text[:len(text) - partial_tag_length])
+            self.pending = text[len(text) - partial_tag_length:]
+            break
+        return self.emit("".join(visible))
+
+    def flush(self) -> str:
+        """Returns the visible text held back at the end of the response."""
+        pending = self.pending
+        self.pending = ""
+        if self.in_reasoning:
+            # The reasoning was not closed (e.g. the response was cut)
+            self.reasoning_length += len(pending)
+            return ""
+        return self.emit(pending)
+
+    def filter(self, text: str) -> str:
+        """Returns the visible text of a complete response."""
+        return self.feed(text) + self.flush()
+
+    def emit(self, text: str) -> str:
+        if not self.started:
+            text = text.lstrip("\n")
+        text = self.newlines + text
+        visible = text.rstrip("\n")
+        self.newlines = text[len(visible):]
+        if visible:
+            self.started = True
+        self.visible_length += len(visible)
+        return visible
+
+
+class ReasoningStats():
+    """Characters of reasoning and of visible text of the filtered responses of each model, to monitor the cost of thinking."""
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, think_filter: ThinkTagFilter):
+        with self._lock:
+            stats = self.stats.setdefault(model_name, {"responses": 0, "reasoning_chars": 0, "visible_chars": 0})
+            stats["responses"] += 1
+            stats["reasoning_chars"] += think_filter.reasoning_length
+            stats["visible_chars"] += think_filter.visible_length
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model_name: dict(stats) for model_name, stats in self.stats.items()}
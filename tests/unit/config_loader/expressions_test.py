@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+
+from config_loader.expressions import Expression, ExpressionError
+
+
+class TestExpression:
+    def test_evaluates_against_context(self):
+        context = {
+            "apply_filters_results": [[], ["Juan"], {}],
+            "evaluation_results": SimpleNamespace(evaluation="Explícita"),
+            "is_global_query": True,
+            "is_comparative_query": False,
+        }
+
+        assert Expression("len(apply_filters_results[2]) == 0").evaluate(context) is True
+        assert Expression("evaluation_results.evaluation != 'Inventada'").evaluate(context) is True
+        assert Expression("is_global_query and not is_comparative_query").evaluate(context) is True
+        assert Expression("apply_filters_results[1]").names == ["apply_filters_results"]
+
+    @pytest.mark.parametrize("source", [
+        "__import__('os')",
+        "query.__class__",
+        "query.lower()",
+        "open('settings.yml')",
+        "[x for x in documents]",
+        "len(",
+    ])
+    def test_rejects_invalid_expressions(self, source):
+        with pytest.raises(ExpressionError):
+            Expression(source)
@@ -0,0 +1,130 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from config_loader.compiled_workflow import CompiledWorkflow
+from config_loader.execution_context import ExecutionContext
+from config_loader.models import CompositeStepModel, ForEachStepModel, GoToStepModel, LLMCallStepModel, SetVariableStepModel
+from config_loader.steps import StepFactory
+from utils.structured_output_caller import StructuredOutputFailure
+
+
+class TestForEachStep:
+    def test_parallel_keeps_input_order_and_isolates_context(self):
+        def llm_call(prompt, use_cache=False):
+            # The first items take longer, so they finish last
+            time.sleep(0.05 * (3 - int(prompt)))
+            return f"respuesta {prompt}"
+
+        model = ForEachStepModel.model_validate({
+            "step_type": "for_each",
+            "id": "for_each_item",
+            "iterate_obj": "items",
+            "collected_field": "response",
+            "output": "responses",
+            "parallel": True,
+            "max_concurrency": 3,
+            "step": {"step_type": "llm_call", "id": "call", "prompt": "{item}", "output": "response"},
+        })
+        execution = ExecutionContext({"items": ["0", "1", "2"]})
+
+        step = StepFactory.create(model, llm_call=llm_call)
+        result = step.run(execution)
+
+        assert result == ["respuesta 0", "respuesta 1", "respuesta 2"]
+        assert execution.context["responses"] == result
+        assert "item" not in execution.context and "response" not in execution.context
+
+
+class TestCompiledWorkflow:
+    def test_go_to_jumps_to_target(self):
+        workflow = [
+            SetVariableStepModel(step_type="set_variable", id="start", source="1", output="x"),
+            GoToStepModel(step_type="go_to", id="jump", target_id="end"),
+            SetVariableStepModel(step_type="set_variable", id="skipped", source="2", output="x"),
+            SetVariableStepModel(step_type="set_variable", id="end", source="x + 10", output="y"),
+        ]
+        execution = ExecutionContext()
+
+        output = CompiledWorkflow(workflow).run(execution)
+
+        assert output == 11
+        assert execution.context == {"x": 1, "y": 11}
+
+    def test_unknown_go_to_target_fails_at_compile_time(self):
+        workflow = [GoToStepModel(step_type="go_to", id="jump", target_id="missing")]
+
+        with pytest.raises(ValueError, match="missing"):
+            CompiledWorkflow(workflow)
+
+
+class TestLLMCallStep:
+    def test_stream_sends_tokens_to_the_run(self):
+        def stream_llm_call(prompt, on_token, use_cache=False):
+            for token in prompt.split():
+                on_token(token)
+            return prompt
+
+        model = LLMCallStepModel(step_type="llm_call", id="final", prompt="{query}", stream=True, output="final_response")
+        step = StepFactory.create(model, llm_call=lambda prompt, use_cache=False: "no stream", stream_llm_call=stream_llm_call)
+        tokens = []
+
+        assert step.run(ExecutionContext({"query": "hola mundo"})) == "no stream"
+        assert step.run(ExecutionContext({"query": "hola mundo"}, on_token=tokens.append)) == "hola mundo"
+        assert tokens == ["hola", "mundo"]
+
+    def test_json_output_cannot_be_streamed(self):
+        with pytest.raises(ValueError):
+            LLMCallStepModel(step_type="llm_call", id="final", prompt="{query}", json_output=True, stream=True, output="final_response")
+
+
+class TestEvaluateActionStep:
+    def test_failed_structured_output_is_not_evaluated_nor_formatted(self):
+        evaluated = []
+
+        def json_llm_call(prompt, label=None, use_cache=False, deadline=None):
+            if label == "check":
+                evaluated.append(prompt)
+                return SimpleNamespace(evaluation="Explícita")
+            if prompt == "doc_b":
+                return StructuredOutputFailure(label, "invalid_json", attempts=3)
+            return SimpleNamespace(nombre_fichero=prompt, respuesta=f"respuesta de {prompt}")
+
+        model = CompositeStepModel.model_validate({
+            "step_type": "composite",
+            "id": "answer",
+            "steps": [
+                {
+                    "step_type": "for_each",
+                    "id": "for_each_document",
+                    "iterate_obj": "documents",
+                    "collected_field": "evidence",
+                    "output": "evidences",
+                    "step": {
+                        "step_type": "action",
+                        "id": "check",
+                        "action": "evaluate",
+                        "json_output": True,
+                        "step": {"step_type": "llm_call", "id": "get_evidence", "json_output": True, "prompt": "{item}", "output": "evidence"},
+                        "prompt": "{evidence.respuesta}",
+                        "output": "evaluation",
+                        "condition": "evaluation.evaluation != 'Inventada'",
+                    },
+                },
+                {
+                    "step_type": "action",
+                    "id": "format_list",
+                    "action": "format_list",
+                    "inputs": ["evidences"],
+                    "format_template": "- {item.nombre_fichero}: {item.respuesta}",
+                    "output": "info_str",
+                },
+            ],
+        })
+        execution = ExecutionContext({"documents": ["doc_a", "doc_b"]})
+
+        StepFactory.create(model, llm_call=lambda prompt, use_cache=False: "", json_llm_call=json_llm_call).run(execution)
+
+        assert evaluated == ["respuesta de doc_a"]
+        assert execution.context["info_str"] == "- doc_a: respuesta de doc_a"
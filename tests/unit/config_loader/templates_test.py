@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from llama_index.core.prompts.utils import format_string
+
+from config_loader.templates import Template
+
+
+class TestTemplate:
+    def test_safe_mode_matches_format_string(self):
+        source = 'Consulta: {query}\nDevuelve {{"fecha": "DD/MM/AAAA"}} o {{"fecha": "None"}}. {otra}'
+        context = {"query": "¿Quién presidió la reunión?", "documents": []}
+
+        template = Template(source, "safe")
+
+        assert template.render(context) == format_string(source, **context)
+        assert template.variables == ["query", "otra"]
+
+    def test_format_mode_matches_str_format(self):
+        source = "- Documento {item.nombre_fichero}({item.fecha}): {scores[0]:>4} {{literal}}"
+        context = {"item": SimpleNamespace(nombre_fichero="ACTA 1.pdf", fecha="24/02/2025"), "scores": [7]}
+
+        template = Template(source, "format")
+
+        assert template.render(context) == source.format(**context)
+        assert template.variables == ["item", "scores"]
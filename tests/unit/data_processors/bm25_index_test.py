@@ -0,0 +1,49 @@
+from llama_index.core.schema import Document
+
+from data_processors.bm25_index import BM25Index
+
+
+def make_documents():
+    return [
+        Document(text="Se aprueba pintar la fachada del edificio.", metadata={"file_name": "ACTA 1.pdf"}),
+        Document(text="Se decide cerrar la piscina en invierno. La piscina necesita reparaciones.", metadata={"file_name": "ACTA 2.pdf"}),
+        Document(text="Se revisa el presupuesto de la piscina y del ascensor.", metadata={"file_name": "ACTA 3.pdf"}),
+        Document(text="Se discute la limpieza del portal.", metadata={"file_name": "ACTA 4.pdf"}),
+    ]
+
+
+class TestBM25Index:
+    def test_rank_by_relevance(self):
+        documents = make_documents()
+        index = BM25Index(documents)
+
+        ranked = index.rank("¿Qué se decidió sobre la PISCINA?")
+
+        assert [d.metadata["file_name"] for d, _ in ranked[:2]] == ["ACTA 2.pdf", "ACTA 3.pdf"]
+        assert ranked[-1][1] == 0.0
+
+    def test_prune_keeps_top_k_in_original_order(self):
+        documents = make_documents()
+        index = BM25Index(documents)
+
+        pruned = index.prune("presupuesto de la piscina", documents, 2)
+
+        assert [d.metadata["file_name"] for d in pruned] == ["ACTA 2.pdf", "ACTA 3.pdf"]
+        assert index.prune("presupuesto", documents[:2], 2) == documents[:2]
+
+    def test_prune_keeps_ties_and_unmatched_queries(self):
+        documents = make_documents() + [Document(text="Se revisa el presupuesto del jardín y del ascensor.", metadata={"file_name": "ACTA 5.pdf"})]
+        index = BM25Index(documents)
+
+        # ACTA 3 and ACTA 5 are tied in the first position
+        assert index.prune("ascensor", documents, 1) == [documents[2], documents[4]]
+        assert index.prune("terraza", documents, 2) == documents
+
+    def test_persisted_term_counts(self, tmp_path):
+        index_path = str(tmp_path / "bm25_index.json")
+        documents = make_documents()
+        BM25Index(documents, index_path)
+
+        index = BM25Index(make_documents(), index_path)
+
+        assert index.rank("fachada")[0][0].metadata["file_name"] == "ACTA 1.pdf"
@@ -0,0 +1,82 @@
+from llama_index.core.schema import Document
+
+from data_processors.chunk_index import ChunkIndex
+from data_processors.stored_document import Page, StoredDocument
+from utils.embedders import HashingEmbedder
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.embedded = 0
+
+    def _embed(self, texts):
+        self.embedded += len(texts)
+        return super()._embed(texts)
+
+
+def make_documents():
+    return [
+        Document(text="Se aprueba el presupuesto de la piscina.\n\nSe discute la limpieza del portal.", metadata={"file_name": "ACTA 1.pdf"}),
+        Document(text="Se acuerda pintar la fachada.\n\nSe revisa el ascensor averiado.", metadata={"file_name": "ACTA 2.pdf"}),
+    ]
+
+
+class TestChunkIndex:
+    def test_top_k_chunks_per_document(self):
+        index = ChunkIndex(HashingEmbedder(), chunk_size=16, chunk_overlap=0).build(make_documents())
+
+        retrieved = index.retrieve("presupuesto de la piscina", top_k=1)
+
+        assert list(retrieved) == ["ACTA 1.pdf", "ACTA 2.pdf"]
+        assert all(len(matches) == 1 for matches in retrieved.values())
+        assert "piscina" in retrieved["ACTA 1.pdf"][0].text
+
+    def test_search_ranks_all_chunks(self):
+        documents = make_documents()
+        index = ChunkIndex(HashingEmbedder(), chunk_size=16, chunk_overlap=0).build(documents)
+
+        matches = index.search("ascensor averiado", top_k=2)
+
+        assert len(matches) == 2
+        assert matches[0].file_name == "ACTA 2.pdf" and "ascensor" in matches[0].text
+        assert matches[0].score >= matches[1].score
+        assert index.search("ascensor averiado", top_k=2, documents=documents[:1])[0].file_name == "ACTA 1.pdf"
+
+    def test_persisted_vectors_are_reused(self, tmp_path):
+        index_path = str(tmp_path / "chunk_index.npz")
+        documents = make_documents()
+        ChunkIndex(CountingEmbedder(), chunk_size=16, chunk_overlap=0, file_path=index_path).build(documents)
+
+        documents[1] = Document(text="Se cambia la puerta del garaje.", metadata={"file_name": "ACTA 2.pdf"})
+        embedder = CountingEmbedder()
+        index = ChunkIndex(embedder, chunk_size=16, chunk_overlap=0, file_path=index_path).build(documents)
+
+        assert embedder.embedded == len(index.texts) - (index.ranges["ACTA 1.pdf"][1] - index.ranges["ACTA 1.pdf"][0])
+        assert index.search("garaje", top_k=1)[0].file_name == "ACTA 2.pdf"
+
+    def test_update_reuses_the_vectors(self):
+        documents = make_documents()
+        index = ChunkIndex(HashingEmbedder(), chunk_size=16, chunk_overlap=0).build(documents)
+        embedder = CountingEmbedder()
+        index.embedder = embedder
+
+        new_document = Document(text="Se cambia la puerta del garaje.", metadata={"file_name": "ACTA 3.pdf"})
+        updated = index.update(documents[1:] + [new_document])
+
+        assert embedder.embedded == 1
+        assert list(updated.ranges) == ["ACTA 2.pdf", "ACTA 3.pdf"]
+        assert list(index.ranges) == ["ACTA 1.pdf", "ACTA 2.pdf"]
+
+    def test_stored_documents_cite_their_pages(self, tmp_path):
+        texts_path = tmp_path / "acta.txt"
+        texts_path.write_text("Se aprueba el presupuesto.\nSe revisa el ascensor averiado.", encoding="utf-8")
+        pages = [Page(0, 26, "1"), Page(27, 58, "2")]
+        document = StoredDocument(str(texts_path), pages, "acta_hash", metadata={"file_name": "ACTA 1.pdf"})
+
+        index = ChunkIndex(HashingEmbedder(), chunk_size=16, chunk_overlap=0).build([document])
+        match = index.search("ascensor averiado", top_k=1)[0]
+
+        assert index.page_labels == ["1", "2"]
+        assert (match.page_label, match.text) == ("2", "Se revisa el ascensor averiado.")
+        assert ChunkIndex.format_matches([match]) == "<<<Fragmentos del documento ACTA 1.pdf:\n[Página 2] Se revisa el ascensor averiado.>>>"
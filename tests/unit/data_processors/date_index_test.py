@@ -0,0 +1,34 @@
+from data_processors.date_index import DateIndex
+
+
+def make_index():
+    return DateIndex({
+        "24/02/2025": {0},
+        "25/08/2025": {1},
+        "25/02/2026": {2},
+        "15/06/2025": {3, 4},
+        "24 de febrero": {5},
+    })
+
+
+class TestDateIndex:
+    def test_full_and_partial_dates(self):
+        index = make_index()
+
+        assert index.search("24/02/2025") == {0}
+        assert index.search("%/06/2025") == {3, 4}
+        assert index.search("%/%/2025") == {0, 1, 3, 4}
+        assert index.search("%/02/2024") == set()
+
+    def test_ranges(self):
+        index = make_index()
+
+        assert index.search("%/03/2025 - %/06/2025") == {3, 4}
+        assert index.search("01/02/2025 - 25/02/2026") == {0, 1, 2, 3, 4}
+
+    def test_non_periods_are_not_searched(self):
+        index = make_index()
+
+        assert index.search("24/%/2025") is None
+        assert index.search("None") is None
+        assert index.unparsed_values == {"24 de febrero": {5}}
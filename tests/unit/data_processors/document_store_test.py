@@ -0,0 +1,81 @@
+import os
+import shutil
+
+from data_processors.document_store import DocumentStore
+from data_processors.metadata_cache import MetadataCache
+from data_processors.static_data_processor import StaticDataProcessor
+from data_processors.stored_document import Page
+from llama_index.readers.file import PDFReader
+
+DATA_FOLDER_PATH = "data"
+
+
+def copy_pdfs(folder_path, file_names):
+    os.makedirs(folder_path, exist_ok=True)
+    for file_name in file_names:
+        shutil.copy(os.path.join(DATA_FOLDER_PATH, file_name), os.path.join(folder_path, file_name))
+
+
+class TestDocumentStore:
+    def test_same_documents_as_pdf_reader(self, tmp_path):
+        data_path = str(tmp_path / "data")
+        copy_pdfs(data_path, ["ACTA 1.pdf", "ACTA 2.pdf"])
+
+        result = DocumentStore(str(tmp_path / "store")).sync(data_path, max_workers=2)
+        expected = StaticDataProcessor.load_pdf_documents(data_path)
+
+        assert [(d.text, d.metadata) for d in result.documents] == [(d.text, d.metadata) for d in expected]
+        assert sorted(result.changed) == ["ACTA 1.pdf", "ACTA 2.pdf"]
+
+    def test_pages_are_read_from_disk(self, tmp_path):
+        data_path = str(tmp_path / "data")
+        copy_pdfs(data_path, ["ACTA 1.pdf"])
+
+        document = DocumentStore(str(tmp_path / "store")).sync(data_path).documents[0]
+        pages = list(document.iter_pages())
+        expected = PDFReader().load_data(file=os.path.join(data_path, "ACTA 1.pdf"))
+
+        assert document.text_resource is None
+        assert document.page_count == len(expected)
+        assert [(p.text, p.metadata["page_label"]) for p in pages] == [(p.text, p.metadata["page_label"]) for p in expected]
+        assert [p.metadata["page_number"] for p in pages] == list(range(1, len(expected) + 1))
+        assert all(p.metadata["file_name"] == "ACTA 1.pdf" for p in pages)
+
+    def test_only_changes_are_parsed(self, tmp_path, monkeypatch):
+        data_path = str(tmp_path / "data")
+        store_path = str(tmp_path / "store")
+        copy_pdfs(data_path, ["ACTA 1.pdf", "ACTA 2.pdf"])
+        first_texts = {d.metadata["file_name"]: d.text for d in DocumentStore(store_path).sync(data_path).documents}
+
+        parsed = []
+        def parse(self, file_paths, texts_paths, max_workers):
+            parsed.extend(file_paths)
+            for texts_path in texts_paths:
+                with open(texts_path, "w", encoding="utf-8") as file:
+                    file.write("nuevo")
+            return [[Page(0, 5, "1")] for _ in file_paths]
+
+        monkeypatch.setattr(DocumentStore, "_parse", parse)
+        os.remove(os.path.join(data_path, "ACTA 2.pdf"))
+        copy_pdfs(data_path, ["ACTA 3.pdf"])
+        result = DocumentStore(store_path).sync(data_path)
+
+        assert [os.path.basename(p) for p in parsed] == ["ACTA 3.pdf"]
+        assert result.changed == ["ACTA 3.pdf"]
+        assert result.removed == ["ACTA 2.pdf"]
+        texts = {d.metadata["file_name"]: d.text for d in result.documents}
+        assert texts == {"ACTA 1.pdf": first_texts["ACTA 1.pdf"], "ACTA 3.pdf": "nuevo"}
+
+    def test_metadata_cache_uses_the_manifest_hash(self, tmp_path, monkeypatch):
+        data_path = str(tmp_path / "data")
+        copy_pdfs(data_path, ["ACTA 1.pdf"])
+        document = DocumentStore(str(tmp_path / "store")).sync(data_path).documents[0]
+        file_hash = DocumentStore.compute_file_hash(os.path.join(data_path, "ACTA 1.pdf"))
+
+        def compute_file_hash(file_path):
+            raise AssertionError(f"{file_path} was hashed again")
+
+        monkeypatch.setattr(DocumentStore, "compute_file_hash", compute_file_hash)
+
+        assert document.file_hash == file_hash
+        assert MetadataCache.compute_document_hash(document, data_path) == file_hash
@@ -0,0 +1,60 @@
+import os
+import shutil
+
+from data_processors.document_store import DocumentStore
+from data_processors.document_watcher import DocumentWatcher
+
+DATA_FOLDER_PATH = "data"
+
+
+def copy_pdf(folder_path, file_name, target_name=None):
+    os.makedirs(folder_path, exist_ok=True)
+    shutil.copy(os.path.join(DATA_FOLDER_PATH, file_name), os.path.join(folder_path, target_name or file_name))
+
+
+def make_watcher(tmp_path, extracted):
+    data_path = str(tmp_path / "data")
+    store_path = str(tmp_path / "store")
+    copy_pdf(data_path, "ACTA 1.pdf")
+    copy_pdf(data_path, "ACTA 2.pdf")
+
+    def extract_metadata(documents):
+        extracted.extend(d.metadata["file_name"] for d in documents)
+        for d in documents:
+            d.metadata["fecha"] = "01/01/2025"
+
+    documents = DocumentStore(store_path).load_pdf_documents(data_path)
+    extract_metadata(documents)
+    return data_path, DocumentWatcher(data_path, DocumentStore(store_path), documents, extract_metadata)
+
+
+class TestDocumentWatcher:
+    def test_no_changes(self, tmp_path):
+        extracted = []
+        _, watcher = make_watcher(tmp_path, extracted)
+        documents = watcher.documents
+
+        assert watcher.poll() is False
+        assert watcher.documents is documents
+
+    def test_added_modified_and_removed_files(self, tmp_path):
+        extracted = []
+        data_path, watcher = make_watcher(tmp_path, extracted)
+        previous_documents = watcher.documents
+        unchanged = next(d for d in previous_documents if d.metadata["file_name"] == "ACTA 1.pdf")
+        updates = []
+        watcher.add_listener(updates.append)
+
+        extracted.clear()
+        copy_pdf(data_path, "ACTA 3.pdf")
+        copy_pdf(data_path, "ACTA 5.pdf", "ACTA 2.pdf")
+        os.remove(os.path.join(data_path, "ACTA 1.pdf"))
+        copy_pdf(data_path, "ACTA 6.pdf")
+
+        assert watcher.poll() is True
+        assert sorted(extracted) == ["ACTA 2.pdf", "ACTA 3.pdf", "ACTA 6.pdf"]
+        assert sorted(d.metadata["file_name"] for d in watcher.documents) == ["ACTA 2.pdf", "ACTA 3.pdf", "ACTA 6.pdf"]
+        assert all(d.metadata["fecha"] == "01/01/2025" for d in watcher.documents)
+        assert unchanged not in watcher.documents and len(previous_documents) == 2
+        assert updates == [watcher.documents]
+        assert watcher.poll() is False
@@ -0,0 +1,33 @@
+from data_processors.metadata_cache import MetadataCache
+from llama_index.core.vector_stores.types import MetadataInfo
+
+
+class TestMetadataCache:
+    def test_get_after_save(self, tmp_path):
+        cache_path = str(tmp_path / "metadata_cache.json")
+        fecha = MetadataInfo(name="fecha", type="str", description="Fecha de la reunión")
+
+        cache = MetadataCache(cache_path)
+        assert cache.get("doc_hash", fecha, "llama3.2") == (False, None)
+        cache.set("doc_hash", fecha, "llama3.2", "24/02/2025")
+        cache.save()
+
+        reloaded_cache = MetadataCache(cache_path)
+        assert reloaded_cache.get("doc_hash", fecha, "llama3.2") == (True, "24/02/2025")
+        assert reloaded_cache.get_stats()["hits"] == 1
+
+    def test_description_change_invalidates_only_that_field(self, tmp_path):
+        cache_path = str(tmp_path / "metadata_cache.json")
+        fecha = MetadataInfo(name="fecha", type="str", description="Fecha de la reunión")
+        presidente = MetadataInfo(name="presidente", type="str", description="Presidente")
+
+        cache = MetadataCache(cache_path)
+        cache.set("doc_hash", fecha, "llama3.2", "24/02/2025")
+        cache.set("doc_hash", presidente, "llama3.2", "Juan Pérez Gutiérrez")
+        cache.save()
+
+        changed_fecha = MetadataInfo(name="fecha", type="str", description="Fecha en formato DD/MM/AAAA")
+        reloaded_cache = MetadataCache(cache_path)
+        assert reloaded_cache.get("doc_hash", changed_fecha, "llama3.2") == (False, None)
+        assert reloaded_cache.get("doc_hash", presidente, "llama3.2") == (True, "Juan Pérez Gutiérrez")
+        assert reloaded_cache.get("doc_hash", presidente, "qwen3:4b") == (False, None)
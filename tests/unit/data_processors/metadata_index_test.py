@@ -0,0 +1,53 @@
+from llama_index.core.schema import Document
+
+from data_processors.metadata_index import MetadataIndex
+
+
+def make_documents():
+    return [
+        Document(text="", metadata={"file_name": "ACTA 1.pdf", "fecha": "24/02/2025", "lista_asistentes": ["Juan Pérez Gutiérrez", "Marta González Ramírez"]}),
+        Document(text="", metadata={"file_name": "ACTA 2.pdf", "fecha": "25/08/2025", "lista_asistentes": ["Luis Ramírez Ortega"]}),
+        Document(text="", metadata={"file_name": "ACTA 3.pdf", "fecha": "25/02/2026"}),
+    ]
+
+
+class TestMetadataIndex:
+    def test_filter_by_name_and_date(self):
+        documents = make_documents()
+        index = MetadataIndex(documents)
+
+        filtered, unmatched_values, discarded = index.filter({"lista_asistentes": "Juan Pérez", "fecha": "%/02/2025"})
+
+        assert filtered == [documents[0]]
+        assert unmatched_values == []
+        assert discarded == documents[1:]
+
+    def test_partial_tokens_and_unmatched_values(self):
+        documents = make_documents()
+        index = MetadataIndex(documents)
+
+        assert index.match("lista_asistentes", "Ramír") == {0, 1}
+
+        filtered, unmatched_values, _ = index.filter({"lista_asistentes": "Pedro Gómez"})
+        assert filtered == []
+        assert unmatched_values == ["Pedro Gómez"]
+
+    def test_value_inside_a_longer_word(self):
+        documents = [
+            Document(text="", metadata={"file_name": "ACTA 1.pdf", "tema": "Presupuesto 2024", "lista_asistentes": ["Juan Pérez"]}),
+            Document(text="", metadata={"file_name": "ACTA 2.pdf", "tema": "Presupuestos generales", "lista_asistentes": ["Juana López"]}),
+        ]
+        index = MetadataIndex(documents)
+
+        assert index.match("tema", "Presupuesto") == {0, 1}
+        assert index.match("lista_asistentes", "Juan") == {0, 1}
+        assert index.match("tema", "Pr") == {0, 1}
+        assert index.match("tema", "2025") == set()
+
+    def test_match_missing_keeps_documents_without_the_field(self):
+        documents = make_documents()
+        index = MetadataIndex(documents)
+
+        filtered, _, _ = index.filter({"lista_asistentes": "Luis Ramírez"}, match_missing=True)
+
+        assert filtered == [documents[1], documents[2]]
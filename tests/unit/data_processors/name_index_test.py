@@ -0,0 +1,32 @@
+from llama_index.core.schema import Document
+
+from data_processors.name_index import NameIndex
+
+
+def make_index():
+    return NameIndex([
+        Document(text="", metadata={"file_name": "ACTA 1.pdf", "lista_asistentes": ["Juan Pérez Gutiérrez", "Ángel Núñez"], "presidente": "Juan Pérez Gutiérrez"}),
+        Document(text="", metadata={"file_name": "ACTA 2.pdf", "lista_asistentes": ["Juan López Martín", "Marta González Ramírez"], "secretario": "Marta González Ramírez"}),
+    ])
+
+
+class TestNameIndex:
+    def test_accents_case_and_missing_surname(self):
+        index = make_index()
+
+        matches = index.search("juan perez")
+
+        assert matches[0].name == "Juan Pérez Gutiérrez"
+        assert matches[0].positions == {0}
+        assert index.resolve("ANGEL NUNEZ") == "Ángel Núñez"
+
+    def test_typos_are_tolerated(self):
+        index = make_index()
+
+        assert index.resolve("Marta Gonzales") == "Marta González Ramírez"
+
+    def test_ambiguous_or_unknown_names_are_not_resolved(self):
+        index = make_index()
+
+        assert index.resolve("Juan") is None
+        assert index.resolve("Pedro Sánchez") is None
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import threading
+import time
+
+from executions.workflow_executions import BatchRunner, EvaluationRunner
+
+
+class TestEvaluationRunner:
+    def test_run_returns_responses_in_question_order(self):
+        def process_question(question):
+            # The first questions take longer, so they finish last
+            time.sleep(0.05 * (3 - int(question)))
+            return f"respuesta {question}"
+
+        responses = EvaluationRunner(max_workers=3).run(["0", "1", "2"], process_question)
+
+        assert responses == ["respuesta 0", "respuesta 1", "respuesta 2"]
+
+    def test_arun_limits_questions_in_flight(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def process_question(question):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return f"respuesta {question}"
+
+        responses = asyncio.run(EvaluationRunner(max_workers=2).arun(["0", "1", "2", "3"], process_question))
+
+        assert responses == ["respuesta 0", "respuesta 1", "respuesta 2", "respuesta 3"]
+        assert max_in_flight == 2
+
+
+def read_answers(answers_path):
+    with open(answers_path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+class TestBatchRunner:
+    def test_answers_are_appended_and_failures_resumed(self, tmp_path):
+        questions_path = tmp_path / "preguntas.jsonl"
+        questions_path.write_text('{"query": "uno", "id": "a"}\n\n{"query": "dos"}\n{"id": "sin consulta"}\n{"query": "tres"}\n', encoding="utf-8")
+        answers_path = str(tmp_path / "respuestas" / "respuestas.jsonl")
+        asked = []
+
+        def process_question(question):
+            asked.append(question)
+            if question == "dos" and asked.count("dos") == 1:
+                raise RuntimeError("timeout")
+            return question.upper()
+
+        stats = BatchRunner(max_workers=2).run(str(questions_path), answers_path, process_question)
+        # A crash while writing leaves a cut line
+        with open(answers_path, "a", encoding="utf-8") as file:
+            file.write('{"line": 9, "qu')
+        resumed_stats = BatchRunner(max_workers=2).run(str(questions_path), answers_path, process_question)
+
+        assert stats == {"answered": 2, "failed": 1, "skipped": 0}
+        assert resumed_stats == {"answered": 1, "failed": 0, "skipped": 2}
+        assert sorted(asked) == ["dos", "dos", "tres", "uno"]
+        with open(answers_path, "r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file if line != '{"line": 9, "qu\n']
+        answers = {r["line"]: r["response"] for r in records if "response" in r}
+        assert answers == {1: "UNO", 3: "DOS", 5: "TRES"}
+        assert [r["id"] for r in records if r["line"] == 1] == ["a"]
+
+    def test_questions_are_read_as_needed(self, tmp_path):
+        questions_path = tmp_path / "preguntas.txt"
+        questions_path.write_text("\n".join(str(i) for i in range(6)), encoding="utf-8")
+        in_flight = 0
+        max_in_flight = 0
+        lock = threading.Lock()
+
+        def process_question(question):
+            nonlocal in_flight, max_in_flight
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight -= 1
+            return question
+
+        stats = BatchRunner(max_workers=2).run(str(questions_path), str(tmp_path / "respuestas.jsonl"), process_question)
+
+        assert stats == {"answered": 6, "failed": 0, "skipped": 0}
+        assert max_in_flight <= 2
+        assert sorted(r["line"] for r in read_answers(str(tmp_path / "respuestas.jsonl"))) == [1, 2, 3, 4, 5, 6]
@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from llama_index.core.schema import Document
+
+from config_loader.models import LLMCallStepModel, MetadataConfig, SetVariableStepModel
+from new_workflow import DocumentsBasedQAFlowExecutor
+
+
+class FakeLLM:
+    """Answers "respuesta a <prompt>". Each call waits at `barrier`, if any, and the prompt "lenta" waits for `release`."""
+    model = "fake"
+
+    def __init__(self, barrier: threading.Barrier = None):
+        self.barrier = barrier
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def complete(self, prompt, **kwargs):
+        if self.barrier is not None:
+            self.barrier.wait(5)
+        if prompt == "lenta":
+            self.started.set()
+            assert self.release.wait(5)
+        return SimpleNamespace(text=f"respuesta a {prompt}")
+
+
+def make_executor(llm, documents):
+    metadata_config = MetadataConfig(data_description="actas", fields_info=[])
+    workflow = [
+        LLMCallStepModel(step_type="llm_call", id="answer", prompt="{query}", output="response"),
+        SetVariableStepModel(step_type="set_variable", id="final", source="response + ' (' + str(len(documents)) + ' documentos)'", output="final_response"),
+    ]
+    return DocumentsBasedQAFlowExecutor(llm, llm, metadata_config, documents, workflow)
+
+
+def make_documents(count):
+    return [Document(text=f"Acta {i}", metadata={"file_name": f"ACTA {i}.pdf"}) for i in range(1, count + 1)]
+
+
+class TestDocumentsBasedQAFlowExecutor:
+    def test_concurrent_runs_have_their_own_context(self):
+        # Both runs are in the middle of their LLM call at the same time
+        llm = FakeLLM(threading.Barrier(2))
+        executor = make_executor(llm, make_documents(2))
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(executor.run, query) for query in ["¿Quién preside?", "¿Cuándo fue la reunión?"]]
+            responses = [future.result(timeout=10) for future in futures]
+
+        assert responses == [
+            "respuesta a ¿Quién preside? (2 documentos)",
+            "respuesta a ¿Cuándo fue la reunión? (2 documentos)",
+        ]
+        assert not hasattr(executor, "global_context") and not hasattr(executor, "step_results")
+
+    def test_update_documents_does_not_affect_a_run_in_progress(self):
+        llm = FakeLLM()
+        executor = make_executor(llm, make_documents(2))
+        previous_workflow = executor.compiled_workflow
+        previous_workflow_runs = []
+        run = previous_workflow.run
+        previous_workflow.run = lambda execution: previous_workflow_runs.append(execution.context["query"]) or run(execution)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            slow = pool.submit(executor.run, "lenta")
+            assert llm.started.wait(5)
+            executor.update_documents(make_documents(3))
+            llm.release.set()
+            assert slow.result(timeout=10) == "respuesta a lenta (2 documentos)"
+
+        assert executor.compiled_workflow is not previous_workflow
+        assert executor.run("rápida") == "respuesta a rápida (3 documentos)"
+        assert previous_workflow_runs == ["lenta"]
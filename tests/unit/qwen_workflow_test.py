@@ -0,0 +1,68 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+from llama_index.core.schema import Document
+
+from config_loader.models import StructuredOutputConfig
+from qwen_workflow import QwenDocumentsBasedQAFlow
+
+
+class FakeJSONLLM:
+    """Answers the evidence and evaluation prompts of each document, recording how many calls are in flight."""
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.evidence_calls = {}
+        self.evaluation_calls = {}
+
+    async def acomplete(self, prompt, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            file_name = next(name for name in ["ACTA 1.pdf", "ACTA 2.pdf", "ACTA 3.pdf", "ACTA 4.pdf"] if name in prompt)
+            # The first documents take longer, so they finish last
+            await asyncio.sleep(0.01 * (5 - int(file_name[5])))
+            if '"evaluation"' in prompt:
+                calls = self.evaluation_calls[file_name] = self.evaluation_calls.get(file_name, 0) + 1
+                # The first evidence of ACTA 2 is considered invented
+                evaluation = "Inventada" if file_name == "ACTA 2.pdf" and calls == 1 else "Explícita"
+                return json.dumps({"evaluation": evaluation, "justification": ""})
+
+            calls = self.evidence_calls[file_name] = self.evidence_calls.get(file_name, 0) + 1
+            if file_name == "ACTA 3.pdf":
+                return "not a json"
+            return json.dumps({"respuesta": f"respuesta {calls} de {file_name}", "evidencia": "cita"})
+        finally:
+            self.in_flight -= 1
+
+
+def make_flow(llm_json_output, max_concurrency):
+    llm = MagicMock()
+    llm.model = "fake"
+    llm_json_output.model = "fake"
+    config = StructuredOutputConfig(max_attempts=1, initial_backoff=0.0)
+    return QwenDocumentsBasedQAFlow(llm, llm_json_output, config, max_concurrency=max_concurrency)
+
+
+class TestQwenDocumentsBasedQAFlow:
+    def test_evidences_are_bounded_ordered_and_verified(self):
+        documents = [Document(text="", metadata={"file_name": f"ACTA {i}.pdf", "fecha": f"2{i}/02/2025"}) for i in range(1, 5)]
+        llm_json_output = FakeJSONLLM()
+        flow = make_flow(llm_json_output, max_concurrency=2)
+
+        evidences = asyncio.run(flow.aget_evidences(documents, "¿Asistió Juan Pérez?"))
+
+        assert llm_json_output.max_in_flight == 2
+        assert [document for document, _ in evidences] == documents
+        assert [response for _, response in evidences] == [
+            "respuesta 1 de ACTA 1.pdf (Evidencia textual: cita)",
+            # Asked again after the invented one
+            "respuesta 2 de ACTA 2.pdf (Evidencia textual: cita)",
+            "No se ha podido obtener información de este documento.",
+            "respuesta 1 de ACTA 4.pdf (Evidencia textual: cita)",
+        ]
+        assert llm_json_output.evidence_calls["ACTA 2.pdf"] == 2
+        # Every evidence of ACTA 3 failed: it is asked again 5 times and never evaluated
+        assert llm_json_output.evidence_calls["ACTA 3.pdf"] == 6
+        assert "ACTA 3.pdf" not in llm_json_output.evaluation_calls
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from config_loader.models import ServerConfig
+from services.query_api import QueryAPI
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.documents = ["ACTA 1.pdf", "ACTA 2.pdf"]
+        self.release = threading.Event()
+        self.deadlines = []
+
+    def run(self, query, deadline=None):
+        self.deadlines.append(deadline)
+        if query == "lenta":
+            self.release.wait(5)
+        return f"Respuesta a: {query}"
+
+    def get_structured_output_stats(self):
+        return {}
+
+    def get_completion_cache_stats(self):
+        return None
+
+
+def run_with_client(api, test):
+    async def run():
+        async with TestClient(TestServer(api.create_app())) as client:
+            await test(client)
+    asyncio.run(run())
+
+
+class TestQueryAPI:
+    def test_query_health_and_metrics(self):
+        executor = FakeExecutor()
+        api = QueryAPI(executor)
+
+        async def test(client):
+            start = time.monotonic()
+            response = await client.post("/query", json={"query": "¿Quién es el presidente?", "timeout": 10})
+            assert response.status == 200
+            # The run stops at the timeout of the request
+            assert start < executor.deadlines[0] <= time.monotonic() + 10
+            assert (await response.json())["response"] == "Respuesta a: ¿Quién es el presidente?"
+
+            assert (await client.post("/query", json={"pregunta": "x"})).status == 400
+            assert (await client.get("/health")).status == 200
+            metrics = await (await client.get("/metrics")).json()
+            assert metrics["requests"] == 2
+            assert metrics["responses"] == {"200": 1, "400": 1}
+
+        run_with_client(api, test)
+
+    def test_full_queue_answers_429_and_slow_queries_time_out(self):
+        executor = FakeExecutor()
+        api = QueryAPI(executor, ServerConfig(max_concurrency=1, max_queue_size=1))
+
+        async def test(client):
+            slow = [asyncio.create_task(client.post("/query", json={"query": "lenta", "timeout": 0.2})) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            assert (await client.post("/query", json={"query": "rápida"})).status == 429
+
+            assert [response.status for response in await asyncio.gather(*slow)] == [504, 504]
+            # The queued query was cancelled, but the running one keeps its slot until it really ends
+            metrics = await (await client.get("/metrics")).json()
+            assert (metrics["running"], metrics["queued"]) == (1, 0)
+            executor.release.set()
+            await asyncio.sleep(0.05)
+            assert (await client.post("/query", json={"query": "rápida"})).status == 200
+
+        run_with_client(api, test)
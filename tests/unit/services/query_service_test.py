@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.query_service import QueryService
+
+
+class TestQueryService:
+    def test_queries_from_several_threads_run_concurrently(self):
+        running = []
+        max_running = []
+
+        async def run_query(query, on_delta):
+            running.append(query)
+            max_running.append(len(running))
+            await asyncio.sleep(0.05)
+            for word in query.split():
+                on_delta(word)
+            running.remove(query)
+            return query.upper()
+
+        service = QueryService(run_query, max_concurrency=2)
+        service.start()
+        try:
+            deltas = {}
+            futures = {}
+            def submit(query):
+                deltas[query] = []
+                futures[query] = service.submit(query, deltas[query].append)
+
+            threads = [threading.Thread(target=submit, args=(f"consulta {i}",)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert {query: future.result(timeout=5) for query, future in futures.items()} == {f"consulta {i}": f"CONSULTA {i}" for i in range(4)}
+            assert deltas["consulta 3"] == ["consulta", "3"]
+            assert max(max_running) == 2
+        finally:
+            service.stop()
+
+    def test_submit_needs_a_running_service(self):
+        async def run_query(query, on_delta):
+            return query
+
+        service = QueryService(run_query)
+        with pytest.raises(RuntimeError):
+            service.submit("consulta")
+
+        service.start()
+        service.stop()
+        with pytest.raises(RuntimeError):
+            service.submit("consulta")
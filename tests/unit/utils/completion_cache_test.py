@@ -0,0 +1,27 @@
+from unittest.mock import MagicMock
+
+from utils.completion_cache import LRUCompletionCache, SQLiteCompletionCache
+
+
+class TestCompletionCache:
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCompletionCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+        assert cache.get("c") == "3"
+        assert cache.get_stats()["hits"] == 3
+
+    def test_sqlite_persists_between_instances(self, tmp_path):
+        cache_path = str(tmp_path / "completions.sqlite")
+        llm = MagicMock(model="qwen3:4b", temperature=0.0, json_mode=True)
+        key = SQLiteCompletionCache.make_key(llm, "prompt")
+
+        SQLiteCompletionCache(cache_path).set(key, '{"fecha": "24/02/2025"}')
+
+        assert SQLiteCompletionCache(cache_path).get(key) == '{"fecha": "24/02/2025"}'
+        assert key != SQLiteCompletionCache.make_key(llm, "prompt", format="json")
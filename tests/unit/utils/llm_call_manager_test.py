@@ -1,11 +1,80 @@
 
 
+import asyncio
+import json
+
+from llama_index.core.schema import Document
+from llama_index.core.vector_stores.types import MetadataInfo, VectorStoreInfo
+
+from data_processors.metadata_cache import MetadataCache
 from utils.llm_call_manager import LLMCallManager
 
 
+class FakeAsyncLLM:
+    """Answers the field prompts of the metadata extraction, recording how many calls are in flight."""
+    model = "fake"
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.prompts = []
+
+    async def acomplete(self, prompt, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.prompts.append(prompt)
+        try:
+            field_name = "fecha" if "'fecha'" in prompt else "presidente"
+            # The second field finishes first, so the merge cannot rely on the order of the responses
+            await asyncio.sleep(0.02 if field_name == "fecha" else 0.01)
+            document = prompt.rsplit("Contexto:", 1)[1].strip()
+            return json.dumps({field_name: f"{field_name} de {document}"})
+        finally:
+            self.in_flight -= 1
+
+
 class TestLLMCallManager:
     def test_singleton(self):
         manager1 = LLMCallManager()
         manager2 = LLMCallManager()
 
         assert id(manager1) == id(manager2)
+
+    def test_get_valid_fields_discards_invalid_types(self):
+        metadata_infos = [
+            MetadataInfo(name="fecha", type="str", description="Fecha"),
+            MetadataInfo(name="num_asistentes", type="int", description="Número de asistentes"),
+            MetadataInfo(name="lista_asistentes", type="list", description="Asistentes"),
+        ]
+        partial_result = {"fecha": "24/02/2025", "num_asistentes": "20", "lista_asistentes": "Juan, Marta"}
+
+        result = LLMCallManager.get_valid_fields(metadata_infos, partial_result)
+
+        assert result == {"fecha": "24/02/2025", "num_asistentes": 20}
+
+    def test_get_valid_fields_without_data(self):
+        metadata_infos = [MetadataInfo(name="fecha", type="str", description="Fecha")]
+
+        assert LLMCallManager.get_valid_fields(metadata_infos, None) == {}
+
+    def test_documents_metadata_is_bounded_merged_in_field_order_and_cached(self, tmp_path):
+        fecha = MetadataInfo(name="fecha", type="str", description="Fecha")
+        presidente = MetadataInfo(name="presidente", type="str", description="Presidente")
+        vector_store_info = VectorStoreInfo(content_info="actas", metadata_info=[fecha, presidente])
+        documents = [Document(text=f"acta {i}", metadata={"file_name": f"ACTA {i}.pdf"}) for i in range(1, 4)]
+        metadata_cache = MetadataCache(str(tmp_path / "metadata_cache.json"))
+        document_hash = MetadataCache.compute_document_hash(documents[0], str(tmp_path))
+        metadata_cache.set(document_hash, fecha, "fake", "fecha cacheada")
+        llm = FakeAsyncLLM()
+
+        asyncio.run(LLMCallManager.aget_documents_all_metadata_by_custom_llm(llm, vector_store_info, documents, str(tmp_path), metadata_cache, max_concurrency=2))
+
+        assert llm.max_in_flight == 2
+        # The cached field is not asked
+        assert len(llm.prompts) == 5
+        assert [list(d.metadata.items()) for d in documents] == [
+            [("file_name", "ACTA 1.pdf"), ("fecha", "fecha cacheada"), ("presidente", "presidente de acta 1")],
+            [("file_name", "ACTA 2.pdf"), ("fecha", "fecha de acta 2"), ("presidente", "presidente de acta 2")],
+            [("file_name", "ACTA 3.pdf"), ("fecha", "fecha de acta 3"), ("presidente", "presidente de acta 3")],
+        ]
+        assert metadata_cache.get_stats()["hits"] == 1
@@ -0,0 +1,42 @@
+from unittest.mock import MagicMock
+
+from config_loader.models import StructuredOutputConfig
+from utils.completion_cache import CompletionCache, LRUCompletionCache
+from utils.structured_output_caller import StructuredOutputCaller, StructuredOutputFailure
+
+
+class TestStructuredOutputCaller:
+    def test_retries_until_valid_json(self):
+        llm = MagicMock()
+        llm.complete.side_effect = ["not a json", '{"otra": 1}', '{"fecha": "24/02/2025"}']
+        config = StructuredOutputConfig(max_attempts=5, initial_backoff=0.0)
+
+        caller = StructuredOutputCaller(llm, config)
+        result = caller.call("prompt", ["fecha"], label="extract_date")
+
+        assert result == {"fecha": "24/02/2025"}
+        assert caller.get_stats()["extract_date"] == {"calls": 1, "attempts": 3, "retries": 2, "failures": 0}
+
+    def test_returns_failure_when_attempts_are_exhausted(self):
+        llm = MagicMock()
+        llm.complete.return_value = "not a json"
+        config = StructuredOutputConfig(max_attempts=3, initial_backoff=0.0)
+
+        caller = StructuredOutputCaller(llm, config)
+        result = caller.call("prompt", ["fecha"], label="extract_date")
+
+        assert isinstance(result, StructuredOutputFailure)
+        assert not result
+        assert result.attempts == 3
+        assert llm.complete.call_count == 3
+        assert caller.get_stats()["extract_date"]["failures"] == 1
+
+    def test_refresh_replaces_the_cached_output(self):
+        llm = MagicMock()
+        llm.complete.side_effect = ['{"fecha": "24/02/2025"}', '{"fecha": "25/02/2025"}']
+        caller = StructuredOutputCaller(llm, StructuredOutputConfig(), completion_cache=LRUCompletionCache())
+
+        assert caller.call("prompt", ["fecha"], use_cache=True) == {"fecha": "24/02/2025"}
+        assert caller.call("prompt", ["fecha"], use_cache=CompletionCache.REFRESH) == {"fecha": "25/02/2025"}
+        assert caller.call("prompt", ["fecha"], use_cache=True) == {"fecha": "25/02/2025"}
+        assert llm.complete.call_count == 2
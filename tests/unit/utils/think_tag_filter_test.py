@@ -0,0 +1,46 @@
+import re
+
+from config_loader.models import LLMConfig
+from utils.llm_call_manager import LLMCallManager
+from utils.llm_manager import LLMManager
+from utils.think_tag_filter import ThinkTagFilter
+
+
+def filter_chunks(chunks):
+    think_filter = ThinkTagFilter()
+    texts = [think_filter.feed(chunk) for chunk in chunks] + [think_filter.flush()]
+    return texts
+
+
+class TestThinkTagFilter:
+    def test_same_text_as_complete_response(self):
+        response = "<think>\nLa consulta pide la fecha.\n</think>\n\nLa reunión fue el <b>24/02/2025</b>.\n"
+        expected = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL).strip("\n")
+
+        for size in [1, 2, 3, 7, len(response)]:
+            chunks = [response[i:i + size] for i in range(0, len(response), size)]
+            assert "".join(filter_chunks(chunks)) == expected
+
+    def test_visible_text_is_not_held_back(self):
+        texts = filter_chunks(["<thi", "nk>razonamiento</th", "ink>Hola", " mundo <", "b>"])
+
+        assert texts == ["", "", "Hola", " mundo ", "<b>", ""]
+
+    def test_process_stream_response_of_models_without_thinking(self):
+        chunks = ["<think>", "x", "</think>", ""]
+
+        assert list(LLMCallManager.process_stream_response("llama3.2", chunks)) == ["<think>", "x", "</think>"]
+
+    def test_reasoning_is_counted(self):
+        think_filter = ThinkTagFilter()
+
+        assert think_filter.filter("<think>abc</think>Hola<think>de") == "Hola"
+        assert (think_filter.reasoning_length, think_filter.visible_length) == (5, 4)
+
+    def test_thinking_is_enabled_per_model(self):
+        LLMManager.create_llm_by_config(LLMConfig(model_name="deepseek-r1-test", thinking=True))
+        LLMManager.create_llm_by_config(LLMConfig(model_name="qwen3-test", thinking=False))
+
+        assert LLMCallManager.process_complete_response("deepseek-r1-test", "<think>x</think>\nHola") == "Hola"
+        assert LLMCallManager.process_complete_response("qwen3-test", "<think>x</think>Hola") == "<think>x</think>Hola"
+        assert LLMCallManager.get_reasoning_stats()["deepseek-r1-test"] == {"responses": 1, "reasoning_chars": 1, "visible_chars": 4}